@@ -0,0 +1,19 @@
+from backends.base import InferenceBackend
+
+BACKENDS = ("hf", "synthetic")
+
+
+def make_backend(name: str, **kwargs) -> InferenceBackend:
+    """
+    hf: HFBackend(model, tokenizer, ...), on whatever device the model is on
+    synthetic: SyntheticBackend(latency, vocab_size, ...), no model or torch needed
+    Implementations are imported on first use so the synthetic backend never
+    pulls in torch/transformers.
+    """
+    if name == "hf":
+        from backends.hf import HFBackend
+        return HFBackend(**kwargs)
+    if name == "synthetic":
+        from backends.synthetic import SyntheticBackend
+        return SyntheticBackend(**kwargs)
+    raise ValueError(f"Unknown inference backend {name!r}, expected one of {sorted(BACKENDS)}")
@@ -0,0 +1,117 @@
+# backends/base.py
+from typing import List, Optional, Tuple
+
+from sampling import SamplingParams
+
+
+class InferenceBackend:
+    """
+    The model-facing half of the batching loops: tokenize, prefill, decode
+    step, detokenize. Everything above it (queues, continuous batching,
+    caches, workers, load balancing, admission) only talks to this interface,
+    so it can be driven by a real model (backends.hf.HFBackend, CPU or CUDA)
+    or by a synthetic one (backends.synthetic.SyntheticBackend) when load
+    testing the control plane.
+
+    A backend is shared by every worker and holds no per-batch state: each
+    scheduler keeps its running batch (KV cache, next tokens, ...) in the
+    object returned by new_batch() and passes it back on every call.
+    Rows of a batch are identified by position; prefill() appends rows,
+    retire() keeps a subset of them in order.
+
+    All methods except tokenize/detokenize are blocking and meant to run on
+    the inference thread.
+    """
+
+    # Anything with decode(ids, skip_special_tokens=...) works for streaming
+    # (serving.streaming.IncrementalDetokenizer)
+    tokenizer = None
+    eos_token_id: int = 0
+
+    def tokenize(self, prompts: List[str]) -> List[List[int]]:
+        return self.tokenizer(prompts)["input_ids"]
+
+    def detokenize(self, sequences: List[List[int]]) -> List[str]:
+        texts = self.tokenizer.batch_decode(sequences, skip_special_tokens=True)
+        return [t.lstrip("\n ").rstrip() for t in texts]
+
+    def new_batch(self, prefix_cache=None):
+        """
+        Empty running batch; prefix_cache (prefix_cache.PrefixCache) is used by
+        backends that can reuse KV for shared prompt prefixes.
+        """
+        raise NotImplementedError
+
+    def prefill(
+        self, batch, token_ids: List[List[int]], params: Optional[List[SamplingParams]] = None
+    ) -> List[Tuple[int, int]]:
+        """
+        Add the prompts to the batch and sample their first tokens.
+        params: each prompt's sampling parameters (sampling.DEFAULT_SAMPLING if None);
+        they stay with the row for every later decode step.
+        Returns (index into token_ids, first token) in the order the new rows
+        were appended, which need not be the input order.
+        """
+        raise NotImplementedError
+
+    def decode_step(self, batch) -> List[List[int]]:
+        """
+        Advance every row; returns the new tokens of each row (one, or several
+        with speculative decoding). Tokens past a row's EOS or budget are the
+        caller's to discard.
+        """
+        raise NotImplementedError
+
+    def retire(self, batch, keep: List[int]):
+        """
+        Drop every row not listed in keep (ascending row indices).
+        """
+        raise NotImplementedError
+
+    def kv_bytes(self, lengths: List[int]) -> int:
+        """
+        Estimated KV cache bytes of a batch whose rows hold this many tokens
+        each, in the backend's own layout (e.g. padding to a common length).
+        0 means the backend can't tell, and the scheduler's KV budget is not enforced.
+        """
+        return 0
+
+    # Whether swap_out/swap_in are implemented (otherwise preemption recomputes)
+    supports_swap = False
+
+    def swap_out(self, batch, rows: List[int]) -> list:
+        """
+        Copy the state of the given rows (KV cache, next token, sampling
+        parameters) to host memory; returns one handle per row for swap_in.
+        The rows stay in the batch until the caller retires them.
+        """
+        raise NotImplementedError
+
+    def swap_in(self, batch, swapped: list):
+        """
+        Append rows saved by swap_out to the batch, in the given order; they
+        continue exactly where they stopped.
+        """
+        raise NotImplementedError
+
+    def generate(self, prompts: List[str], max_new_tokens: int, params: Optional[List[SamplingParams]] = None):
+        """
+        Static batch (batch_processor.batch_worker): prefill the prompts together
+        and decode max_new_tokens for all of them; each row is cut after its EOS.
+        Stop sequences are left to the caller (sampling.truncate_at_stop).
+        Returns (texts, generated token ids, prompt lengths), in prompt order.
+        """
+        token_ids = self.tokenize(prompts)
+        batch = self.new_batch()
+        joined = self.prefill(batch, token_ids, params)
+        rows = [[tok] for _, tok in joined]
+        for _ in range(max_new_tokens - 1):
+            for row, tokens in zip(rows, self.decode_step(batch)):
+                row.extend(tokens)
+        generated = [None] * len(prompts)
+        for (i, _), row in zip(joined, rows):
+            row = row[:max_new_tokens]
+            if self.eos_token_id in row:
+                row = row[:row.index(self.eos_token_id) + 1]
+            generated[i] = row
+        return self.detokenize(generated), generated, [len(ids) for ids in token_ids]
@@ -0,0 +1,491 @@
+# backends/hf.py
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+import torch
+from transformers import DynamicCache
+
+from backends.base import InferenceBackend
+from backends.sampling import STREAM_ACCEPT, STREAM_RESIDUAL, STREAM_SAMPLE, SamplingRows, uniforms
+from batch_former import observe_padding
+from batch_processor import left_pad_batch, run_batch
+from prefix_cache import PrefixCache
+from sampling import DEFAULT_SAMPLING, SamplingParams
+from speculative import verify_draft
+from metrics import (
+    KV_SWAP_BYTES,
+    SPECULATIVE_DRAFT_TOKENS,
+    SPECULATIVE_ACCEPTED_TOKENS,
+    speculative_tokens_per_forward_histogram,
+)
+
+
+def _unpack_cache(past) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+    if hasattr(past, "to_legacy_cache"):
+        past = past.to_legacy_cache()
+    return [(k, v) for k, v in past]
+
+
+def _pack_cache(layers: List[Tuple[torch.Tensor, torch.Tensor]]):
+    return DynamicCache.from_legacy_cache(tuple(layers))
+
+
+def _left_pad(t: torch.Tensor, length: int, dim: int) -> torch.Tensor:
+    pad = length - t.shape[dim]
+    if pad <= 0:
+        return t
+    shape = list(t.shape)
+    shape[dim] = pad
+    return torch.cat([t.new_zeros(shape), t], dim=dim)
+
+
+def _merge_kv(old, new, kv_len: int):
+    """
+    Concatenate two batches' KV along the batch dim, left-padding both to kv_len.
+    """
+    return [
+        (
+            torch.cat([_left_pad(k_old, kv_len, 2), _left_pad(k_new, kv_len, 2)], dim=0),
+            torch.cat([_left_pad(v_old, kv_len, 2), _left_pad(v_new, kv_len, 2)], dim=0),
+        )
+        for (k_old, v_old), (k_new, v_new) in zip(old, new)
+    ]
+
+
+def _select_kv(kv, index: torch.Tensor, first_column: int):
+    return [
+        (k.index_select(0, index)[:, :, first_column:], v.index_select(0, index)[:, :, first_column:])
+        for k, v in kv
+    ]
+
+
+def _gather_kv(kv, columns: torch.Tensor):
+    """
+    Per-row column selection: columns [batch, kv_len] indexes dim 2 of every layer.
+    """
+    def gather(t):
+        return t.gather(2, columns[:, None, :, None].expand(-1, t.shape[1], -1, t.shape[3]))
+    return [(gather(k), gather(v)) for k, v in kv]
+
+
+def kv_bytes_per_token(model) -> int:
+    """
+    KV cache bytes one token takes in every layer of the model: a key and a
+    value vector per KV head (fewer than the attention heads with grouped-query attention).
+    """
+    config = model.config
+    heads = config.num_attention_heads
+    kv_heads = getattr(config, "num_key_value_heads", None) or heads
+    head_dim = getattr(config, "head_dim", None) or config.hidden_size // heads
+    element_size = torch.empty((), dtype=model.dtype).element_size()
+    return 2 * config.num_hidden_layers * kv_heads * head_dim * element_size
+
+
+# Running batch of one scheduler: KV cache left-padded to a common length
+@dataclass
+class HFBatch:
+    prefix_cache: Optional[PrefixCache] = None
+    kv: Optional[List[Tuple[torch.Tensor, torch.Tensor]]] = None
+    attention_mask: Optional[torch.Tensor] = None  # [batch, kv_len]
+    draft_kv: Optional[List[Tuple[torch.Tensor, torch.Tensor]]] = None
+    next_tokens: List[int] = field(default_factory=list)  # sampled but not yet fed to the model
+    positions: List[int] = field(default_factory=list)    # position id of each next token
+    sampling: Optional[SamplingRows] = None                # each row's sampling parameters
+
+
+# One row of an HFBatch set aside in host memory by swap_out: its real KV
+# columns only, so swap_in can pad it to whatever batch it rejoins
+@dataclass
+class SwappedRow:
+    kv: List[Tuple[torch.Tensor, torch.Tensor]]            # per layer, [heads, tokens, head_dim]
+    draft_kv: Optional[List[Tuple[torch.Tensor, torch.Tensor]]]
+    next_token: int
+    position: int
+    sampling: SamplingRows
+    nbytes: int
+
+
+class HFBackend(InferenceBackend):
+    """
+    Hugging Face causal LM (model.load_model) on the model's own device, CPU or CUDA.
+    - Keeps a batch's KV cache left-padded to a common length, re-packing it
+      only when sequences join or leave
+    - Optionally reuses cached KV for shared prompt prefixes (the batch's prefix_cache)
+    - Optionally decodes speculatively (draft_model): the draft proposes
+      num_draft_tokens per sequence and the model verifies them in one pass.
+      The draft keeps its own KV with the same column layout; columns of
+      rejected draft tokens are masked out and compacted away once they
+      make up half of the cache
+    - Can swap rows' KV out to host memory and back (preemption, see
+      scheduler.ContinuousBatchScheduler)
+    """
+
+    supports_swap = True
+
+    def __init__(self, model, tokenizer, draft_model=None, num_draft_tokens: int = 4):
+        """
+        draft_model: smaller model sharing the tokenizer, for speculative decoding
+        num_draft_tokens: tokens the draft proposes per target forward pass
+        """
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = model.device
+        self.eos_token_id = tokenizer.eos_token_id
+        self.draft_model = draft_model
+        self.num_draft_tokens = num_draft_tokens
+        self.kv_bytes_per_token = kv_bytes_per_token(model)
+        if draft_model is not None:
+            self.kv_bytes_per_token += kv_bytes_per_token(draft_model)
+
+    def kv_bytes(self, lengths: List[int]) -> int:
+        if not lengths:
+            return 0
+        # Rows are left-padded to the longest one. With a draft model, the
+        # masked-out columns of rejected drafts can make the cache twice the
+        # real length (plus one step's drafts) before _compact drops them
+        columns = max(lengths)
+        if self.draft_model is not None:
+            columns = 2 * columns + self.num_draft_tokens + 1
+        return len(lengths) * columns * self.kv_bytes_per_token
+
+    def new_batch(self, prefix_cache: Optional[PrefixCache] = None) -> HFBatch:
+        return HFBatch(prefix_cache=prefix_cache, sampling=SamplingRows(self.device))
+
+    def generate(self, prompts: List[str], max_new_tokens: int, params: Optional[List[SamplingParams]] = None):
+        params = params or [DEFAULT_SAMPLING] * len(prompts)
+        # model.generate applies one setting to the whole batch and draws from
+        # torch's generator: fine for a batch of identical unseeded requests.
+        # Anything else runs the per-row loop of the base class
+        if len(set(params)) > 1 or params[0].seed is not None:
+            return super().generate(prompts, max_new_tokens, params)
+        texts, generated, prompt_lengths = run_batch(self.model, self.tokenizer, prompts, max_new_tokens, params[0])
+        return texts, generated.tolist(), prompt_lengths
+
+    @torch.no_grad()
+    def decode_step(self, batch: HFBatch) -> List[List[int]]:
+        if self.draft_model is not None:
+            return self._speculative_step(batch)
+
+        n = len(batch.next_tokens)
+        input_ids = torch.tensor([[t] for t in batch.next_tokens], device=self.device)
+        position_ids = torch.tensor([[p] for p in batch.positions], device=self.device)
+        attention_mask = torch.cat([batch.attention_mask, batch.attention_mask.new_ones((n, 1))], dim=1)
+
+        out = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=_pack_cache(batch.kv),
+            use_cache=True,
+        )
+        batch.kv = _unpack_cache(out.past_key_values)
+        batch.attention_mask = attention_mask
+
+        next_tokens = batch.sampling.sample(out.logits[:, -1, :], position_ids[:, 0] + 1).tolist()
+        batch.sampling.observe([[t] for t in next_tokens])
+        batch.next_tokens = next_tokens
+        batch.positions = [p + 1 for p in batch.positions]
+        return [[t] for t in next_tokens]
+
+    def _speculative_step(self, batch: HFBatch) -> List[List[int]]:
+        """
+        Decode 1..num_draft_tokens + 1 tokens for every row with one target
+        forward pass (see speculative.verify_draft).
+        """
+        k, n = self.num_draft_tokens, len(batch.next_tokens)
+        last = torch.tensor([[t] for t in batch.next_tokens], device=self.device)
+        positions = torch.tensor([[p] for p in batch.positions], device=self.device)
+        ones = batch.attention_mask.new_ones((n, 1))
+
+        # Draft k tokens one at a time; the k-th is fed too, so the draft cache
+        # gets the same k + 1 new columns as the target's. Draft and target
+        # probabilities both apply each row's sampling parameters, with the
+        # repetition penalty counting the tokens drafted so far
+        rows = batch.sampling
+        draft_kv = _pack_cache(batch.draft_kv)
+        mask, tokens = batch.attention_mask, last
+        drafted, draft_probs = [], []
+        for i in range(k + 1):
+            mask = torch.cat([mask, ones], dim=1)
+            out = self.draft_model(
+                input_ids=tokens,
+                attention_mask=mask,
+                position_ids=positions + i,
+                past_key_values=draft_kv,
+                use_cache=True,
+            )
+            draft_kv = out.past_key_values
+            if i == k:
+                break
+            probs = rows.probs(out.logits[:, -1, :], torch.cat(drafted, dim=1) if drafted else None)
+            tokens = rows.sample_probs(probs, positions[:, 0] + 1 + i, STREAM_SAMPLE).unsqueeze(-1)
+            drafted.append(tokens)
+            draft_probs.append(probs)
+        batch.draft_kv = _unpack_cache(draft_kv)
+        drafted = torch.cat(drafted, dim=1)
+        draft_probs = torch.stack(draft_probs, dim=1)
+
+        # Verify: the target scores the last token and all k drafts in one pass
+        offsets = torch.arange(k + 1, device=self.device)
+        out = self.model(
+            input_ids=torch.cat([last, drafted], dim=1),
+            attention_mask=mask,
+            position_ids=positions + offsets,
+            past_key_values=_pack_cache(batch.kv),
+            use_cache=True,
+        )
+        batch.kv = _unpack_cache(out.past_key_values)
+        target_probs = rows.probs(out.logits, drafted)
+        # Position j's replacement after a rejection there, or the bonus token after all k
+        sample_u = torch.cat([
+            uniforms(rows.seed[:, None], positions + 1 + offsets[None, :k], STREAM_RESIDUAL),
+            uniforms(rows.seed[:, None], positions + 1 + k, STREAM_SAMPLE),
+        ], dim=1)
+        accepted, next_tokens = verify_draft(
+            target_probs,
+            draft_probs,
+            drafted,
+            accept_u=uniforms(rows.seed[:, None], positions + 1 + offsets[None, :k], STREAM_ACCEPT),
+            sample_u=sample_u,
+        )
+
+        # Both caches keep the columns of rejected drafts, masked out
+        kept = (offsets[None, :] <= accepted[:, None]).to(mask.dtype)
+        batch.attention_mask = torch.cat([batch.attention_mask, kept], dim=1)
+
+        accepted, next_tokens, drafted = accepted.tolist(), next_tokens.tolist(), drafted.tolist()
+        new_tokens = []
+        for a, row, tok in zip(accepted, drafted, next_tokens):
+            new_tokens.append(row[:a] + [tok])
+            speculative_tokens_per_forward_histogram.observe(a + 1)
+        rows.observe(new_tokens)
+        batch.next_tokens = next_tokens
+        batch.positions = [p + a + 1 for p, a in zip(batch.positions, accepted)]
+        SPECULATIVE_DRAFT_TOKENS.inc(k * n)
+        SPECULATIVE_ACCEPTED_TOKENS.inc(sum(accepted))
+
+        self._compact(batch)
+        return new_tokens
+
+    def _prefill_draft(self, input_ids: torch.Tensor, mask: torch.Tensor, position_ids: torch.Tensor):
+        out = self.draft_model(
+            input_ids=input_ids,
+            attention_mask=mask,
+            position_ids=position_ids,
+            use_cache=True,
+        )
+        return _unpack_cache(out.past_key_values)
+
+    @torch.no_grad()
+    def prefill(
+        self, batch: HFBatch, token_ids: List[List[int]], params: Optional[List[SamplingParams]] = None
+    ) -> List[Tuple[int, int]]:
+        params = params or [DEFAULT_SAMPLING] * len(token_ids)
+        joined = []
+        misses = []
+        for i, ids in enumerate(token_ids):
+            matched, prefix_kv = 0, None
+            if batch.prefix_cache is not None:
+                matched, prefix_kv = batch.prefix_cache.lookup(ids)
+            if prefix_kv is None:
+                misses.append((i, ids))
+            else:
+                joined += self._prefill_suffix(batch, i, ids, matched, prefix_kv, params[i])
+
+        # Split misses into groups of similar length so short prompts
+        # aren't padded out to a much longer one
+        misses.sort(key=lambda item: len(item[1]))
+        group = []
+        for item in misses:
+            if group and len(item[1]) > 2 * len(group[0][1]):
+                joined += self._prefill_batch(batch, group, params)
+                group = []
+            group.append(item)
+        if group:
+            joined += self._prefill_batch(batch, group, params)
+        return joined
+
+    def _prefill_batch(self, batch: HFBatch, items: List[Tuple[int, List[int]]], params: List[SamplingParams]):
+        """
+        Prefill full prompts together, left-padded so every prompt ends at the same column.
+        """
+        input_ids, mask = left_pad_batch([ids for _, ids in items], self.tokenizer.pad_token_id, self.device)
+        max_len = input_ids.shape[1]
+        real = sum(len(ids) for _, ids in items)
+        observe_padding(real, max_len * len(items) - real)
+        position_ids = (mask.cumsum(-1) - 1).clamp(min=0)
+
+        out = self.model(
+            input_ids=input_ids,
+            attention_mask=mask,
+            position_ids=position_ids,
+            use_cache=True,
+        )
+        new_kv = _unpack_cache(out.past_key_values)
+
+        if batch.prefix_cache is not None:
+            for row, (_, ids) in enumerate(items):
+                pad = max_len - len(ids)
+                batch.prefix_cache.insert(ids, [(k[row, :, pad:], v[row, :, pad:]) for k, v in new_kv])
+
+        draft_kv = self._prefill_draft(input_ids, mask, position_ids) if self.draft_model is not None else None
+        return self._admit(
+            batch,
+            [i for i, _ in items],
+            [ids for _, ids in items],
+            [params[i] for i, _ in items],
+            out.logits[:, -1, :],
+            new_kv,
+            mask,
+            draft_kv,
+        )
+
+    def _prefill_suffix(
+        self, batch: HFBatch, index: int, ids: List[int], matched: int, prefix_kv, params: SamplingParams
+    ):
+        """
+        Prefill only the part of the prompt after a cached prefix of `matched` tokens.
+        Prefix hits are prefilled one request at a time since their cached
+        lengths differ; the work per request is just the unmatched suffix.
+        """
+        input_ids = torch.tensor([ids[matched:]], device=self.device)
+        mask = torch.ones((1, len(ids)), dtype=torch.long, device=self.device)
+        position_ids = torch.arange(matched, len(ids), device=self.device).unsqueeze(0)
+
+        out = self.model(
+            input_ids=input_ids,
+            attention_mask=mask,
+            position_ids=position_ids,
+            past_key_values=_pack_cache(prefix_kv),
+            use_cache=True,
+        )
+        new_kv = _unpack_cache(out.past_key_values)
+        batch.prefix_cache.insert(ids, [(k[0], v[0]) for k, v in new_kv])
+
+        # The prefix cache holds target KV only; the draft prefills the whole prompt
+        draft_kv = None
+        if self.draft_model is not None:
+            draft_kv = self._prefill_draft(
+                torch.tensor([ids], device=self.device), mask, torch.arange(len(ids), device=self.device).unsqueeze(0)
+            )
+        return self._admit(batch, [index], [ids], [params], out.logits[:, -1, :], new_kv, mask, draft_kv)
+
+    def _admit(
+        self,
+        batch: HFBatch,
+        indices: List[int],
+        token_ids: List[List[int]],
+        params: List[SamplingParams],
+        logits: torch.Tensor,
+        new_kv,
+        mask,
+        draft_kv=None,
+    ) -> List[Tuple[int, int]]:
+        """
+        Sample each new row's first token and merge its KV into the running batch.
+        """
+        prompt_lengths = [len(ids) for ids in token_ids]
+        rows = SamplingRows(self.device)
+        rows.extend(params, token_ids, logits.shape[-1])
+        first_tokens = rows.sample(logits, torch.tensor(prompt_lengths, device=self.device)).tolist()
+        rows.observe([[t] for t in first_tokens])
+        batch.sampling.append(rows)
+        batch.next_tokens.extend(first_tokens)
+        batch.positions.extend(prompt_lengths)
+        self._merge(batch, new_kv, mask, draft_kv)
+        return list(zip(indices, first_tokens))
+
+    @staticmethod
+    def _merge(batch: HFBatch, new_kv, mask, draft_kv=None):
+        if batch.kv is None:
+            batch.kv, batch.attention_mask, batch.draft_kv = new_kv, mask, draft_kv
+            return
+        # Merge with the running batch: left-pad both sides to a common kv length
+        kv_len = max(batch.attention_mask.shape[1], mask.shape[1])
+        batch.kv = _merge_kv(batch.kv, new_kv, kv_len)
+        if draft_kv is not None:
+            batch.draft_kv = _merge_kv(batch.draft_kv, draft_kv, kv_len)
+        batch.attention_mask = torch.cat(
+            [_left_pad(batch.attention_mask, kv_len, 1), _left_pad(mask, kv_len, 1)], dim=0
+        )
+
+    def swap_out(self, batch: HFBatch, rows: List[int]) -> List[SwappedRow]:
+        swapped = []
+        for row in rows:
+            columns = batch.attention_mask[row].nonzero().squeeze(-1)
+
+            def to_host(kv):
+                return [(k[row][:, columns].to("cpu"), v[row][:, columns].to("cpu")) for k, v in kv]
+
+            kv = to_host(batch.kv)
+            draft_kv = to_host(batch.draft_kv) if batch.draft_kv is not None else None
+            nbytes = sum(t.numel() * t.element_size() for layer in kv + (draft_kv or []) for t in layer)
+            swapped.append(SwappedRow(
+                kv=kv,
+                draft_kv=draft_kv,
+                next_token=batch.next_tokens[row],
+                position=batch.positions[row],
+                sampling=batch.sampling.subset([row]).to("cpu"),
+                nbytes=nbytes,
+            ))
+            KV_SWAP_BYTES.labels(direction="out").inc(nbytes)
+        return swapped
+
+    def swap_in(self, batch: HFBatch, swapped: List[SwappedRow]):
+        length = max(row.kv[0][0].shape[1] for row in swapped)
+
+        def to_device(kvs):
+            # [heads, tokens, head_dim] per row -> [rows, heads, length, head_dim], left-padded
+            return [
+                tuple(
+                    torch.stack([_left_pad(kv[layer][i], length, 1) for kv in kvs]).to(self.device)
+                    for i in (0, 1)
+                )
+                for layer in range(len(kvs[0]))
+            ]
+
+        mask = torch.stack([
+            _left_pad(torch.ones(row.kv[0][0].shape[1], dtype=torch.long), length, 0) for row in swapped
+        ]).to(self.device)
+        draft_kv = to_device([row.draft_kv for row in swapped]) if self.draft_model is not None else None
+        for row in swapped:
+            batch.sampling.append(row.sampling.to(self.device))
+            batch.next_tokens.append(row.next_token)
+            batch.positions.append(row.position)
+            KV_SWAP_BYTES.labels(direction="in").inc(row.nbytes)
+        self._merge(batch, to_device([row.kv for row in swapped]), mask, draft_kv)
+
+    def retire(self, batch: HFBatch, keep: List[int]):
+        if not keep:
+            batch.kv, batch.attention_mask, batch.draft_kv = None, None, None
+            batch.next_tokens, batch.positions = [], []
+            batch.sampling = SamplingRows(self.device)
+            return
+
+        index = torch.tensor(keep, device=self.device)
+        batch.next_tokens = [batch.next_tokens[i] for i in keep]
+        batch.positions = [batch.positions[i] for i in keep]
+        batch.sampling.select(keep)
+        mask = batch.attention_mask.index_select(0, index)
+
+        # Drop leading columns that are padding for every remaining sequence
+        first_real = int(mask.any(dim=0).nonzero()[0])
+        batch.attention_mask = mask[:, first_real:]
+        batch.kv = _select_kv(batch.kv, index, first_real)
+        if batch.draft_kv is not None:
+            batch.draft_kv = _select_kv(batch.draft_kv, index, first_real)
+            self._compact(batch)
+
+    def _compact(self, batch: HFBatch):
+        """
+        Drop the masked-out columns left by rejected draft tokens once they make
+        up half of the cache: each row keeps its real columns in order, left-padded.
+        """
+        real = int(batch.attention_mask.sum(dim=1).max())
+        if 2 * real > batch.attention_mask.shape[1]:
+            return
+        # A stable sort of the 0/1 mask puts each row's real columns last, in order
+        columns = torch.sort(batch.attention_mask, dim=1, stable=True).indices[:, -real:]
+        batch.attention_mask = batch.attention_mask.gather(1, columns)
+        batch.kv = _gather_kv(batch.kv, columns)
+        batch.draft_kv = _gather_kv(batch.draft_kv, columns)
@@ -0,0 +1,249 @@
+# backends/sampling.py
+# Batched sampling with per-row parameters (sampling.SamplingParams).
+#
+# SamplingRows keeps each running row's temperature, top-k, top-p, repetition
+# penalty and seed as [rows] tensors next to the KV cache, so a decode step
+# applies every row's settings with a handful of tensor ops over the whole
+# batch; per-request Python only runs when rows join or leave.
+#
+# Randomness is counter-based: the uniform used to sample position p of a row
+# is a hash of (row seed, p, stream), computed for all rows at once. Outputs
+# therefore don't depend on which other requests share the batch, and a
+# request with a seed is reproducible. Unseeded rows get a random seed on
+# admission. A uniform u picks a token by inverse CDF (first token whose
+# cumulative probability exceeds u).
+
+import copy
+import random
+from typing import List, Optional
+
+import torch
+
+from sampling import SamplingParams
+
+# Independent random streams for the same (seed, position). Speculative decoding
+# draws the draft's proposals and the bonus token from STREAM_SAMPLE too, so
+# with a draft identical to the target it reproduces plain decoding
+STREAM_SAMPLE = 0    # the token sampled at a position
+STREAM_ACCEPT = 2    # speculative decoding: accept/reject test of a draft token
+STREAM_RESIDUAL = 3  # speculative decoding: resample after a rejection
+
+_MASK32 = 0xFFFFFFFF
+
+
+def _mul32(x: torch.Tensor, c: int) -> torch.Tensor:
+    # (x * c) mod 2**32 for x < 2**32, in 16-bit halves so int64 never overflows
+    return (x * (c & 0xFFFF) + (((x * (c >> 16)) & 0xFFFF) << 16)) & _MASK32
+
+
+def _mix32(x: torch.Tensor) -> torch.Tensor:
+    # murmur3 finalizer
+    x = x ^ (x >> 16)
+    x = _mul32(x, 0x85EBCA6B)
+    x = x ^ (x >> 13)
+    x = _mul32(x, 0xC2B2AE35)
+    return x ^ (x >> 16)
+
+
+def uniforms(seeds: torch.Tensor, positions: torch.Tensor, stream: int = STREAM_SAMPLE) -> torch.Tensor:
+    """
+    One float64 uniform in [0, 1) per (seed, position); seeds and positions
+    are int64 tensors broadcast against each other.
+    """
+    h = _mix32((seeds & _MASK32) ^ ((stream * 0x9E3779B9) & _MASK32))
+    h = _mix32(h ^ ((seeds >> 32) & _MASK32))
+    h = _mix32(h ^ (positions & _MASK32))
+    g = _mix32(h ^ 0x68E31DA4)
+    return ((h << 21) | (g >> 11)).double() / float(1 << 53)
+
+
+def sample_from(probs: torch.Tensor, u: torch.Tensor) -> torch.Tensor:
+    """
+    Inverse-CDF sampling: probs [rows, vocab] (need not be normalized), u [rows]
+    uniforms -> [rows] token ids. Tokens with zero probability are never picked.
+    """
+    cdf = probs.double().cumsum(dim=-1)
+    target = (u.to(cdf.dtype) * cdf[:, -1]).unsqueeze(-1)
+    return torch.searchsorted(cdf, target, right=True).squeeze(-1).clamp_(max=probs.shape[-1] - 1)
+
+
+class SamplingRows:
+    """
+    Sampling parameters of a running batch's rows, in row order. Rows are
+    appended with extend()/append() and kept with select(), like the KV cache.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.params: List[SamplingParams] = []
+        self.temperature = torch.empty(0, device=device)
+        self.top_k = torch.empty(0, dtype=torch.long, device=device)   # 0 = no limit
+        self.top_p = torch.empty(0, device=device)
+        self.penalty = torch.empty(0, device=device)
+        self.seed = torch.empty(0, dtype=torch.long, device=device)
+        self.greedy = torch.empty(0, dtype=torch.bool, device=device)
+        # [rows, vocab]: tokens in each row's prompt and output, for the repetition
+        # penalty; allocated once a row with a penalty joins
+        self.seen = None
+        self._update_flags()
+
+    def __len__(self):
+        return len(self.params)
+
+    def _update_flags(self):
+        # Which kernels the batch needs; recomputed only when rows join or leave
+        params = self.params
+        self.any_greedy = any(p.greedy for p in params)
+        self.all_greedy = bool(params) and all(p.greedy for p in params)
+        self.any_top_p = any(p.top_p < 1 and not p.greedy for p in params)
+        self.any_penalty = any(p.repetition_penalty != 1 for p in params)
+        limits = [p.top_k for p in params if not p.greedy]
+        self.max_top_k = max(limits, default=0)
+        self.any_top_k = any(limits)
+        self.any_unlimited = not all(limits)
+
+    def extend(self, params: List[SamplingParams], token_ids: List[List[int]], vocab_size: int):
+        """
+        Add rows for new sequences; token_ids are their prompts (for the repetition penalty).
+        """
+        new = SamplingRows(self.device)
+        new.params = list(params)
+        new.temperature = torch.tensor([p.temperature for p in params], device=self.device)
+        new.top_k = torch.tensor([p.top_k for p in params], dtype=torch.long, device=self.device)
+        new.top_p = torch.tensor([p.top_p for p in params], device=self.device)
+        new.penalty = torch.tensor([p.repetition_penalty for p in params], device=self.device)
+        new.seed = torch.tensor(
+            [p.seed if p.seed is not None else random.getrandbits(63) for p in params],
+            dtype=torch.long, device=self.device,
+        )
+        new.greedy = torch.tensor([p.greedy for p in params], dtype=torch.bool, device=self.device)
+        if self.seen is not None or any(p.repetition_penalty != 1 for p in params):
+            new.seen = torch.zeros((len(params), vocab_size), dtype=torch.bool, device=self.device)
+            new.observe(token_ids)
+        self.append(new)
+
+    def append(self, other: "SamplingRows"):
+        if other.seen is not None and self.seen is None:
+            self.seen = torch.zeros((len(self), other.seen.shape[1]), dtype=torch.bool, device=self.device)
+        elif self.seen is not None and other.seen is None:
+            other.seen = torch.zeros((len(other), self.seen.shape[1]), dtype=torch.bool, device=self.device)
+        self.params = self.params + other.params
+        for name in ("temperature", "top_k", "top_p", "penalty", "seed", "greedy", "seen"):
+            mine = getattr(self, name)
+            if mine is not None:
+                setattr(self, name, torch.cat([mine, getattr(other, name)]))
+        self._update_flags()
+
+    def select(self, keep: List[int]):
+        index = torch.tensor(keep, dtype=torch.long, device=self.device)
+        self.params = [self.params[i] for i in keep]
+        for name in ("temperature", "top_k", "top_p", "penalty", "seed", "greedy", "seen"):
+            value = getattr(self, name)
+            if value is not None:
+                setattr(self, name, value.index_select(0, index))
+        self._update_flags()
+        if not self.any_penalty:
+            self.seen = None
+
+    def subset(self, rows: List[int]) -> "SamplingRows":
+        """
+        Copy of the given rows (e.g. to set them aside); this object is unchanged.
+        """
+        new = copy.copy(self)
+        new.select(rows)
+        return new
+
+    def to(self, device) -> "SamplingRows":
+        new = copy.copy(self)
+        new.device = device
+        for name in ("temperature", "top_k", "top_p", "penalty", "seed", "greedy", "seen"):
+            value = getattr(self, name)
+            if value is not None:
+                setattr(new, name, value.to(device))
+        return new
+
+    def observe(self, tokens: List[List[int]]):
+        """
+        Mark each row's new tokens as seen (a no-op unless a row has a repetition penalty).
+        """
+        if self.seen is None:
+            return
+        rows = [row for row, ids in enumerate(tokens) for _ in ids]
+        if rows:
+            cols = [t for ids in tokens for t in ids]
+            self.seen[torch.tensor(rows, device=self.device), torch.tensor(cols, device=self.device)] = True
+
+    def probs(self, logits: torch.Tensor, drafted: Optional[torch.Tensor] = None) -> torch.Tensor:
+        """
+        logits [rows, vocab], or [rows, positions, vocab] (the speculative verify
+        pass) -> normalized next-token probabilities of the same shape. Greedy
+        rows get all their mass on the argmax, so rejection sampling against
+        them reproduces greedy decoding.
+        drafted [rows, m]: speculative tokens not observed yet, which the
+        repetition penalty counts as seen like plain decoding would: all m
+        for [rows, vocab] logits (the draft loop), the first j at position j
+        of [rows, m + 1, vocab] logits (the verify pass).
+        """
+        shape = logits.shape
+        vocab = shape[-1]
+        per_row = logits.numel() // (len(self) * vocab)
+        x = logits.reshape(-1, vocab).float()
+
+        def rows(t):
+            return t if per_row == 1 else t.repeat_interleave(per_row, dim=0)
+
+        if self.any_penalty:
+            seen = self.seen[:, :vocab]
+            if drafted is not None and drafted.shape[1]:
+                # seen_before[:, j]: the tokens drafted before position j
+                hits = torch.zeros((len(self), drafted.shape[1], vocab), dtype=torch.bool, device=self.device)
+                hits.scatter_(-1, drafted[:, :, None], True)
+                seen_before = seen[:, None] | (hits.cumsum(dim=1) > 0)
+                if per_row == 1:
+                    seen = seen_before[:, -1]
+                else:
+                    seen = torch.cat([seen[:, None], seen_before[:, :per_row - 1]], dim=1).reshape(-1, vocab)
+            else:
+                seen = rows(seen)
+            penalty = rows(self.penalty)[:, None]
+            x = torch.where(seen, torch.where(x > 0, x / penalty, x * penalty), x)
+
+        argmax = x.argmax(dim=-1, keepdim=True) if self.any_greedy else None
+        if self.all_greedy:
+            return torch.zeros_like(x).scatter_(-1, argmax, 1.0).reshape(shape)
+
+        x = x / rows(torch.where(self.greedy, torch.ones_like(self.temperature), self.temperature))[:, None]
+        top_k = rows(torch.where(self.top_k > 0, self.top_k, vocab).clamp(max=vocab))
+        if self.any_top_p:
+            # One sort serves both filters: rank >= k drops, then the nucleus
+            # keeps tokens while the mass ranked above them is below top_p
+            sorted_x, order = x.sort(dim=-1, descending=True)
+            ranks = torch.arange(vocab, device=x.device)
+            sorted_x = sorted_x.masked_fill(ranks[None, :] >= top_k[:, None], float("-inf"))
+            sorted_probs = torch.softmax(sorted_x, dim=-1)
+            mass_before = sorted_probs.cumsum(dim=-1) - sorted_probs
+            sorted_probs = sorted_probs.masked_fill(mass_before >= rows(self.top_p)[:, None], 0.0)
+            probs = torch.zeros_like(sorted_probs).scatter_(-1, order, sorted_probs)
+            probs = probs / probs.sum(dim=-1, keepdim=True)
+        else:
+            if self.any_top_k:
+                # k-th largest logit of every row from one topk over the largest k in the batch
+                k = vocab if self.any_unlimited else min(self.max_top_k, vocab)
+                kth = torch.topk(x, k, dim=-1).values.gather(-1, (top_k - 1)[:, None])
+                x = x.masked_fill(x < kth, float("-inf"))
+            probs = torch.softmax(x, dim=-1)
+
+        if self.any_greedy:
+            one_hot = torch.zeros_like(probs).scatter_(-1, argmax, 1.0)
+            probs = torch.where(rows(self.greedy)[:, None], one_hot, probs)
+        return probs.reshape(shape)
+
+    def sample(self, logits: torch.Tensor, positions: torch.Tensor, stream: int = STREAM_SAMPLE) -> torch.Tensor:
+        """
+        logits [rows, vocab] -> [rows] token ids; positions [rows]: where each
+        sampled token goes in its sequence (keys the row's random stream).
+        """
+        return self.sample_probs(self.probs(logits), positions, stream)
+
+    def sample_probs(self, probs: torch.Tensor, positions: torch.Tensor, stream: int = STREAM_SAMPLE) -> torch.Tensor:
+        return sample_from(probs, uniforms(self.seed, positions, stream))
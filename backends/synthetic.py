@@ -0,0 +1,172 @@
+# backends/synthetic.py
+# A backend with no model: each token id is a hash of everything before it
+# (and the seed), and each call costs what a LatencyModel says it should.
+# Lets the control plane (queues, scheduler, caches, load balancer, admission)
+# be load-tested on a CI box without a GPU, a model download, or torch; with
+# a zero-cost LatencyModel it measures the serving stack's own overhead.
+#
+#   backend = SyntheticBackend(LatencyModel(step_ms=10, decode_token_us=200))
+
+import random
+import time
+import zlib
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from backends.base import InferenceBackend
+from metrics import KV_SWAP_BYTES
+from sampling import DEFAULT_SAMPLING, SamplingParams
+
+
+@dataclass(frozen=True)
+class LatencyModel:
+    """
+    Wall-clock cost of one backend call, spent in time.sleep like a GPU kernel
+    the inference thread waits on (the GIL is released meanwhile):
+        prefill:     step_ms + prefill_token_us x prompt tokens in the call
+        decode step: step_ms + decode_token_us x rows in the batch
+    """
+    step_ms: float = 10.0           # fixed per forward pass (launches, reading the weights)
+    prefill_token_us: float = 50.0
+    decode_token_us: float = 200.0
+
+    def prefill_s(self, tokens: int) -> float:
+        return (self.step_ms * 1000 + self.prefill_token_us * tokens) / 1_000_000
+
+    def decode_s(self, rows: int) -> float:
+        return (self.step_ms * 1000 + self.decode_token_us * rows) / 1_000_000
+
+
+class SyntheticTokenizer:
+    """
+    One token per whitespace-separated word; ids are word hashes, 0 is EOS/pad.
+    """
+
+    eos_token_id = 0
+    pad_token_id = 0
+
+    def __init__(self, vocab_size: int = 256):
+        self.vocab_size = vocab_size
+
+    def encode(self, text: str) -> List[int]:
+        return [zlib.crc32(w.encode()) % (self.vocab_size - 1) + 1 for w in text.split()] or [1]
+
+    def __call__(self, texts, **kwargs):
+        if isinstance(texts, str):
+            return {"input_ids": self.encode(texts)}
+        return {"input_ids": [self.encode(t) for t in texts]}
+
+    def decode(self, ids, skip_special_tokens: bool = True) -> str:
+        return "".join(f" w{i}" for i in ids if not (skip_special_tokens and i == self.eos_token_id))
+
+    def batch_decode(self, sequences, skip_special_tokens: bool = True) -> List[str]:
+        return [self.decode(s, skip_special_tokens) for s in sequences]
+
+
+# Per row: [hash of the tokens fed so far, how many there are]; the row's
+# next token is a function of the hash, and isn't fed until the next step
+@dataclass
+class SyntheticBatch:
+    rows: List[List[int]] = field(default_factory=list)
+
+
+class SyntheticBackend(InferenceBackend):
+    """
+    Never samples EOS, so every request runs to exactly its max_new_tokens.
+    Greedy requests get an output that depends only on the prompt, seeded ones
+    on the prompt and seed, so cache hits can be checked against fresh
+    generations; unseeded sampled requests get a different output every time.
+    Like a real model's, the continuation depends only on the context: prefilling
+    a prompt plus part of its output continues where decoding left off.
+    KV memory is only accounted, at kv_bytes_per_token per token (distilgpt2
+    in fp32 by default), so KV budgeting and preemption can be exercised too.
+    """
+
+    supports_swap = True
+
+    def __init__(
+        self, latency: LatencyModel = LatencyModel(), vocab_size: int = 256, kv_bytes_per_token: int = 36_864
+    ):
+        self.latency = latency
+        self.tokenizer = SyntheticTokenizer(vocab_size)
+        self.eos_token_id = self.tokenizer.eos_token_id
+        self.vocab_size = vocab_size
+        self.kv_bytes_per_token = kv_bytes_per_token
+
+    def _token(self, state: int) -> int:
+        return state % (self.vocab_size - 1) + 1
+
+    @staticmethod
+    def _feed(state: int, ids: List[int]) -> int:
+        # CRC32 chains: feeding a, then b, gives the same state as feeding a + b
+        return zlib.crc32(b"".join(i.to_bytes(4, "little") for i in ids), state)
+
+    def _start(self, ids: List[int], params: SamplingParams) -> int:
+        if params.greedy:
+            state = 0
+        elif params.seed is not None:
+            state = zlib.crc32(repr(params.seed).encode())
+        else:
+            state = random.getrandbits(32)
+        return self._feed(state, ids)
+
+    @staticmethod
+    def _wait(seconds: float):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def new_batch(self, prefix_cache=None) -> SyntheticBatch:
+        return SyntheticBatch()
+
+    def prefill(
+        self, batch: SyntheticBatch, token_ids: List[List[int]], params: Optional[List[SamplingParams]] = None
+    ) -> List[Tuple[int, int]]:
+        self._wait(self.latency.prefill_s(sum(len(ids) for ids in token_ids)))
+        params = params or [DEFAULT_SAMPLING] * len(token_ids)
+        joined = []
+        for i, ids in enumerate(token_ids):
+            state = self._start(ids, params[i])
+            batch.rows.append([state, len(ids)])
+            joined.append((i, self._token(state)))
+        return joined
+
+    def decode_step(self, batch: SyntheticBatch) -> List[List[int]]:
+        self._wait(self.latency.decode_s(len(batch.rows)))
+        new_tokens = []
+        for row in batch.rows:
+            row[0] = self._feed(row[0], [self._token(row[0])])
+            row[1] += 1
+            new_tokens.append([self._token(row[0])])
+        return new_tokens
+
+    def retire(self, batch: SyntheticBatch, keep: List[int]):
+        batch.rows = [batch.rows[i] for i in keep]
+
+    def kv_bytes(self, lengths: List[int]) -> int:
+        return sum(lengths) * self.kv_bytes_per_token
+
+    def swap_out(self, batch: SyntheticBatch, rows: List[int]) -> List[List[int]]:
+        swapped = [list(batch.rows[i]) for i in rows]
+        KV_SWAP_BYTES.labels(direction="out").inc(self.kv_bytes([row[1] for row in swapped]))
+        return swapped
+
+    def swap_in(self, batch: SyntheticBatch, swapped: List[List[int]]):
+        KV_SWAP_BYTES.labels(direction="in").inc(self.kv_bytes([row[1] for row in swapped]))
+        batch.rows.extend(list(row) for row in swapped)
+
+    def generate(self, prompts: List[str], max_new_tokens: int, params: Optional[List[SamplingParams]] = None):
+        # One prefill call, then one call per decoded token, like model.generate
+        token_ids = self.tokenize(prompts)
+        self._wait(self.latency.prefill_s(sum(len(ids) for ids in token_ids)))
+        for _ in range(max_new_tokens - 1):
+            self._wait(self.latency.decode_s(len(prompts)))
+        params = params or [DEFAULT_SAMPLING] * len(prompts)
+        generated = []
+        for ids, p in zip(token_ids, params):
+            state = self._start(ids, p)
+            row = [self._token(state)]
+            while len(row) < max_new_tokens:
+                state = self._feed(state, row[-1:])
+                row.append(self._token(state))
+            generated.append(row)
+        return self.detokenize(generated), generated, [len(ids) for ids in token_ids]
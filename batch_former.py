@@ -0,0 +1,107 @@
+from typing import TYPE_CHECKING, Callable, List, Optional, Tuple
+
+from metrics import BATCH_TOKENS, padding_efficiency_histogram
+
+if TYPE_CHECKING:
+    from batch_processor import GenerationRequest
+
+
+def observe_padding(real_tokens: int, padding_tokens: int):
+    """
+    Record how many of the tokens a batch computed were real vs. padding.
+    """
+    BATCH_TOKENS.labels(kind="real").inc(real_tokens)
+    BATCH_TOKENS.labels(kind="padding").inc(padding_tokens)
+    total = real_tokens + padding_tokens
+    if total:
+        padding_efficiency_histogram.observe(real_tokens / total)
+
+
+class LengthBucketBatcher:
+    """
+    Forms batches from pending requests with similar prompt and output lengths,
+    so less compute goes to padding.
+
+    - Requests are bucketed by log2 of their estimated prompt tokens and of max_new_tokens
+    - Every batch is anchored on the oldest pending request of the most urgent
+      priority class, then filled with that class's requests first, closest
+      buckets and oldest first within it
+    - Anchoring on the oldest request is the fairness bound: a request that
+      never matches anyone else's bucket still leads a batch once everything
+      ahead of it (in its class) has been served, so long requests can't be
+      starved by short ones
+
+    Prompt length is estimated from characters rather than tokenized here,
+    so tokenization stays on the inference thread.
+    """
+
+    def __init__(
+        self,
+        max_pending: int = 64,
+        max_bucket_distance: Optional[int] = 1,
+        use_output_length: bool = True,
+        chars_per_token: int = 4,
+    ):
+        """
+        max_pending: how many requests to look ahead at
+        max_bucket_distance: furthest bucket (in log2 steps) that may join the
+            anchor's batch; None fills the batch with the closest requests instead
+        use_output_length: bucket on max_new_tokens too (static batches generate
+            every row to the batch-wide max; continuous batching doesn't)
+        """
+        self.max_pending = max_pending
+        self.max_bucket_distance = max_bucket_distance
+        self.use_output_length = use_output_length
+        self.chars_per_token = chars_per_token
+        self.pending: List["GenerationRequest"] = []  # arrival order
+
+    def __len__(self):
+        return len(self.pending)
+
+    def has_room(self) -> bool:
+        return len(self.pending) < self.max_pending
+
+    def add(self, req: "GenerationRequest"):
+        self.pending.append(req)
+
+    def remove_if(self, predicate: Callable[["GenerationRequest"], bool]):
+        """
+        Drop pending requests for which predicate is true (e.g. expired or cancelled).
+        """
+        self.pending = [r for r in self.pending if not predicate(r)]
+
+    def bucket(self, req: "GenerationRequest") -> Tuple[int, int]:
+        prompt_tokens = len(req.prompt) // self.chars_per_token + 1
+        output_bucket = max(req.max_new_tokens, 1).bit_length() if self.use_output_length else 0
+        return prompt_tokens.bit_length(), output_bucket
+
+    def next_batch(self, max_size: int, max_priority: Optional[int] = None) -> List["GenerationRequest"]:
+        """
+        max_priority: only take requests at least this urgent (priority <= max_priority)
+        """
+        eligible = [
+            i for i in range(len(self.pending)) if max_priority is None or self.pending[i].priority <= max_priority
+        ]
+        if not eligible or max_size <= 0:
+            return []
+
+        anchor = min(eligible, key=lambda i: (self.pending[i].priority, i))
+        anchor_prompt, anchor_output = self.bucket(self.pending[anchor])
+
+        def distance(req):
+            prompt_bucket, output_bucket = self.bucket(req)
+            return abs(prompt_bucket - anchor_prompt) + abs(output_bucket - anchor_output)
+
+        # Most urgent class first, then closest buckets, oldest first within a bucket
+        candidates = sorted(
+            (i for i in eligible if i != anchor),
+            key=lambda i: (self.pending[i].priority, distance(self.pending[i]), i),
+        )
+        if self.max_bucket_distance is not None:
+            candidates = [i for i in candidates if distance(self.pending[i]) <= self.max_bucket_distance]
+        chosen = [anchor] + candidates[:max_size - 1]
+
+        batch = [self.pending[i] for i in sorted(chosen)]
+        picked = set(chosen)
+        self.pending = [r for i, r in enumerate(self.pending) if i not in picked]
+        return batch
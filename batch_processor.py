@@ -1,10 +1,24 @@
 import asyncio
-import torch
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import List
+from typing import List, Optional
 
-from metrics import REQUEST_COUNTER, REQUEST_LATENCY, batch_size_histogram, queue_wait_time_histogram
+import tracing
+from batch_former import LengthBucketBatcher, observe_padding
+from logs import get_logger
+from sampling import DEFAULT_SAMPLING, SamplingParams, truncate_at_stop
+from metrics import (
+    REQUEST_COUNTER,
+    REQUEST_LATENCY,
+    batch_size_histogram,
+    queue_wait_time_histogram,
+    batch_run_time_histogram,
+    REQUESTS_SHED,
+    REQUESTS_EXPIRED,
+    REQUESTS_CANCELLED,
+)
 
+log = get_logger("batch")
 
 
 # Represents a single generation request flowing through the system
@@ -14,16 +28,73 @@ class GenerationRequest:
     max_new_tokens: int
     future: asyncio.Future  # where the result will be returned
     enqueue_time: float    # timestamp when request enters the queue
+    # Optional per-request token channel for streaming: token ids are pushed
+    # as they are decoded, followed by STREAM_END once the request finishes
+    stream: Optional[asyncio.Queue] = None
+    # Event-loop time after which the answer is no longer wanted; expired
+    # requests are failed instead of being given a batch slot
+    deadline: Optional[float] = None
+    # Scheduling class, lower runs first (PRIORITIES)
+    priority: int = 0
+    # Ties this request's spans together (tracing.py)
+    trace_id: int = 0
+    # Temperature, top-k/top-p, repetition penalty, seed and stop sequences
+    sampling: SamplingParams = DEFAULT_SAMPLING
+
+
+# Sentinel pushed on a request's stream after its last token
+STREAM_END = None
+
+# Priority classes: interactive requests are batched ahead of bulk ones
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+PRIORITIES = {"interactive": PRIORITY_INTERACTIVE, "bulk": PRIORITY_BULK}
+PRIORITY_NAMES = {value: name for name, value in PRIORITIES.items()}
+
+# Requests allowed to wait in a queue before new ones are refused
+MAX_QUEUE_SIZE = 1024
+
+
+class RequestRejected(Exception):
+    """
+    A request refused at admission or dropped before it was scheduled.
+    status_code: HTTP status to answer with (429 or 503; 413 if it can never
+        fit the scheduler's KV budget)
+    retry_after: seconds the client should wait before retrying
+    """
+
+    def __init__(self, reason: str, status_code: int = 503, retry_after: float = 1.0):
+        super().__init__(reason)
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
 
 
 # Global async queue holding incoming requests
-request_queue: asyncio.Queue[GenerationRequest] = asyncio.Queue()
+request_queue: asyncio.Queue[GenerationRequest] = asyncio.Queue(maxsize=MAX_QUEUE_SIZE)
 
+# Dedicated thread for tokenization and model calls, off the event loop
+inference_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
 
-async def enqueue_request(prompt: str, max_new_tokens: int):
+
+async def enqueue_request(
+    prompt: str,
+    max_new_tokens: int,
+    stream: Optional[asyncio.Queue] = None,
+    queue: Optional[asyncio.Queue] = None,
+    deadline: Optional[float] = None,
+    priority: int = PRIORITY_INTERACTIVE,
+    sampling: Optional[SamplingParams] = None,
+):
     """
     Called by the FastAPI endpoint.
     Enqueues a request and waits until the batch worker resolves it.
+    If stream is given, generated token ids are also pushed onto it while decoding.
+    queue: the worker queue to use (defaults to the global request_queue)
+    deadline: event-loop time after which the request is dropped unscheduled
+    sampling: per-request sampling parameters (DEFAULT_SAMPLING if None)
+    Raises RequestRejected if the queue is full or the deadline passes first.
+    Cancelling the caller cancels the request; it is dropped before it takes a slot.
     """
     loop = asyncio.get_running_loop()
     future = loop.create_future()
@@ -32,77 +103,185 @@ async def enqueue_request(prompt: str, max_new_tokens: int):
         prompt=prompt,
         max_new_tokens=max_new_tokens,
         future=future,
-        enqueue_time=asyncio.get_event_loop().time() # timestamp when request enters the queue
+        enqueue_time=asyncio.get_event_loop().time(), # timestamp when request enters the queue
+        stream=stream,
+        deadline=deadline,
+        priority=priority,
+        trace_id=tracing.trace_id(),
+        sampling=sampling or DEFAULT_SAMPLING,
     )
 
-    await request_queue.put(req)
+    try:
+        (request_queue if queue is None else queue).put_nowait(req)
+    except asyncio.QueueFull:
+        REQUESTS_SHED.labels(reason="queue_full", priority=PRIORITY_NAMES.get(priority, str(priority))).inc()
+        raise RequestRejected("queue_full", status_code=503)
 
     # Wait until batch_worker sets the result
     return await future
 
+def drop_if_stale(req: GenerationRequest, now: float) -> bool:
+    """
+    True if a queued request should not be scheduled: its caller has gone away
+    (future cancelled) or its deadline has passed (failed with RequestRejected).
+    """
+    if req.future.done():
+        REQUESTS_CANCELLED.inc()
+        return True
+    if req.deadline is not None and now > req.deadline:
+        REQUESTS_EXPIRED.inc()
+        req.future.set_exception(RequestRejected("deadline_expired", status_code=503))
+        return True
+    return False
+
+
+def left_pad_batch(token_ids: List[List[int]], pad_token_id: int, device=None):
+    """
+    Build left-padded input_ids and attention_mask tensors from token id lists.
+    """
+    # torch is imported on first use, so the API process can import the request
+    # types and queues here without waiting for the model stack to load
+    import torch
+
+    width = max(len(ids) for ids in token_ids)
+    input_ids = torch.tensor([[pad_token_id] * (width - len(ids)) + ids for ids in token_ids], device=device)
+    attention_mask = torch.tensor([[0] * (width - len(ids)) + [1] * len(ids) for ids in token_ids], device=device)
+    return input_ids, attention_mask
+
+
+def run_batch(model, tokenizer, prompts: List[str], max_new_tokens: int, sampling: SamplingParams = DEFAULT_SAMPLING):
+    """
+    Blocking: tokenize, generate and decode one static batch, every row with
+    the same sampling parameters (stop sequences are left to the caller).
+    Generated tokens start right after the padded prompt width for every row,
+    so no per-request re-tokenization is needed to find them.
+    Returns (texts, generated_ids, prompt_lengths); prompt lengths come from the attention mask
+    """
+    import torch
+
+    inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(model.device)
+    prompt_width = inputs["input_ids"].shape[1]
+    prompt_lengths = inputs["attention_mask"].sum(dim=1).tolist()
+
+    if sampling.greedy:
+        options = {"do_sample": False}
+    else:
+        options = {"do_sample": True, "temperature": sampling.temperature, "top_k": sampling.top_k, "top_p": sampling.top_p}
+    with torch.no_grad():
+        output = model.generate(
+            **inputs,
+            **options,
+            repetition_penalty=sampling.repetition_penalty,
+            max_new_tokens=max_new_tokens,
+            pad_token_id=tokenizer.eos_token_id,
+        )
+
+    generated = output[:, prompt_width:].cpu()
+    texts = tokenizer.batch_decode(generated, skip_special_tokens=True)
+    return [t.lstrip("\n ").rstrip() for t in texts], generated, prompt_lengths
+
+
 # max_wait_time_ms is 500 for testing, bring back to 20 after
-async def batch_worker(model, tokenizer, batch_size: int = 1, max_wait_ms: int = 500):
+async def batch_worker(
+    backend,
+    batch_size: int = 1,
+    max_wait_ms: int = 500,
+    batcher: Optional[LengthBucketBatcher] = None,
+    controller=None,
+    queue: Optional[asyncio.Queue] = None,
+):
     """
     Background task:
-    - Pulls requests from the queue
-    - Batches them for a single GPU forward pass
+    - Pulls requests from the queue (the global request_queue unless given)
+    - Groups requests of similar prompt/output length (LengthBucketBatcher)
+    - Batches them for a single backend.generate call (model.generate for backends.hf)
     - Resolves each request's future
     - Records Prometheus metrics
+    If a controller (serving.batch_controller.BatchController) is given,
+    batch_size and max_wait_ms follow its setpoints instead.
     """
+    batcher = batcher or LengthBucketBatcher(
+        max_pending=4 * (controller.max_batch_size if controller else batch_size)
+    )
+    loop = asyncio.get_running_loop()
+    if queue is None:
+        queue = request_queue
+
     while True:
-        batch: List[GenerationRequest] = []
+        if controller is not None:
+            batch_size, max_wait_ms = controller.batch_size, controller.max_wait_ms
 
-        # Wait for at least one request
-        req = await request_queue.get()
-        batch.append(req)
+        # Wait for at least one request (unless some were left over from the last batch)
+        if not batcher:
+            batcher.add(await queue.get())
 
-        start_time = asyncio.get_event_loop().time()
+        start_time = loop.time()
+        form_start = tracing.now()
 
         # Try to fill the batch until batch_size or max_wait_ms is reached
-        while len(batch) < batch_size:
-            elapsed_ms = (asyncio.get_event_loop().time() - start_time) * 1000
+        while len(batcher) < batch_size:
+            elapsed_ms = (loop.time() - start_time) * 1000
             remaining_ms = max_wait_ms - elapsed_ms
             if remaining_ms <= 0:
                 break
             try:
-                next_req = await asyncio.wait_for(request_queue.get(), timeout=remaining_ms / 1000)
-                batch.append(next_req)
+                next_req = await asyncio.wait_for(queue.get(), timeout=remaining_ms / 1000)
+                batcher.add(next_req)
             except asyncio.TimeoutError:
                 break  # time window exceeded, process current batch
 
+        # Look ahead at whatever else is already queued so similar lengths can be grouped
+        while batcher.has_room() and not queue.empty():
+            batcher.add(queue.get_nowait())
+
+        # Nobody is waiting for expired or cancelled requests
+        now = loop.time()
+        batcher.remove_if(lambda r: drop_if_stale(r, now))
+        batch = batcher.next_batch(batch_size)
+        if not batch:
+            continue
+        formed = tracing.now()
+        tracing.spans.record("batch_form", form_start, formed, size=len(batch))
+
         # Measure queue wait time for all requests
-        now = asyncio.get_event_loop().time()
         for r in batch:
             wait_time = now - r.enqueue_time
             queue_wait_time_histogram.observe(wait_time)
-            print(f"Request waited {wait_time:.3f}s in queue")
+            tracing.spans.record("queue_wait", int(r.enqueue_time * 1e9), formed, trace_id=r.trace_id)
+            log.debug("Request waited %.3fs in queue", wait_time)
 
         # Record batch size
         batch_size_histogram.observe(len(batch))
 
-        # Prepare batched input
+        # Tokenize, generate and decode on the inference thread so the
+        # event loop keeps accepting requests during the forward pass
         prompts = [r.prompt for r in batch]
         max_tokens = max(r.max_new_tokens for r in batch)
-        inputs = tokenizer(prompts, return_tensors="pt", padding=True).to("cuda")
-
-        # Run inference
-        with torch.no_grad():
-            output = model.generate(
-                **inputs,
-                max_new_tokens=max_tokens,
-                do_sample=True,
-                top_k=50,
-                temperature=0.7,
-                pad_token_id=tokenizer.eos_token_id,
-            )
-
-        # Decode and set results for each request
-        input_lengths = [len(tokenizer(r.prompt)["input_ids"]) for r in batch]
+        run_start = loop.time()
+        texts, generated, prompt_lengths = await loop.run_in_executor(
+            inference_executor, backend.generate, prompts, max_tokens, [r.sampling for r in batch]
+        )
+        batch_run_time_histogram.observe(loop.time() - run_start)
+        tracing.spans.record("generate", int(run_start * 1e9), size=len(batch))
+
+        # Every row is padded to the longest prompt and generated to the largest budget
+        real = sum(prompt_lengths) + sum(r.max_new_tokens for r in batch)
+        computed = len(batch) * (max(prompt_lengths) + max_tokens)
+        observe_padding(real, computed - real)
+
+        # Set results for each request
         for i, r in enumerate(batch):
-            generated_ids = output[i][input_lengths[i]:]
-            text = tokenizer.decode(generated_ids, skip_special_tokens=True)
-            text = text.lstrip("\n ").rstrip()
+            # The caller may have gone away (future cancelled) during the forward pass
+            if r.future.done():
+                REQUESTS_CANCELLED.inc()
+                continue
+            text = texts[i]
+            if r.sampling.stop:
+                text = truncate_at_stop(text, r.sampling.stop)[0].rstrip()
             r.future.set_result(text)
 
-        
-        
+            # Static batches can't stream mid-generation; flush the whole output at once
+            if r.stream is not None:
+                for token_id in generated[i]:
+                    r.stream.put_nowait(token_id)
+                r.stream.put_nowait(STREAM_END)
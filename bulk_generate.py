@@ -0,0 +1,226 @@
+# bulk_generate.py
+# Offline bulk generation: stream a JSONL (or Parquet) file of prompts through
+# the static batching path at full throughput, without the HTTP server.
+#
+#   python bulk_generate.py prompts.jsonl outputs.jsonl --batch-size 64
+#
+# Input records: {"prompt": str, "id": optional, "max_new_tokens": optional int}
+# Output lines:  {"id": ..., "output": str, "prompt_tokens": int, "generated_tokens": int}
+#
+# - Input is read lazily; only one sort window (batch_size x window_batches
+#   records) is held in memory at a time, whatever the input size
+# - Each window is sorted by (max_new_tokens, prompt length) and cut into batches,
+#   so rows in a batch need similar padding and generate to similar lengths
+# - Results are appended as batches finish; after each window the output is
+#   flushed and a checkpoint (input position, output size) is written atomically.
+#   Rerunning the same command resumes after the last completed window.
+#   Outputs within a window are in batch order, not input order; use "id".
+
+import argparse
+import json
+import os
+import time
+from typing import Iterator, List, Optional, Tuple
+
+from batch_processor import run_batch
+from batch_former import observe_padding
+from model import PROFILES, default_device, load_model
+
+
+def iter_jsonl(path: str, offset: int = 0) -> Iterator[Tuple[dict, Optional[int]]]:
+    """
+    Yields (record, byte offset just past the record), starting at `offset`.
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        line_no = 0
+        for line in iter(f.readline, b""):
+            line_no += 1
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"{path}: invalid JSON on line {line_no} after offset {offset}: {e}") from None
+                yield record, f.tell()
+
+
+def iter_parquet(path: str, skip: int = 0, batch_rows: int = 1024) -> Iterator[Tuple[dict, Optional[int]]]:
+    """
+    Yields (record, None) row by row, reading batch_rows at a time; skips the first `skip` rows.
+    """
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Parquet input needs pyarrow: pip install pyarrow")
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_rows):
+        rows = batch.to_pylist()
+        if skip >= len(rows):
+            skip -= len(rows)
+            continue
+        for record in rows[skip:]:
+            yield record, None
+        skip = 0
+
+
+def iter_windows(records: Iterator[Tuple[dict, Optional[int]]], size: int, first_index: int):
+    """
+    Group records into windows of `size`: yields (items, input offset after the window),
+    items being (index, record) with index counted from the start of the input.
+    """
+    window, offset, index = [], None, first_index
+    for record, offset in records:
+        window.append((index, record))
+        index += 1
+        if len(window) == size:
+            yield window, offset
+            window = []
+    if window:
+        yield window, offset
+
+
+def generated_length(ids: List[int], eos_token_id: int) -> int:
+    """
+    Tokens generated before the row finished (pad == eos after a row stops).
+    """
+    return ids.index(eos_token_id) if eos_token_id in ids else len(ids)
+
+
+class Checkpoint:
+    """
+    Progress of one job: input records done, where to resume reading, output size
+    at that point, and running totals for the tokens/sec report.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = 0
+        self.input_offset = 0
+        self.output_bytes = 0
+        self.generated_tokens = 0
+        self.elapsed_s = 0.0
+
+    def load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as f:
+            self.__dict__.update({k: v for k, v in json.load(f).items() if k != "path"})
+        return True
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({k: v for k, v in self.__dict__.items() if k != "path"}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+
+def run(model, tokenizer, args) -> Checkpoint:
+    checkpoint = Checkpoint(args.checkpoint or args.output + ".ckpt")
+    resumed = checkpoint.load()
+    if resumed:
+        # Truncating a short file would extend it with NUL bytes instead
+        size = os.path.getsize(args.output) if os.path.exists(args.output) else None
+        if size is None or size < checkpoint.output_bytes:
+            found = "is missing" if size is None else f"has {size} bytes"
+            raise SystemExit(
+                f"{args.output} {found} but checkpoint {checkpoint.path} expects {checkpoint.output_bytes} bytes; "
+                f"restore the output or delete the checkpoint to start over"
+            )
+        print(f"Resuming after {checkpoint.records} records")
+
+    parquet = args.input.endswith(".parquet")
+    records = (
+        iter_parquet(args.input, skip=checkpoint.records)
+        if parquet
+        else iter_jsonl(args.input, offset=checkpoint.input_offset)
+    )
+
+    # Drop anything written after the last checkpoint (a window that didn't finish)
+    out = open(args.output, "r+b" if resumed else "wb")
+    out.truncate(checkpoint.output_bytes)
+    out.seek(checkpoint.output_bytes)
+
+    eos = tokenizer.eos_token_id
+    start = time.perf_counter() - checkpoint.elapsed_s
+    window_size = args.batch_size * args.window_batches
+
+    with out:
+        for window, input_offset in iter_windows(records, window_size, checkpoint.records):
+            # Sort the window so each batch shares output budget and prompt length
+            window.sort(key=lambda item: (
+                item[1].get("max_new_tokens") or args.max_new_tokens, len(item[1]["prompt"])
+            ))
+            for b in range(0, len(window), args.batch_size):
+                batch = window[b:b + args.batch_size]
+                prompts = [record["prompt"] for _, record in batch]
+                budgets = [record.get("max_new_tokens") or args.max_new_tokens for _, record in batch]
+                texts, generated, prompt_lengths = run_batch(model, tokenizer, prompts, max(budgets))
+
+                width = max(prompt_lengths)
+                observe_padding(sum(prompt_lengths), width * len(batch) - sum(prompt_lengths))
+
+                lines = []
+                for row, ((index, record), budget) in enumerate(zip(batch, budgets)):
+                    ids = generated[row, :budget].tolist()
+                    n = generated_length(ids, eos)
+                    text = texts[row]
+                    if budget < generated.shape[1]:
+                        text = tokenizer.decode(ids, skip_special_tokens=True).lstrip("\n ").rstrip()
+                    checkpoint.generated_tokens += n
+                    lines.append(json.dumps({
+                        "id": record.get("id", index),
+                        "output": text,
+                        "prompt_tokens": prompt_lengths[row],
+                        "generated_tokens": n,
+                    }) + "\n")
+                out.write("".join(lines).encode())
+
+            out.flush()
+            os.fsync(out.fileno())
+            checkpoint.records += len(window)
+            if input_offset is not None:
+                checkpoint.input_offset = input_offset
+            checkpoint.output_bytes = out.tell()
+            checkpoint.elapsed_s = time.perf_counter() - start
+            checkpoint.save()
+
+            print(
+                f"{checkpoint.records} records, {checkpoint.generated_tokens} tokens, "
+                f"{checkpoint.generated_tokens / max(checkpoint.elapsed_s, 1e-9):.1f} tokens/sec"
+            )
+
+    print(
+        f"Done: {checkpoint.records} records, {checkpoint.generated_tokens} generated tokens "
+        f"in {checkpoint.elapsed_s:.1f}s ({checkpoint.generated_tokens / max(checkpoint.elapsed_s, 1e-9):.1f} tokens/sec)"
+    )
+    return checkpoint
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate outputs for a JSONL/Parquet file of prompts.")
+    parser.add_argument("input", help="prompts (.jsonl, or .parquet with pyarrow installed)")
+    parser.add_argument("output", help="results (.jsonl), appended incrementally")
+    parser.add_argument("--model", default="distilgpt2")
+    parser.add_argument("--device", default=default_device())
+    parser.add_argument("--profile", default="fp32", choices=sorted(PROFILES),
+                        help="execution profile (int8 = dynamic quantization, CPU only)")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads (default: torch's choice)")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--window-batches", type=int, default=16,
+                        help="batches per sort window (memory is bounded by batch_size x window_batches records)")
+    parser.add_argument("--max-new-tokens", type=int, default=64, help="for records that don't set their own")
+    parser.add_argument("--checkpoint", default=None, help="defaults to OUTPUT.ckpt")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    model, tokenizer = load_model(
+        args.model, device=args.device, profile=args.profile, num_threads=args.threads
+    )
+    run(model, tokenizer, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# experiments/autoscaler_simulator.py
+# Offline trace replay for the autoscaling policies in serving/scaling_policy.py.
+# Arrival timestamps go through a simulated worker pool; each policy is scored on
+# queue-time SLO violations vs. worker-seconds spent.
+#
+# Worker model: each active worker completes SERVICE_RATE requests/sec (its
+# batched throughput), a new worker serves nothing for STARTUP_S seconds but is
+# billed from the moment it is requested, and removed workers stop billing at once.
+#
+# Run from the repo root:
+#   python -m experiments.autoscaler_simulator                  # synthetic bursty trace
+#   python -m experiments.autoscaler_simulator trace.json       # recorded trace
+#
+# A trace is a JSON list of arrival timestamps in seconds, or of objects with a
+# "timestamp" field, or a results file from experiments/benchmark.py.
+
+import json
+import math
+import random
+import sys
+from collections import deque
+
+from serving.scaling_policy import PredictivePolicy, QueueThresholdPolicy, ScalingObservation
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+SERVICE_RATE = 4.0        # requests/sec per worker
+STARTUP_S = 3.0           # time before a new worker takes requests
+QUEUE_TIME_SLO_S = 1.0
+INTERVAL_S = 1.0          # autoscaler monitor interval
+TICK_S = 0.05
+MIN_WORKERS = 1
+MAX_WORKERS = 8
+SEED = 0
+
+
+def load_trace(path):
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data["requests"]  # experiments/benchmark.py results
+    times = sorted(float(x["timestamp"] if isinstance(x, dict) else x) for x in data)
+    return [t - times[0] for t in times]
+
+
+def synthetic_trace(duration_s=600, seed=SEED):
+    """
+    Poisson arrivals whose rate follows a slow daily-style wave plus short bursts.
+    """
+    rng = random.Random(seed)
+    times, t = [], 0.0
+    peak = 0.0
+    while t < duration_s:
+        base = 4 + 6 * (1 + math.sin(2 * math.pi * t / 300)) / 2
+        if rng.random() < 0.002:
+            peak = t + rng.uniform(5, 20)
+        rate = base * (3 if t < peak else 1)
+        t += rng.expovariate(rate)
+        times.append(t)
+    return times
+
+
+class FixedPolicy:
+    """
+    Baseline: a static pool provisioned for peak.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+
+    def desired_workers(self, obs):
+        return self.workers
+
+
+def simulate(trace, policy, initial_workers=MIN_WORKERS):
+    queue = deque()
+    waits = []
+    active = initial_workers
+    starting = deque()        # ready times of workers still starting up
+    credit = 0.0
+    worker_seconds = 0.0
+    arrivals = completions = 0
+    next_arrival = 0
+    next_decision = INTERVAL_S
+    end = trace[-1] if trace else 0.0
+    t = 0.0
+
+    while next_arrival < len(trace) or queue:
+        t += TICK_S
+        while starting and starting[0] <= t:
+            starting.popleft()
+            active += 1
+
+        while next_arrival < len(trace) and trace[next_arrival] <= t:
+            queue.append(trace[next_arrival])
+            next_arrival += 1
+            arrivals += 1
+
+        credit += active * SERVICE_RATE * TICK_S
+        while queue and credit >= 1.0:
+            waits.append(t - queue.popleft())
+            credit -= 1.0
+            completions += 1
+        if not queue:
+            credit = min(credit, 1.0)
+
+        worker_seconds += (active + len(starting)) * TICK_S
+
+        if t >= next_decision:
+            obs = ScalingObservation(
+                now=t,
+                interval=INTERVAL_S,
+                arrivals=arrivals,
+                completions=completions,
+                queue_depth=len(queue),
+                workers=active + len(starting),
+                starting=len(starting),
+            )
+            arrivals = completions = 0
+            desired = max(MIN_WORKERS, min(MAX_WORKERS, policy.desired_workers(obs)))
+            current = active + len(starting)
+            for _ in range(desired - current):
+                starting.append(t + STARTUP_S)
+            for _ in range(current - desired):
+                # Cancel a worker that is still starting before stopping a live one
+                if starting:
+                    starting.pop()
+                else:
+                    active -= 1
+            next_decision += INTERVAL_S
+
+        if t > end + 3600:
+            break
+
+    waits.sort()
+    n = len(waits)
+    violations = sum(w > QUEUE_TIME_SLO_S for w in waits)
+    return {
+        "requests": n,
+        "slo_violation_pct": 100 * violations / n if n else 0.0,
+        "p99_queue_s": waits[min(n - 1, int(0.99 * n))] if n else 0.0,
+        "worker_seconds": worker_seconds,
+    }
+
+
+def main():
+    trace = load_trace(sys.argv[1]) if len(sys.argv) > 1 else synthetic_trace()
+    print(f"{len(trace)} arrivals over {trace[-1]:.0f}s, "
+          f"service rate {SERVICE_RATE}/s per worker, startup {STARTUP_S}s")
+
+    policies = [
+        ("queue_threshold", QueueThresholdPolicy(), MIN_WORKERS),
+        ("predictive", PredictivePolicy(
+            queue_time_slo_s=QUEUE_TIME_SLO_S,
+            horizon_s=STARTUP_S,
+            initial_service_rate=SERVICE_RATE,
+        ), MIN_WORKERS),
+        ("predictive_util_0.85", PredictivePolicy(
+            target_utilization=0.85,
+            queue_time_slo_s=QUEUE_TIME_SLO_S,
+            horizon_s=STARTUP_S,
+            initial_service_rate=SERVICE_RATE,
+        ), MIN_WORKERS),
+        (f"fixed_{MAX_WORKERS}", FixedPolicy(MAX_WORKERS), MAX_WORKERS),
+    ]
+
+    print(f"{'policy':<22} {'SLO viol %':>10} {'p99 queue s':>12} {'worker-s':>10}")
+    for name, policy, initial_workers in policies:
+        result = simulate(trace, policy, initial_workers=initial_workers)
+        print(f"{name:<22} {result['slo_violation_pct']:>10.2f} "
+              f"{result['p99_queue_s']:>12.2f} {result['worker_seconds']:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# experiments/batch_overhead_benchmark.py
+# Micro-benchmark for the per-batch Python overhead around model.generate:
+#   1. post-processing: the old per-request re-tokenize + decode vs. slicing
+#      at the padded width + one batch_decode
+#   2. event-loop stall: generating inline on the loop vs. on the inference thread
+#
+# Run from the repo root:
+#   python -m experiments.batch_overhead_benchmark
+
+import asyncio
+import time
+
+import torch
+
+from batch_processor import inference_executor, run_batch
+from model import load_model
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+MODEL_NAME = "distilgpt2"
+DEVICE = "cpu"
+BATCH_SIZES = [4, 16, 64]
+NEW_TOKENS = 32
+REPEATS = 50
+
+
+def make_prompts(n):
+    return [f"Request {i}: summarize the following paragraph about distributed systems" for i in range(n)]
+
+
+def legacy_postprocess(tokenizer, prompts, output):
+    # What batch_worker used to do after generate
+    input_lengths = [len(tokenizer(p)["input_ids"]) for p in prompts]
+    texts = []
+    for i in range(len(prompts)):
+        text = tokenizer.decode(output[i][input_lengths[i]:], skip_special_tokens=True)
+        texts.append(text.lstrip("\n ").rstrip())
+    return texts
+
+
+def batched_postprocess(tokenizer, prompt_width, output):
+    texts = tokenizer.batch_decode(output[:, prompt_width:], skip_special_tokens=True)
+    return [t.lstrip("\n ").rstrip() for t in texts]
+
+
+def bench_postprocess(tokenizer):
+    print("Post-processing overhead per batch (no model call):")
+    for n in BATCH_SIZES:
+        prompts = make_prompts(n)
+        inputs = tokenizer(prompts, return_tensors="pt", padding=True)
+        width = inputs["input_ids"].shape[1]
+        fake_new = torch.randint(0, tokenizer.vocab_size, (n, NEW_TOKENS))
+        output = torch.cat([inputs["input_ids"], fake_new], dim=1)
+
+        start = time.perf_counter()
+        for _ in range(REPEATS):
+            legacy_postprocess(tokenizer, prompts, output)
+        legacy_ms = (time.perf_counter() - start) / REPEATS * 1000
+
+        start = time.perf_counter()
+        for _ in range(REPEATS):
+            batched_postprocess(tokenizer, width, output)
+        batched_ms = (time.perf_counter() - start) / REPEATS * 1000
+
+        print(f"  batch={n:>3}: before={legacy_ms:.2f}ms after={batched_ms:.2f}ms")
+
+
+async def max_loop_lag(run):
+    """
+    Worst delay seen by a 1 ms ticker on the event loop while run() executes.
+    """
+    lag = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal lag
+        while not done:
+            t = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lag = max(lag, time.perf_counter() - t - 0.001)
+
+    tick = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    await run()
+    done = True
+    await tick
+    return lag
+
+
+async def bench_loop_stall(model, tokenizer):
+    prompts = make_prompts(BATCH_SIZES[0])
+
+    async def inline():
+        run_batch(model, tokenizer, prompts, NEW_TOKENS)
+
+    async def offloaded():
+        await asyncio.get_running_loop().run_in_executor(
+            inference_executor, run_batch, model, tokenizer, prompts, NEW_TOKENS
+        )
+
+    print("Worst event-loop stall during one batch:")
+    print(f"  inline on the loop:     {await max_loop_lag(inline) * 1000:.1f}ms")
+    print(f"  on inference_executor:  {await max_loop_lag(offloaded) * 1000:.1f}ms")
+
+
+async def main():
+    model, tokenizer = load_model(MODEL_NAME, device=DEVICE)
+    bench_postprocess(tokenizer)
+    await bench_loop_stall(model, tokenizer)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
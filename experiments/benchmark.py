@@ -0,0 +1,687 @@
+# experiments/benchmark.py
+# Reproducible load benchmark for the serving stack.
+#
+# - Open loop: requests are sent on a precomputed schedule (Poisson arrivals or
+#   a replayed trace) whether or not earlier ones have finished, and latency is
+#   measured from the scheduled send time, so a stalled server can't hide its
+#   queueing delay by slowing the client down (coordinated omission)
+# - Prompt and output lengths are drawn from configurable distributions;
+#   --repeat-fraction resends earlier prompts to exercise the caches (which only
+#   keep greedy or seeded outputs: pass --temperature 0 or --sample-seed)
+# - Requests scheduled during the first --warmup seconds are sent but not measured
+# - --bulk-fraction sends a share of requests at bulk priority (latency is then
+#   also reported per priority); with --kv-budget-mb the in-process loop bounds
+#   KV memory and preempts bulk requests for interactive ones (--preemption)
+# - Reports p50/p90/p99/p99.9 latency and TTFT, tokens/sec, and goodput
+#   (completed requests/sec meeting the latency and TTFT SLOs)
+# - Results are versioned JSON (summary + per-request records), comparable
+#   across runs with experiments/compare_results.py
+#
+# Targets:
+#   http       a running server (POST /generate, streaming for TTFT, over one
+#              pool of keep-alive connections; --batch-window-ms groups requests
+#              into /generate_batch calls)
+#   inprocess  enqueue_request straight into a batching loop in this process
+#              (or through the load balancer to a pool of workers, --workers),
+#              on the synthetic backend by default (no GPU, no download),
+#              optionally behind the server's cache + single-flight layers (--cache).
+#              With --synthetic-step-ms 0 (and zero per-token costs) the backend
+#              is free, so what's left is the serving stack's own overhead
+#
+# Run from the repo root:
+#   python -m experiments.benchmark --target inprocess --rate 20 --duration 30
+#   python -m experiments.benchmark --target inprocess --rate 5000 --batch-size 256 --workers 4 \
+#       --synthetic-step-ms 0 --synthetic-prefill-token-us 0 --synthetic-decode-token-us 0
+#   python -m experiments.benchmark --target http --url http://localhost:8000/generate \
+#       --arrival trace --trace results/cache_test_results.json
+#   python -m experiments.benchmark --help
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, List, Optional
+
+import numpy as np
+
+RESULTS_SCHEMA = "llm-benchmark"
+RESULTS_VERSION = 1
+PERCENTILES = [50, 90, 99, 99.9]
+
+WORDS = (
+    "explain describe summarize compare list why how what the a of in for to and "
+    "relativity gravity photosynthesis databases caching networks protein markets "
+    "history rome climate batteries compilers vaccines orbits algebra poetry jazz"
+).split()
+
+
+# -----------------------------
+# Workload
+# -----------------------------
+@dataclass
+class ScheduledRequest:
+    index: int
+    at: float                 # seconds after the start of the run
+    prompt: str
+    prompt_tokens: int
+    max_new_tokens: int
+    warmup: bool
+    priority: str = "interactive"   # batch_processor.PRIORITIES
+
+
+@dataclass
+class RequestRecord:
+    index: int
+    scheduled_s: float
+    prompt: str
+    prompt_tokens: int
+    max_new_tokens: int
+    warmup: bool
+    status: str = "ok"        # ok | rejected | error
+    latency_ms: Optional[float] = None
+    ttft_ms: Optional[float] = None
+    output_tokens: int = 0
+    cache_hit: bool = False
+    send_lag_ms: float = 0.0  # how late the client sent it vs. the schedule
+    priority: str = "interactive"
+    timestamp: float = field(default_factory=time.time)
+
+
+def length_distribution(spec: str) -> Callable[[random.Random], int]:
+    """
+    "fixed:N" | "uniform:LOW:HIGH" | "lognormal:MEDIAN:SIGMA" | "choice:A,B,C"
+    """
+    kind, _, params = spec.partition(":")
+    if kind == "fixed":
+        n = int(params)
+        return lambda rng: n
+    if kind == "uniform":
+        low, high = (int(x) for x in params.split(":"))
+        return lambda rng: rng.randint(low, high)
+    if kind == "lognormal":
+        median, sigma = (float(x) for x in params.split(":"))
+        return lambda rng: max(1, int(round(rng.lognormvariate(math.log(median), sigma))))
+    if kind == "choice":
+        values = [int(x) for x in params.split(",")]
+        return lambda rng: rng.choice(values)
+    raise ValueError(f"Unknown length distribution {spec!r}")
+
+
+def make_prompt(rng: random.Random, tokens: int, index: int) -> str:
+    # Unique first word, so distinct requests never collide in the caches
+    return " ".join([f"q{index}"] + [rng.choice(WORDS) for _ in range(tokens - 1)])
+
+
+def poisson_arrivals(rng: random.Random, rate: float, duration_s: float) -> List[float]:
+    times, t = [], rng.expovariate(rate)
+    while t < duration_s:
+        times.append(t)
+        t += rng.expovariate(rate)
+    return times
+
+
+def load_trace(path: str) -> List[dict]:
+    """
+    A JSON list of arrival timestamps, or of objects with "timestamp" and
+    optionally "prompt" / "prompt_tokens" / "max_new_tokens"; a results file
+    from this script (its "requests") works too.
+    Returns records sorted by time, timestamps rebased to 0.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data["requests"]
+    records = [x if isinstance(x, dict) else {"timestamp": x} for x in data]
+    records.sort(key=lambda r: float(r["timestamp"]))
+    start = float(records[0]["timestamp"])
+    return [dict(r, timestamp=float(r["timestamp"]) - start) for r in records]
+
+
+def build_schedule(args) -> List[ScheduledRequest]:
+    rng = random.Random(args.seed)
+    prompt_len = length_distribution(args.prompt_tokens)
+    output_len = length_distribution(args.output_tokens)
+
+    if args.arrival == "poisson":
+        trace = [{"timestamp": t} for t in poisson_arrivals(rng, args.rate, args.warmup + args.duration)]
+    else:
+        trace = load_trace(args.trace)
+
+    schedule, sent = [], []
+    for i, r in enumerate(trace):
+        if sent and rng.random() < args.repeat_fraction:
+            prompt, tokens, max_new = rng.choice(sent)
+        else:
+            tokens = int(r.get("prompt_tokens") or prompt_len(rng))
+            prompt = r.get("prompt") or make_prompt(rng, tokens, i)
+            max_new = int(r.get("max_new_tokens") or output_len(rng))
+            sent.append((prompt, tokens, max_new))
+        priority = "bulk" if rng.random() < args.bulk_fraction else "interactive"
+        schedule.append(
+            ScheduledRequest(i, r["timestamp"], prompt, tokens, max_new, r["timestamp"] < args.warmup, priority)
+        )
+    return schedule
+
+
+# -----------------------------
+# Targets
+# -----------------------------
+class HttpTarget:
+    """
+    POST /generate on a running server, through one serving.client.GenerationClient
+    (a pool of keep-alive connections shared by all requests). With streaming
+    (default), TTFT is the first SSE text event and output tokens are counted as
+    text events (a lower bound: a token that completes no character sends no event).
+    With batch_window_ms, requests due within that window (and sharing
+    max_new_tokens and priority) go out together as one streamed /generate_batch
+    call instead; each completes when its own result line arrives (no TTFT).
+    """
+
+    def __init__(
+        self,
+        url: str,
+        stream: bool = True,
+        timeout_s: float = 300.0,
+        sampling: Optional[dict] = None,
+        connections: int = 100,
+        batch_window_ms: float = 0.0,
+        max_batch: int = 256,
+    ):
+        """
+        url: the /generate endpoint; /generate_batch is next to it
+        sampling: extra request fields (temperature, seed, ...)
+        connections: size of the client's connection pool
+        """
+        self.base_url = url[:-len("/generate")] if url.endswith("/generate") else url
+        self.stream = stream
+        self.timeout_s = timeout_s
+        self.sampling = sampling or {}
+        self.connections = connections
+        self.batch_window_ms = batch_window_ms
+        self.max_batch = max_batch
+        self.client = None
+        self._groups = {}  # (max_new_tokens, priority) -> [(prompt, record, future)] not sent yet
+
+    async def __aenter__(self):
+        from serving.client import GenerationClient
+
+        self.client = GenerationClient(self.base_url, max_connections=self.connections, timeout_s=self.timeout_s)
+        await self.client.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.client.close()
+
+    async def send(self, req: ScheduledRequest, rec: RequestRecord, start: float):
+        from serving.client import GenerationError
+
+        if self.batch_window_ms > 0:
+            return await self._send_batched(req, rec)
+        settings = {"max_new_tokens": req.max_new_tokens, "priority": req.priority, **self.sampling}
+        try:
+            if not self.stream:
+                data = await self.client.generate(req.prompt, **settings)
+                rec.cache_hit = data.get("cache_hit", False)
+                return
+
+            async for event, data in self.client.generate_stream(req.prompt, **settings):
+                if event == "text":
+                    if rec.ttft_ms is None:
+                        rec.ttft_ms = (time.perf_counter() - start) * 1000
+                    rec.output_tokens += 1
+                elif event == "done":
+                    rec.cache_hit = data.get("cache_hit", False)
+                elif event == "error":
+                    rec.status = "rejected"
+        except GenerationError as e:
+            rec.status = "rejected" if e.status in (413, 429, 503) else "error"
+
+    async def _send_batched(self, req: ScheduledRequest, rec: RequestRecord):
+        key = (req.max_new_tokens, req.priority)
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = []
+            asyncio.get_running_loop().call_later(
+                self.batch_window_ms / 1000, lambda: asyncio.ensure_future(self._flush(key, group))
+            )
+        future = asyncio.get_running_loop().create_future()
+        group.append((req.prompt, rec, future))
+        if len(group) >= self.max_batch:
+            asyncio.ensure_future(self._flush(key, group))
+        await future
+
+    async def _flush(self, key, group):
+        from serving.client import GenerationError
+
+        if self._groups.get(key) is not group:
+            return  # already sent
+        del self._groups[key]
+        max_new_tokens, priority = key
+        try:
+            results = self.client.generate_batch_stream(
+                [prompt for prompt, _, _ in group], max_new_tokens=max_new_tokens, priority=priority, **self.sampling
+            )
+            async for item in results:
+                _, rec, future = group[item["index"]]
+                if "error" in item:
+                    rec.status = "rejected" if item["status_code"] in (413, 429, 503) else "error"
+                else:
+                    rec.cache_hit = item["cache_hit"]
+                future.set_result(None)
+        except GenerationError as e:
+            for _, rec, future in group:
+                if not future.done():
+                    rec.status = "rejected" if e.status in (413, 429, 503) else "error"
+                    future.set_result(None)
+        except Exception as e:
+            for _, _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            # The response ended early: whatever it didn't answer failed
+            for _, rec, future in group:
+                if not future.done():
+                    rec.status = "error"
+                    future.set_result(None)
+
+
+class InProcessTarget:
+    """
+    enqueue_request into a continuous (or static) batching loop in this process,
+    or with workers > 0, route_request through a load balancer to that many
+    serving.worker.Worker (continuous only, like the server).
+    TTFT and output tokens come from the request's token stream. With cache=True,
+    requests go through the server's miss path: memory cache, then single-flight.
+    """
+
+    def __init__(
+        self,
+        backend,
+        engine: str = "continuous",
+        batch_size: int = 8,
+        cache: bool = False,
+        workers: int = 0,
+        lb_policy: str = "consistent_hash",
+        sampling=None,
+        kv_budget_bytes: Optional[int] = None,
+        preemption: Optional[str] = "recompute",
+    ):
+        """
+        sampling: sampling.SamplingParams of every request (DEFAULT_SAMPLING if None)
+        kv_budget_bytes / preemption: continuous loop (each worker's), see scheduler.ContinuousBatchScheduler
+        """
+        from sampling import DEFAULT_SAMPLING
+
+        self.backend = backend
+        self.tokenizer = backend.tokenizer
+        self.engine = engine
+        self.batch_size = batch_size
+        self.use_cache = cache
+        self.workers = workers
+        self.lb_policy = lb_policy
+        self.sampling = sampling or DEFAULT_SAMPLING
+        self.kv_budget_bytes = kv_budget_bytes
+        self.preemption = preemption
+        self.worker = None
+        self.autoscaler = None
+
+    async def __aenter__(self):
+        from batch_processor import batch_worker, enqueue_request, MAX_QUEUE_SIZE, PRIORITY_INTERACTIVE
+        from scheduler import continuous_batch_worker
+
+        if self.workers:
+            from serving.autoscaler import AutoScaler
+            from serving.load_balancer import make_load_balancer
+
+            load_balancer = make_load_balancer(self.lb_policy)
+            self.autoscaler = AutoScaler(
+                self.backend,
+                load_balancer,
+                initial_workers=self.workers,
+                max_workers=self.workers,
+                min_workers=self.workers,
+                max_batch_size=self.batch_size,
+                kv_budget_bytes=self.kv_budget_bytes,
+                preemption=self.preemption,
+            )
+            self.submit = load_balancer.route_request
+        else:
+            self.queue = asyncio.Queue(maxsize=MAX_QUEUE_SIZE)
+            if self.engine == "continuous":
+                loop = continuous_batch_worker(
+                    self.backend,
+                    max_batch_size=self.batch_size,
+                    queue=self.queue,
+                    kv_budget_bytes=self.kv_budget_bytes,
+                    preemption=self.preemption,
+                )
+            else:
+                loop = batch_worker(self.backend, batch_size=self.batch_size, max_wait_ms=20, queue=self.queue)
+            self.worker = asyncio.create_task(loop)
+
+            async def submit(prompt, max_new_tokens, stream=None, sampling=None, priority=PRIORITY_INTERACTIVE):
+                return await enqueue_request(
+                    prompt, max_new_tokens, stream=stream, queue=self.queue, sampling=sampling, priority=priority
+                )
+            self.submit = submit
+
+        if self.use_cache:
+            from serving.cache import InMemoryCache, make_key
+            from serving.single_flight import SingleFlight
+
+            self.cache = InMemoryCache(ttl_seconds=300, max_entries=10_000, max_bytes=64 * 1024 * 1024, policy="tinylfu")
+            self.inflight = SingleFlight()
+            self.make_key = make_key
+        return self
+
+    async def __aexit__(self, *exc):
+        if self.autoscaler is not None:
+            self.autoscaler.min_workers = 0
+            while self.autoscaler.workers:
+                self.autoscaler.remove_worker()
+            await asyncio.gather(*self.autoscaler.draining)
+        else:
+            self.worker.cancel()
+
+    async def _generate(self, req: ScheduledRequest, rec: RequestRecord, start: float) -> str:
+        from batch_processor import PRIORITIES, STREAM_END
+
+        channel = asyncio.Queue()
+
+        async def consume():
+            while await channel.get() is not STREAM_END:
+                if rec.ttft_ms is None:
+                    rec.ttft_ms = (time.perf_counter() - start) * 1000
+                # The static loop generates every row to the batch's largest budget
+                rec.output_tokens = min(rec.output_tokens + 1, req.max_new_tokens)
+
+        consumer = asyncio.create_task(consume())
+        try:
+            text = await self.submit(
+                req.prompt, req.max_new_tokens, stream=channel, sampling=self.sampling, priority=PRIORITIES[req.priority]
+            )
+            # Both loops push STREAM_END before (or right after) resolving the request
+            await consumer
+            return text
+        finally:
+            consumer.cancel()
+
+    async def send(self, req: ScheduledRequest, rec: RequestRecord, start: float):
+        from batch_processor import RequestRejected
+
+        try:
+            # Like the server, only greedy or seeded requests use the cache
+            if not self.use_cache or not self.sampling.cacheable:
+                await self._generate(req, rec, start)
+                return
+            variant = self.sampling.variant()
+            cached = await self.cache.get(req.prompt, req.max_new_tokens, variant)
+            if cached is not None:
+                rec.cache_hit = True
+                rec.ttft_ms = (time.perf_counter() - start) * 1000
+                rec.output_tokens = len(self.tokenizer(cached)["input_ids"])
+                return
+
+            async def miss():
+                text = await self._generate(req, rec, start)
+                await self.cache.set(req.prompt, req.max_new_tokens, text, variant=variant)
+                return text
+
+            text = await self.inflight.run(self.make_key(req.prompt, req.max_new_tokens, variant), miss)
+            if rec.ttft_ms is None:
+                # Coalesced onto another request's generation: everything arrives at once
+                rec.ttft_ms = (time.perf_counter() - start) * 1000
+                rec.output_tokens = len(self.tokenizer(text)["input_ids"])
+        except RequestRejected:
+            rec.status = "rejected"
+
+
+# -----------------------------
+# Run + report
+# -----------------------------
+async def run_schedule(target, schedule: List[ScheduledRequest]) -> List[RequestRecord]:
+    records = []
+
+    async def one(req: ScheduledRequest, scheduled_at: float):
+        rec = RequestRecord(
+            req.index, req.at, req.prompt, req.prompt_tokens, req.max_new_tokens, req.warmup, priority=req.priority
+        )
+        rec.send_lag_ms = (time.perf_counter() - scheduled_at) * 1000
+        records.append(rec)
+        try:
+            await target.send(req, rec, scheduled_at)
+        except Exception as e:
+            rec.status = "error"
+            print(f"Request {req.index} failed: {e!r}")
+        # Measured from when the request was due, not when it was actually sent
+        rec.latency_ms = (time.perf_counter() - scheduled_at) * 1000
+
+    tasks = []
+    t0 = time.perf_counter()
+    for req in schedule:
+        delay = t0 + req.at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(req, t0 + req.at)))
+    await asyncio.gather(*tasks)
+    records.sort(key=lambda r: r.index)
+    return records
+
+
+def percentiles(values: List[float]) -> dict:
+    if not values:
+        return {f"p{p}": None for p in PERCENTILES}
+    return {f"p{p}": float(np.percentile(values, p)) for p in PERCENTILES}
+
+
+def summarize(records: List[RequestRecord], slo_latency_ms: float, slo_ttft_ms: Optional[float]) -> dict:
+    measured = [r for r in records if not r.warmup]
+    ok = [r for r in measured if r.status == "ok"]
+    if not measured:
+        return {"requests": 0}
+
+    # Measurement window: first measured arrival to last measured completion
+    window_start = min(r.scheduled_s for r in measured)
+    window_end = max(r.scheduled_s + (r.latency_ms or 0) / 1000 for r in measured)
+    elapsed = max(window_end - window_start, 1e-9)
+
+    def meets_slo(r):
+        return r.latency_ms <= slo_latency_ms and (
+            slo_ttft_ms is None or r.ttft_ms is None or r.ttft_ms <= slo_ttft_ms
+        )
+
+    good = [r for r in ok if meets_slo(r)]
+    return {
+        "requests": len(measured),
+        "completed": len(ok),
+        "rejected": sum(r.status == "rejected" for r in measured),
+        "errors": sum(r.status == "error" for r in measured),
+        "cache_hit_rate": sum(r.cache_hit for r in ok) / len(ok) if ok else None,
+        "elapsed_s": elapsed,
+        "throughput_rps": len(ok) / elapsed,
+        "tokens_per_sec": sum(r.output_tokens for r in ok) / elapsed,
+        "goodput_rps": len(good) / elapsed,
+        "goodput_fraction": len(good) / len(measured),
+        "latency_ms": percentiles([r.latency_ms for r in ok]),
+        "ttft_ms": percentiles([r.ttft_ms for r in ok if r.ttft_ms is not None]),
+        "send_lag_ms_max": max(r.send_lag_ms for r in measured),
+        "latency_ms_by_priority": {
+            priority: percentiles([r.latency_ms for r in ok if r.priority == priority])
+            for priority in sorted({r.priority for r in measured})
+        },
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(path: str, args, summary: dict, records: List[RequestRecord]):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({
+            "schema": RESULTS_SCHEMA,
+            "version": RESULTS_VERSION,
+            "created": datetime.now(timezone.utc).isoformat(),
+            "git_commit": git_commit(),
+            "config": vars(args),
+            "summary": summary,
+            "requests": [asdict(r) for r in records],
+        }, f, indent=2)
+
+
+def print_summary(summary: dict):
+    if not summary.get("requests"):
+        print("No measured requests")
+        return
+
+    def fmt(p):
+        return " ".join(f"{k}={v:.1f}" if v is not None else f"{k}=n/a" for k, v in p.items())
+
+    print(
+        f"requests={summary['requests']} completed={summary['completed']} "
+        f"rejected={summary['rejected']} errors={summary['errors']}"
+    )
+    print(f"latency ms: {fmt(summary['latency_ms'])}")
+    print(f"ttft ms:    {fmt(summary['ttft_ms'])}")
+    if len(summary["latency_ms_by_priority"]) > 1:
+        for priority, p in summary["latency_ms_by_priority"].items():
+            print(f"  {priority} latency ms: {fmt(p)}")
+    print(
+        f"throughput={summary['throughput_rps']:.2f} req/s tokens/sec={summary['tokens_per_sec']:.1f} "
+        f"goodput={summary['goodput_rps']:.2f} req/s ({summary['goodput_fraction']:.1%} within SLO)"
+    )
+    if summary["cache_hit_rate"]:
+        print(f"cache hit rate={summary['cache_hit_rate']:.1%}")
+    if summary["send_lag_ms_max"] > 50:
+        print(f"warning: client fell {summary['send_lag_ms_max']:.0f}ms behind schedule; results understate load")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Open-loop load benchmark for /generate or the in-process batching loop.")
+    parser.add_argument("--target", choices=["http", "inprocess"], default="inprocess")
+    parser.add_argument("--url", default="http://localhost:8000/generate")
+    parser.add_argument("--no-stream", action="store_true", help="http: plain JSON responses (no TTFT)")
+    parser.add_argument("--connections", type=int, default=100, help="http: client connection pool size")
+    parser.add_argument("--batch-window-ms", type=float, default=0.0,
+                        help="http: send requests due within this window as one /generate_batch call (0 = off)")
+
+    parser.add_argument("--arrival", choices=["poisson", "trace"], default="poisson")
+    parser.add_argument("--rate", type=float, default=10.0, help="poisson: requests/sec")
+    parser.add_argument("--trace", help="trace: JSON arrival trace (see load_trace)")
+    parser.add_argument("--duration", type=float, default=30.0, help="poisson: measured seconds after warm-up")
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds of requests sent but not measured")
+    parser.add_argument("--prompt-tokens", default="lognormal:32:0.6",
+                        help="fixed:N | uniform:LOW:HIGH | lognormal:MEDIAN:SIGMA | choice:A,B,C")
+    parser.add_argument("--output-tokens", default="choice:16,32,64,128")
+    parser.add_argument("--repeat-fraction", type=float, default=0.0, help="share of requests repeating an earlier prompt")
+    parser.add_argument("--seed", type=int, default=0, help="workload RNG")
+    parser.add_argument("--bulk-fraction", type=float, default=0.0, help="share of requests sent at bulk priority")
+    parser.add_argument("--temperature", type=float, default=0.7, help="request sampling temperature (0 = greedy)")
+    parser.add_argument("--sample-seed", type=int, default=None,
+                        help="request sampling seed: reproducible, cacheable outputs")
+
+    parser.add_argument("--slo-latency-ms", type=float, default=2000.0)
+    parser.add_argument("--slo-ttft-ms", type=float, default=500.0)
+
+    parser.add_argument("--backend", choices=["synthetic", "hf"], default="synthetic", help="inprocess: inference backend")
+    parser.add_argument("--model", default="distilgpt2", help="hf backend: model name for load_model")
+    parser.add_argument("--engine", choices=["continuous", "static"], default="continuous")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=0,
+                        help="inprocess: N workers behind a load balancer (0 = one loop, no load balancer)")
+    parser.add_argument("--lb-policy", default="consistent_hash", help="inprocess with --workers: load balancing policy")
+    parser.add_argument("--cache", action="store_true", help="inprocess: memory cache + single-flight in front")
+    parser.add_argument("--kv-budget-mb", type=float, default=None,
+                        help="inprocess continuous: KV cache budget of the loop (of each worker with --workers)")
+    parser.add_argument("--preemption", choices=["recompute", "swap", "off"], default="recompute",
+                        help="inprocess continuous: how bulk requests give way to interactive ones")
+    parser.add_argument("--synthetic-step-ms", type=float, default=10.0, help="synthetic: fixed cost per forward pass")
+    parser.add_argument("--synthetic-prefill-token-us", type=float, default=50.0, help="synthetic: cost per prompt token")
+    parser.add_argument("--synthetic-decode-token-us", type=float, default=200.0,
+                        help="synthetic: cost per sequence in a decode step")
+
+    parser.add_argument("--out", default=None, help="results JSON (default results/bench/<target>-<time>.json)")
+    args = parser.parse_args(argv)
+    if args.arrival == "trace" and not args.trace:
+        parser.error("--arrival trace needs --trace")
+    return args
+
+
+def make_inprocess_backend(args):
+    from backends import make_backend
+
+    if args.backend == "synthetic":
+        from backends.synthetic import LatencyModel
+
+        latency = LatencyModel(args.synthetic_step_ms, args.synthetic_prefill_token_us, args.synthetic_decode_token_us)
+        return make_backend("synthetic", latency=latency)
+
+    from model import load_model
+
+    model, tokenizer = load_model(args.model)
+    return make_backend("hf", model=model, tokenizer=tokenizer)
+
+
+async def run(args) -> dict:
+    schedule = build_schedule(args)
+    print(f"{len(schedule)} requests scheduled over {schedule[-1].at:.1f}s" if schedule else "Empty schedule")
+
+    if args.target == "http":
+        sampling = {"temperature": args.temperature}
+        if args.sample_seed is not None:
+            sampling["seed"] = args.sample_seed
+        target = HttpTarget(
+            args.url,
+            stream=not args.no_stream,
+            sampling=sampling,
+            connections=args.connections,
+            batch_window_ms=args.batch_window_ms,
+        )
+    else:
+        from sampling import SamplingParams
+
+        if args.workers and args.engine != "continuous":
+            raise SystemExit("--workers runs the server's continuous batching workers; drop --engine static")
+        target = InProcessTarget(
+            make_inprocess_backend(args),
+            args.engine,
+            args.batch_size,
+            args.cache,
+            args.workers,
+            args.lb_policy,
+            SamplingParams(temperature=args.temperature, seed=args.sample_seed),
+            kv_budget_bytes=int(args.kv_budget_mb * 1024 * 1024) if args.kv_budget_mb else None,
+            preemption=None if args.preemption == "off" else args.preemption,
+        )
+
+    async with target:
+        records = await run_schedule(target, schedule)
+
+    summary = summarize(records, args.slo_latency_ms, args.slo_ttft_ms)
+    print_summary(summary)
+    out = args.out or os.path.join(
+        "results", "bench", f"{args.target}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    save_results(out, args, summary, records)
+    print(f"Saved results to {out}")
+    return summary
+
+
+def main(argv=None):
+    return asyncio.run(run(parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# experiments/compare_results.py
+# Diff the summaries of two benchmark runs (experiments/benchmark.py results).
+# Prints every metric side by side with its relative change and exits non-zero
+# if a latency or throughput metric regressed by more than --threshold, so a CI
+# job can run the in-process benchmark on a fixed seed and compare to a baseline.
+#
+# Run from the repo root:
+#   python -m experiments.compare_results results/bench/base.json results/bench/new.json
+
+import argparse
+import json
+import sys
+
+from experiments.benchmark import RESULTS_SCHEMA, RESULTS_VERSION
+
+# Metrics where a larger value is worse; everything else is better when larger
+LOWER_IS_BETTER = ("latency_ms", "ttft_ms", "rejected", "errors", "send_lag_ms_max")
+# Metrics checked against --threshold
+GATED = (
+    "latency_ms.p50", "latency_ms.p99", "ttft_ms.p50", "ttft_ms.p99",
+    "tokens_per_sec", "goodput_rps",
+)
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("schema") != RESULTS_SCHEMA:
+        raise SystemExit(f"{path}: not a benchmark results file")
+    if data.get("version") != RESULTS_VERSION:
+        raise SystemExit(f"{path}: results version {data.get('version')}, expected {RESULTS_VERSION}")
+    return data
+
+
+def flatten(summary: dict, prefix: str = "") -> dict:
+    out = {}
+    for key, value in summary.items():
+        if isinstance(value, dict):
+            out.update(flatten(value, f"{prefix}{key}."))
+        else:
+            out[f"{prefix}{key}"] = value
+    return out
+
+
+def fmt(value) -> str:
+    return f"{value:.4g}" if isinstance(value, float) else str(value)
+
+
+def compare(base: dict, new: dict, threshold: float):
+    """
+    Yields (metric, base value, new value, relative change, regressed).
+    """
+    a, b = flatten(base["summary"]), flatten(new["summary"])
+    for metric in a.keys() | b.keys():
+        x, y = a.get(metric), b.get(metric)
+        if not isinstance(x, (int, float)) or not isinstance(y, (int, float)):
+            yield metric, x, y, None, False
+            continue
+        change = (y - x) / abs(x) if x else None
+        worse = change is not None and (change > 0 if metric.startswith(LOWER_IS_BETTER) else change < 0)
+        yield metric, x, y, change, worse and metric in GATED and abs(change) > threshold
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark results files.")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed relative regression (default 10%%)")
+    args = parser.parse_args(argv)
+
+    base, new = load(args.base), load(args.new)
+    print(f"base: {base['created']} {base.get('git_commit') or ''}")
+    print(f"new:  {new['created']} {new.get('git_commit') or ''}")
+
+    regressions = []
+    for metric, x, y, change, regressed in sorted(compare(base, new, args.threshold)):
+        delta = f"{change:+.1%}" if change is not None else ""
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{metric:<20} {fmt(x):>10} {fmt(y):>10} {delta:>8}{flag}")
+        if regressed:
+            regressions.append(metric)
+
+    if regressions:
+        print(f"{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
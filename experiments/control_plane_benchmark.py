@@ -0,0 +1,59 @@
+# experiments/control_plane_benchmark.py
+# Where does the Python serving path saturate? Sweeps the offered rate through
+# the in-process benchmark on a zero-cost synthetic backend, so every
+# millisecond measured is queueing, scheduling, streaming, load balancing and
+# caching overhead. Stops once completed throughput falls below
+# SATURATION_RATIO of the offered rate.
+#
+# Run from the repo root:
+#   python -m experiments.control_plane_benchmark
+
+import asyncio
+import json
+import os
+
+from experiments.benchmark import parse_args, run
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+RATES = [1_000, 2_000, 5_000, 10_000, 20_000, 50_000, 100_000]
+DURATION_S = 5.0
+SATURATION_RATIO = 0.9
+# Each configuration adds one layer of the stack
+CONFIGS = {
+    "scheduler": [],
+    "scheduler+cache": ["--cache", "--repeat-fraction", "0.5", "--sample-seed", "0"],
+    "load_balancer+4 workers": ["--workers", "4"],
+}
+BASE_ARGS = [
+    "--target", "inprocess", "--backend", "synthetic",
+    "--synthetic-step-ms", "0", "--synthetic-prefill-token-us", "0", "--synthetic-decode-token-us", "0",
+    "--batch-size", "256", "--prompt-tokens", "fixed:16", "--output-tokens", "fixed:8",
+    "--warmup", "1", "--duration", str(DURATION_S),
+]
+RESULTS_FILE = os.path.join("results", "control_plane_results.json")
+
+
+async def main():
+    results = {}
+    for name, extra in CONFIGS.items():
+        results[name] = []
+        for rate in RATES:
+            out = os.path.join("results", "bench", f"control-plane-{name.replace(' ', '_')}-{rate}.json")
+            summary = await run(parse_args(BASE_ARGS + extra + ["--rate", str(rate), "--out", out]))
+            results[name].append({"rate": rate, **summary})
+            achieved = summary.get("throughput_rps", 0.0)
+            print(f"{name} offered={rate}/s completed={achieved:.0f}/s p99={summary['latency_ms']['p99']:.1f}ms")
+            if achieved < SATURATION_RATIO * rate:
+                print(f"{name}: saturated at ~{achieved:.0f} req/s")
+                break
+
+    os.makedirs("results", exist_ok=True)
+    with open(RESULTS_FILE, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved results to {RESULTS_FILE}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,117 @@
+# experiments/execution_profile_benchmark.py
+# Execution profiles (model.PROFILES: fp32, bf16, dynamic int8) on CPU:
+# quality against fp32, latency, tokens/sec and resident memory.
+#
+# Each profile runs in a fresh process, so resident memory is its own.
+# Quality, on a fixed prompt set:
+#   - perplexity of the prompts under the profile (teacher-forced)
+#   - next-token agreement: share of positions where the profile's argmax
+#     matches fp32's, teacher-forced so one early divergence doesn't cascade
+# A profile is "ok" if agreement >= MIN_AGREEMENT and perplexity is within
+# MAX_PPL_INCREASE of fp32; pick the cheapest ok profile.
+#
+# Run from the repo root:
+#   python -m experiments.execution_profile_benchmark
+
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+import psutil
+import torch
+
+from batch_processor import run_batch
+from model import load_model
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+MODEL_NAME = "distilgpt2"
+PROFILES = ["fp32", "bf16", "int8"]
+NUM_THREADS = os.cpu_count() or 1
+INTEROP_THREADS = 1
+BATCH_SIZE = 8
+MAX_NEW_TOKENS = 32
+ROUNDS = 5
+MIN_AGREEMENT = 0.95
+MAX_PPL_INCREASE = 0.05
+
+PROMPTS = [
+    "The history of the Roman Empire begins with",
+    "To make a cup of tea, first boil the water and then",
+    "Machine learning models are trained by minimizing",
+    "The weather forecast for tomorrow says that",
+    "In a small village by the sea there lived an old fisherman who",
+    "The main difference between a list and a tuple in Python is",
+    "Photosynthesis is the process by which plants",
+    "The stock market fell sharply today after",
+]
+
+
+def measure(profile):
+    model, tokenizer = load_model(
+        MODEL_NAME, device="cpu", profile=profile, num_threads=NUM_THREADS, interop_threads=INTEROP_THREADS
+    )
+
+    # Quality: one teacher-forced forward pass per prompt
+    nll, count, predictions = 0.0, 0, []
+    with torch.no_grad():
+        for prompt in PROMPTS:
+            ids = tokenizer(prompt, return_tensors="pt").input_ids
+            logits = model(ids).logits.float()
+            nll += torch.nn.functional.cross_entropy(logits[0, :-1], ids[0, 1:], reduction="sum").item()
+            count += ids.shape[1] - 1
+            predictions.append(logits[0].argmax(-1).tolist())
+
+    # Speed: batched greedy generation through the serving path
+    prompts = (PROMPTS * (BATCH_SIZE // len(PROMPTS) + 1))[:BATCH_SIZE]
+    run_batch(model, tokenizer, prompts, MAX_NEW_TOKENS)  # warm-up
+    latencies, tokens = [], 0
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        _, generated, _ = run_batch(model, tokenizer, prompts, MAX_NEW_TOKENS)
+        latencies.append(time.perf_counter() - start)
+        tokens += generated.numel()
+
+    return {
+        "profile": profile,
+        "perplexity": float(np.exp(nll / count)),
+        "predictions": predictions,
+        "p50_batch_s": float(np.percentile(latencies, 50)),
+        "tokens_per_s": tokens / sum(latencies),
+        "rss_mb": psutil.Process().memory_info().rss / 2**20,
+    }
+
+
+def agreement(predictions, reference):
+    same = total = 0
+    for p, r in zip(predictions, reference):
+        same += sum(a == b for a, b in zip(p, r))
+        total += len(r)
+    return same / total
+
+
+def main():
+    # A fresh process per profile keeps resident memory and thread settings independent
+    ctx = mp.get_context("spawn")
+    results = []
+    for profile in PROFILES:
+        with ctx.Pool(1) as pool:
+            results.append(pool.apply(measure, (profile,)))
+
+    reference = next(r for r in results if r["profile"] == "fp32")
+    print(f"{MODEL_NAME} on CPU, {NUM_THREADS} threads, batch={BATCH_SIZE}, max_new_tokens={MAX_NEW_TOKENS}")
+    for r in results:
+        agree = agreement(r["predictions"], reference["predictions"])
+        ppl_increase = r["perplexity"] / reference["perplexity"] - 1
+        ok = agree >= MIN_AGREEMENT and ppl_increase <= MAX_PPL_INCREASE
+        print(
+            f"{r['profile']:<5} ppl={r['perplexity']:.2f} ({ppl_increase:+.1%}) agreement={agree:.1%} "
+            f"p50 batch={r['p50_batch_s'] * 1000:.0f}ms {r['tokens_per_s']:.1f} tokens/sec "
+            f"rss={r['rss_mb']:.0f}MB {'ok' if ok else 'REJECT'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
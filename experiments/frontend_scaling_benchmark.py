@@ -0,0 +1,115 @@
+# experiments/frontend_scaling_benchmark.py
+# Does HTTP throughput scale with the number of front-end processes?
+# Starts one engine process (python -m serving.engine) on the synthetic backend
+# and, for each FRONT_ENDS count and transport, `uvicorn --workers N` front ends
+# connected to it (ENGINE_SOCKET), then sweeps the offered rate through the
+# HTTP benchmark until completed throughput falls below SATURATION_RATIO of it.
+#
+# The workload is mostly cache hits (REPEAT_FRACTION), which front ends answer
+# on their own, plus misses that cross the transport to the engine. Each front
+# end has its own memory cache, so hits only scale once every process has seen
+# the prompt. Needs cores for the front ends and the load generator: on an
+# N-core box, expect scaling up to about N - 2 front ends.
+#
+# Run from the repo root:
+#   python -m experiments.frontend_scaling_benchmark
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+from experiments.benchmark import parse_args, run
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+FRONT_ENDS = [1, 2, 4, 8]
+TRANSPORTS = ["shm", "socket"]
+RATES = [250, 500, 1_000, 2_000, 4_000, 8_000]
+DURATION_S = 10.0
+SATURATION_RATIO = 0.9
+REPEAT_FRACTION = 0.8
+PORT = 8100
+SOCKET_PATH = "/tmp/llm-engine-bench.sock"
+ENV = {
+    **os.environ,
+    "INFERENCE_BACKEND": "synthetic",
+    "SYNTHETIC_STEP_MS": "1",
+    "DISK_CACHE_PATH": "",
+    "LOG_LEVEL": "WARNING",
+}
+BASE_ARGS = [
+    "--target", "http", "--no-stream", "--url", f"http://127.0.0.1:{PORT}/generate",
+    "--prompt-tokens", "fixed:16", "--output-tokens", "fixed:8",
+    "--repeat-fraction", str(REPEAT_FRACTION), "--sample-seed", "0",
+    "--warmup", "2", "--duration", str(DURATION_S),
+]
+RESULTS_FILE = os.path.join("results", "frontend_scaling_results.json")
+
+
+def wait_ready(url: str, timeout_s: float = 120.0):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as resp:
+                if resp.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"{url} not ready after {timeout_s}s")
+
+
+def start_front_ends(n: int, transport: str) -> subprocess.Popen:
+    env = {**ENV, "ENGINE_SOCKET": SOCKET_PATH, "ENGINE_TRANSPORT": transport}
+    front_ends = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "serving.app:app", "--port", str(PORT),
+         "--workers", str(n), "--log-level", "warning"],
+        env=env,
+    )
+    # Ready once a front end has connected to the engine; give the rest a moment too
+    wait_ready(f"http://127.0.0.1:{PORT}/health/ready")
+    time.sleep(1.0 + 0.25 * n)
+    return front_ends
+
+
+async def main():
+    engine = subprocess.Popen(
+        [sys.executable, "-m", "serving.engine", "--socket", SOCKET_PATH, "--metrics-port", "8003"], env=ENV
+    )
+    results = {}
+    try:
+        for transport in TRANSPORTS:
+            for n in FRONT_ENDS:
+                name = f"{n} front ends ({transport})"
+                front_ends = start_front_ends(n, transport)
+                results[name] = []
+                try:
+                    for rate in RATES:
+                        out = os.path.join("results", "bench", f"frontend-{transport}-{n}-{rate}.json")
+                        summary = await run(parse_args(BASE_ARGS + ["--rate", str(rate), "--out", out]))
+                        results[name].append({"rate": rate, **summary})
+                        achieved = summary.get("throughput_rps", 0.0)
+                        print(f"{name} offered={rate}/s completed={achieved:.0f}/s p99={summary['latency_ms']['p99']:.1f}ms")
+                        if achieved < SATURATION_RATIO * rate:
+                            print(f"{name}: saturated at ~{achieved:.0f} req/s")
+                            break
+                finally:
+                    front_ends.terminate()
+                    front_ends.wait()
+    finally:
+        engine.terminate()
+        engine.wait()
+
+    os.makedirs("results", exist_ok=True)
+    with open(RESULTS_FILE, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved results to {RESULTS_FILE}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
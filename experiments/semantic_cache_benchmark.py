@@ -0,0 +1,92 @@
+# experiments/semantic_cache_benchmark.py
+# Semantic cache tier: lookup latency and hit quality vs. index size, no model needed.
+# Cached prompts are queried back with small edits (case, punctuation, whitespace,
+# a dropped word) and compared against unrelated prompts that should miss.
+# Lookup latency should stay far below a single generation (tens of ms and up).
+#
+# Run from the repo root:
+#   python -m experiments.semantic_cache_benchmark
+
+import asyncio
+import random
+import time
+
+import numpy as np
+
+from serving.cache import InMemoryCache
+from serving.semantic_cache import HashingEncoder, SemanticCache
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+SIZES = [1_000, 10_000, 50_000]
+INDEXES = ["flat", "ivf"]
+THRESHOLD = 0.85
+QUERIES = 500
+MAX_NEW_TOKENS = 64
+SEED = 0
+
+WORDS = (
+    "explain describe summarize compare list why how what the a of in for to and "
+    "relativity gravity photosynthesis databases caching networks protein markets "
+    "history rome climate batteries compilers vaccines orbits algebra poetry jazz "
+    "economics neurons volcanoes encryption languages oceans bridges engines"
+).split()
+
+
+def make_prompt(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 14))).capitalize() + "?"
+
+
+def perturb(rng, prompt):
+    edits = [
+        lambda p: p.lower(),
+        lambda p: p.upper(),
+        lambda p: p.rstrip("?") + ".",
+        lambda p: "  " + p.replace(" ", "  ") + " ",
+        lambda p: " ".join(w for i, w in enumerate(p.split()) if i != len(p.split()) // 2),
+    ]
+    return rng.choice(edits)(prompt)
+
+
+async def bench(size, index, rng):
+    memory = InMemoryCache(max_entries=size + 1, max_bytes=1 << 30, policy="lru")
+    cache = SemanticCache(memory, memory, HashingEncoder(), threshold=THRESHOLD, max_entries=size, index=index)
+
+    prompts = list({make_prompt(rng) for _ in range(size * 2)})[:size]
+    for i, p in enumerate(prompts):
+        await cache.set(p, MAX_NEW_TOKENS, f"output {i}")
+
+    expected = {p: f"output {i}" for i, p in enumerate(prompts)}
+    known = set(prompts)
+    latencies, hits, wrong, false_hits = [], 0, 0, 0
+    for _ in range(QUERIES):
+        original = rng.choice(prompts)
+        start = time.perf_counter()
+        value = await cache.lookup(perturb(rng, original), MAX_NEW_TOKENS)
+        latencies.append(time.perf_counter() - start)
+        hits += value is not None
+        wrong += value is not None and value != expected[original]
+
+        unrelated = make_prompt(rng)
+        if unrelated not in known:
+            start = time.perf_counter()
+            false_hits += await cache.lookup(unrelated, MAX_NEW_TOKENS) is not None
+            latencies.append(time.perf_counter() - start)
+
+    ms = np.array(latencies) * 1000
+    print(
+        f"size={size:>6} index={index:<4} "
+        f"p50={np.percentile(ms, 50):.2f}ms p99={np.percentile(ms, 99):.2f}ms "
+        f"near-dup hit rate={hits / QUERIES:.1%} wrong={wrong} unrelated hits={false_hits}"
+    )
+
+
+async def main():
+    for size in SIZES:
+        for index in INDEXES:
+            await bench(size, index, random.Random(SEED))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+# experiments/speculative_decoding_benchmark.py
+# Speculative decoding vs. plain decoding in the continuous batching scheduler,
+# in-process on CPU. A small draft proposes NUM_DRAFT_TOKENS tokens per step and
+# the target verifies them in one forward pass; the output distribution is the
+# target's either way, so only wall-clock time and the acceptance rate change.
+# The gain is largest at small batch sizes, where a decode step is bound by
+# reading the target's weights rather than by compute.
+#
+# Run from the repo root:
+#   python -m experiments.speculative_decoding_benchmark
+
+import asyncio
+import json
+import os
+import time
+
+from backends.hf import HFBackend
+from batch_processor import enqueue_request
+from metrics import (
+    GENERATED_TOKENS,
+    SPECULATIVE_DRAFT_TOKENS,
+    SPECULATIVE_ACCEPTED_TOKENS,
+    speculative_tokens_per_forward_histogram,
+)
+from model import load_model
+from scheduler import continuous_batch_worker
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+TARGET_MODEL = "gpt2-medium"
+DRAFT_MODEL = "distilgpt2"   # must share the target's tokenizer
+DEVICE = "cpu"
+BATCH_SIZES = [1, 4]
+DRAFT_TOKENS = [2, 4, 6]
+NUM_REQUESTS = 8
+MAX_NEW_TOKENS = 64
+RESULTS_FILE = os.path.join("results", "speculative_decoding_results.json")
+
+PROMPT = "The history of the Roman Empire begins with"
+
+
+def histogram_totals(histogram):
+    total = count = 0.0
+    for metric in histogram.collect():
+        for sample in metric.samples:
+            if sample.name.endswith("_sum"):
+                total = sample.value
+            elif sample.name.endswith("_count"):
+                count = sample.value
+    return total, count
+
+
+async def run(target, tokenizer, batch_size, draft=None, num_draft_tokens=4):
+    queue = asyncio.Queue()
+    backend = HFBackend(target, tokenizer, draft_model=draft, num_draft_tokens=num_draft_tokens)
+    worker = asyncio.create_task(continuous_batch_worker(backend, max_batch_size=batch_size, queue=queue))
+    tokens_before = GENERATED_TOKENS._value.get()
+    drafted_before = SPECULATIVE_DRAFT_TOKENS._value.get()
+    accepted_before = SPECULATIVE_ACCEPTED_TOKENS._value.get()
+    per_forward_before = histogram_totals(speculative_tokens_per_forward_histogram)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        enqueue_request(f"{PROMPT} ({i})", MAX_NEW_TOKENS, queue=queue) for i in range(NUM_REQUESTS)
+    ])
+    elapsed = time.perf_counter() - start
+    worker.cancel()
+
+    drafted = SPECULATIVE_DRAFT_TOKENS._value.get() - drafted_before
+    accepted = SPECULATIVE_ACCEPTED_TOKENS._value.get() - accepted_before
+    per_forward = histogram_totals(speculative_tokens_per_forward_histogram)
+    forwards = per_forward[1] - per_forward_before[1]
+    return {
+        "tokens_per_sec": (GENERATED_TOKENS._value.get() - tokens_before) / elapsed,
+        "elapsed_s": elapsed,
+        "acceptance_rate": accepted / drafted if drafted else None,
+        "tokens_per_target_forward": (per_forward[0] - per_forward_before[0]) / forwards if forwards else 1.0,
+    }
+
+
+async def main():
+    target, tokenizer = load_model(TARGET_MODEL, device=DEVICE)
+    draft, _ = load_model(DRAFT_MODEL, device=DEVICE)
+
+    results = {}
+    for batch_size in BATCH_SIZES:
+        # Warm up both models at this shape before timing
+        await run(target, tokenizer, batch_size, draft, DRAFT_TOKENS[0])
+        baseline = await run(target, tokenizer, batch_size)
+        results[f"batch={batch_size} plain"] = baseline
+        print(f"batch={batch_size} plain: {baseline['tokens_per_sec']:.1f} tokens/sec")
+        for k in DRAFT_TOKENS:
+            r = await run(target, tokenizer, batch_size, draft, k)
+            r["speedup"] = r["tokens_per_sec"] / baseline["tokens_per_sec"]
+            results[f"batch={batch_size} k={k}"] = r
+            print(
+                f"batch={batch_size} k={k}: {r['tokens_per_sec']:.1f} tokens/sec (x{r['speedup']:.2f}) "
+                f"acceptance={r['acceptance_rate']:.1%} tokens/target forward={r['tokens_per_target_forward']:.2f}"
+            )
+
+    os.makedirs("results", exist_ok=True)
+    with open(RESULTS_FILE, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved results to {RESULTS_FILE}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
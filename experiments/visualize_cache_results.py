@@ -20,6 +20,10 @@ os.makedirs(OUTPUT_DIR, exist_ok=True)
 with open(RESULTS_FILE, "r") as f:
     data = json.load(f)
 
+# experiments/benchmark.py results: per-request records, warm-up excluded
+if isinstance(data, dict):
+    data = [r for r in data["requests"] if not r["warmup"] and r["status"] == "ok"]
+
 df = pd.DataFrame(data)
 
 # Convert timestamp to seconds if needed
@@ -0,0 +1,73 @@
+# experiments/worker_scaling_benchmark.py
+# Throughput vs. number of workers, in-process on CPU.
+# Each worker gets cores // workers torch threads, so on a multi-core box
+# tokens/sec should grow close to linearly with the worker count.
+#
+# Run from the repo root:
+#   python -m experiments.worker_scaling_benchmark
+
+import asyncio
+import os
+import time
+
+from backends.hf import HFBackend
+from metrics import GENERATED_TOKENS
+from model import load_model
+from serving.autoscaler import AutoScaler
+from serving.load_balancer import RoundRobinLoadBalancer
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+MODEL_NAME = "distilgpt2"
+DEVICE = "cpu"
+WORKER_COUNTS = [1, 2, 4]
+NUM_REQUESTS = 64
+MAX_NEW_TOKENS = 32
+MAX_BATCH_SIZE = 8
+
+
+async def run(backend, num_workers):
+    cores = os.cpu_count() or 1
+    lb = RoundRobinLoadBalancer()
+    scaler = AutoScaler(
+        backend,
+        lb,
+        initial_workers=num_workers,
+        max_workers=num_workers,
+        min_workers=num_workers,
+        max_batch_size=MAX_BATCH_SIZE,
+        prefix_cache_bytes=None,
+        threads_per_worker=max(1, cores // num_workers),
+    )
+
+    tokens_before = GENERATED_TOKENS._value.get()
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        lb.route_request(f"Request {i}: write a sentence about the sea", MAX_NEW_TOKENS)
+        for i in range(NUM_REQUESTS)
+    ])
+    elapsed = time.perf_counter() - start
+    tokens = GENERATED_TOKENS._value.get() - tokens_before
+
+    scaler.min_workers = 0
+    while scaler.workers:
+        scaler.remove_worker()
+    await asyncio.gather(*scaler.draining)
+    return tokens / elapsed
+
+
+async def main():
+    model, tokenizer = load_model(MODEL_NAME, device=DEVICE)
+    backend = HFBackend(model, tokenizer)
+    print(f"{os.cpu_count()} cores")
+
+    baseline = None
+    for n in WORKER_COUNTS:
+        tps = await run(backend, n)
+        baseline = baseline or tps
+        print(f"workers={n}: {tps:.1f} tokens/sec (x{tps / baseline:.2f})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
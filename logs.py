@@ -0,0 +1,67 @@
+import logging
+import os
+import sys
+import threading
+import time
+
+# DEBUG | INFO | WARNING | ERROR; per-request messages are DEBUG
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    At most `burst` records per call site (file, line) every `interval_s`;
+    the first record let through after a quiet window reports how many were
+    dropped. Keeps a message logged per request or per step from turning into
+    a hot-path cost (and a flood) under load.
+    """
+
+    def __init__(self, interval_s: float = 10.0, burst: int = 10):
+        super().__init__()
+        self.interval_s = interval_s
+        self.burst = burst
+        self._sites = {}  # (pathname, lineno) -> [window start, records let through, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= self.interval_s:
+                suppressed = site[2] if site else 0
+                site = self._sites[key] = [now, 0, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} [{suppressed} similar messages suppressed]"
+            if site[1] >= self.burst:
+                site[2] += 1
+                return False
+            site[1] += 1
+            return True
+
+
+_root = logging.getLogger("llm")
+_configure_lock = threading.Lock()
+
+
+def _configure():
+    with _configure_lock:
+        if _root.handlers:
+            return
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+        handler.addFilter(RateLimitFilter())
+        _root.addHandler(handler)
+        _root.setLevel(LOG_LEVEL)
+        # uvicorn configures the root logger too; don't print everything twice
+        _root.propagate = False
+
+
+def get_logger(component: str) -> logging.Logger:
+    """
+    Logger for one component ("llm.<component>"), sharing the rate-limited
+    stderr handler. Pass arguments lazily (log.debug("waited %.3fs", t)) so
+    disabled levels cost one comparison.
+    """
+    _configure()
+    return logging.getLogger(f"llm.{component}")
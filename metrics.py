@@ -26,6 +26,16 @@ queue_wait_time_histogram = Histogram(
 CACHE_HITS = Counter("llm_cache_hits_total", "Number of cache hits")
 CACHE_MISSES = Counter("llm_cache_misses_total", "Number of cache misses")
 
+# Per-tier cache lookups (memory tier, then the on-disk tier shared by server processes)
+CACHE_TIER_HITS = Counter("llm_cache_tier_hits_total", "Cache hits per tier", ["tier"])
+CACHE_TIER_MISSES = Counter("llm_cache_tier_misses_total", "Cache misses per tier", ["tier"])
+cache_tier_lookup_histogram = Histogram(
+    "llm_cache_tier_lookup_seconds",
+    "Time to look up a key in one cache tier",
+    ["tier"],
+    buckets=[0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1]
+)
+
 # Global per-worker request counter
 WORKER_REQUEST_COUNTER = Counter(
     "llm_worker_requests_total",
@@ -38,3 +48,161 @@ ACTIVE_WORKERS = Gauge(
     "llm_active_workers",
     "Number of active logical workers"
 )
+
+# Continuous batching: time spent in one scheduler decode step
+decode_step_time_histogram = Histogram(
+    "llm_decode_step_time_seconds",
+    "Time for one continuous-batching decode step across the running batch"
+)
+
+GENERATED_TOKENS = Counter(
+    "llm_generated_tokens_total",
+    "Total number of tokens generated"
+)
+
+# Streaming: time from request arrival to the first streamed token
+time_to_first_token_histogram = Histogram(
+    "llm_time_to_first_token_seconds",
+    "Time from request arrival to the first streamed token"
+)
+
+# Streaming: gap between consecutive streamed tokens of one request
+inter_token_latency_histogram = Histogram(
+    "llm_inter_token_latency_seconds",
+    "Time between consecutive streamed tokens of a request"
+)
+
+# Requests that joined an identical in-flight request instead of enqueueing
+COALESCED_REQUESTS = Counter(
+    "llm_coalesced_requests_total",
+    "Number of requests served by awaiting an identical in-flight request"
+)
+
+# Prefix (KV) cache: hit ratio = hits / lookups
+PREFIX_CACHE_LOOKUPS = Counter(
+    "llm_prefix_cache_lookups_total",
+    "Number of prompt prefix lookups in the KV prefix cache"
+)
+PREFIX_CACHE_HITS = Counter(
+    "llm_prefix_cache_hits_total",
+    "Number of prompts that reused at least one cached KV block"
+)
+PREFIX_CACHE_SAVED_TOKENS = Counter(
+    "llm_prefix_cache_saved_prefill_tokens_total",
+    "Prompt tokens whose prefill was skipped thanks to the prefix cache"
+)
+PREFIX_CACHE_BYTES = Gauge(
+    "llm_prefix_cache_bytes",
+    "Bytes of KV tensors held by the prefix cache"
+)
+
+# Tokens computed per batch, split into real tokens and padding
+BATCH_TOKENS = Counter(
+    "llm_batch_tokens_total",
+    "Tokens computed in batches, by kind",
+    ["kind"]  # real | padding
+)
+
+# Share of a batch's computed tokens that were real (1.0 = no padding)
+padding_efficiency_histogram = Histogram(
+    "llm_batch_padding_efficiency",
+    "Real tokens / (real + padding tokens) per batch",
+    buckets=[0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0]
+)
+
+# Static batch_worker: time to run one batch (tokenize + generate + decode)
+batch_run_time_histogram = Histogram(
+    "llm_batch_run_time_seconds",
+    "Time to run one static batch through the model"
+)
+
+# Current setpoints chosen by the adaptive batch controller
+BATCH_SIZE_SETPOINT = Gauge(
+    "llm_batch_size_setpoint",
+    "Batch size currently targeted by the batch controller"
+)
+MAX_WAIT_MS_SETPOINT = Gauge(
+    "llm_batch_max_wait_ms_setpoint",
+    "Batch-forming wait window (ms) currently set by the batch controller"
+)
+
+# Predictive autoscaler inputs and decision
+ARRIVAL_RATE_FORECAST = Gauge(
+    "llm_autoscaler_arrival_rate_forecast",
+    "Forecast request arrival rate (req/s) used by the autoscaler"
+)
+SERVICE_RATE_ESTIMATE = Gauge(
+    "llm_autoscaler_service_rate_estimate",
+    "Estimated requests/sec one worker completes when saturated"
+)
+DESIRED_WORKERS = Gauge(
+    "llm_autoscaler_desired_workers",
+    "Worker count the autoscaler's capacity model asks for"
+)
+
+# Admission control and load shedding
+REQUESTS_SHED = Counter(
+    "llm_requests_shed_total",
+    "Requests refused at admission (queue full or deadline can't be met)",
+    ["reason", "priority"]
+)
+REQUESTS_EXPIRED = Counter(
+    "llm_requests_expired_total",
+    "Queued requests dropped because their deadline passed before scheduling"
+)
+REQUESTS_CANCELLED = Counter(
+    "llm_requests_cancelled_total",
+    "Requests dropped or stopped early because the client went away"
+)
+
+# Startup pipeline (serving/startup.py)
+STARTUP_PHASE_SECONDS = Gauge(
+    "llm_startup_phase_seconds",
+    "Time spent in each startup phase of this process",
+    ["phase"]  # import | load_model | start_workers | warm_up | connect_engine | caches | total
+)
+READY = Gauge(
+    "llm_ready",
+    "1 once the model is loaded and warmed up and the server accepts generation requests"
+)
+
+# Speculative decoding: acceptance rate = accepted / drafted
+SPECULATIVE_DRAFT_TOKENS = Counter(
+    "llm_speculative_draft_tokens_total",
+    "Tokens proposed by the draft model"
+)
+SPECULATIVE_ACCEPTED_TOKENS = Counter(
+    "llm_speculative_accepted_tokens_total",
+    "Draft tokens accepted by the target model"
+)
+# Tokens each sequence gains per target forward pass (1 = no speedup, num_draft_tokens + 1 = all accepted)
+speculative_tokens_per_forward_histogram = Histogram(
+    "llm_speculative_tokens_per_target_forward",
+    "Tokens generated for a sequence per target-model forward pass",
+    buckets=[1, 2, 3, 4, 5, 6, 7, 8, 9]
+)
+
+# Request lifecycle phases (tracing.py); sampled, so counts are a fraction of all spans
+phase_time_histogram = Histogram(
+    "llm_phase_seconds",
+    "Time spent in one phase of a request or batch (sampled)",
+    ["phase"],  # tracing.PHASES
+    buckets=[0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30]
+)
+
+# KV-cache budgeting and preemption (scheduler.ContinuousBatchScheduler)
+KV_CACHE_BYTES = Gauge(
+    "llm_kv_cache_bytes",
+    "Estimated KV cache bytes of running sequences, summed over workers",
+    ["kind"]  # used (tokens so far) | reserved (prompt + max_new_tokens, what admission counts)
+)
+PREEMPTIONS = Counter(
+    "llm_preemptions_total",
+    "Running sequences paused to make room for more urgent requests",
+    ["mode"]  # swap | recompute
+)
+KV_SWAP_BYTES = Counter(
+    "llm_kv_swap_bytes_total",
+    "KV cache bytes copied between the device and host memory by preemption",
+    ["direction"]  # out | in
+)
@@ -1,21 +1,149 @@
+import os
+from dataclasses import dataclass
+from typing import Optional
+
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
 
+from logs import get_logger
+
+log = get_logger("model")
+
+
+@dataclass(frozen=True)
+class ExecutionProfile:
+    """
+    How the weights are stored and executed.
+    dtype: storage/compute dtype of the loaded weights
+    quantize: dynamic int8 quantization of the transformer's Linear layers
+        (weights int8, activations quantized per batch; CPU only)
+    """
+    dtype: torch.dtype
+    quantize: bool = False
+
+
+PROFILES = {
+    "fp32": ExecutionProfile(torch.float32),
+    "bf16": ExecutionProfile(torch.bfloat16),
+    "int8": ExecutionProfile(torch.float32, quantize=True),
+}
+
+
+def default_device() -> str:
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def configure_threads(num_threads: Optional[int] = None, interop_threads: Optional[int] = None):
+    """
+    Process-wide torch CPU thread pools.
+    num_threads: intra-op threads (one matmul split across cores); workers can
+        override it per inference thread (Worker threads_per_worker)
+    interop_threads: threads running independent ops concurrently; can only be
+        set before the first parallel op, so set it at startup
+    """
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError as e:
+            log.warning("Could not set interop threads to %d: %s", interop_threads, e)
+
+
+def _conv1d_to_linear(module: torch.nn.Module):
+    """
+    GPT-2 style models use transformers' Conv1D (x @ W + b, W stored as in x out)
+    for their projections. Swap them for equivalent nn.Linear so dynamic
+    quantization, which only knows nn.Linear, covers them.
+    """
+    from transformers.pytorch_utils import Conv1D
+
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            linear = torch.nn.Linear(child.weight.shape[0], child.weight.shape[1], dtype=child.weight.dtype)
+            linear.weight.data = child.weight.data.t().contiguous()
+            linear.bias.data = child.bias.data
+            setattr(module, name, linear)
+        else:
+            _conv1d_to_linear(child)
+
+
+def quantize_dynamic_int8(model):
+    """
+    Dynamic int8 quantization of every Linear in the transformer body.
+    The LM head stays in float: it is tied to the embeddings and quantizing it
+    costs the most quality for the least speedup.
+    """
+    _conv1d_to_linear(model.base_model)
+    torch.ao.quantization.quantize_dynamic(
+        model.base_model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+    return model
+
+
 def load_model(
     model_name="distilgpt2",
-    dtype=torch.float32,
+    dtype=None,
     compile_model=False,
+    device=None,
+    artifact_dir=None,
+    profile="fp32",
+    num_threads=None,
+    interop_threads=None,
 ):
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    """
+    profile: execution profile from PROFILES ("fp32", "bf16", "int8");
+        an explicit dtype overrides the profile's dtype
+    device: "cuda", "cpu", ...; defaults to CUDA when available, else CPU
+    num_threads, interop_threads: torch CPU thread pools (see configure_threads)
+    artifact_dir: local cache of the model already converted to `dtype`, saved as
+        safetensors on first load. Later loads read it from local disk with no hub
+        lookup or dtype conversion; safetensors are memory-mapped, so weights are
+        paged in instead of read and copied. It also holds the torch.compile
+        (inductor) cache, so compile_model=True reuses kernels across restarts.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown execution profile {profile!r}, expected one of {sorted(PROFILES)}")
+    execution = PROFILES[profile]
+    dtype = dtype or execution.dtype
+    device = device or default_device()
+    if execution.quantize and torch.device(device).type != "cpu":
+        raise ValueError(f"Profile {profile!r} (dynamic int8) runs on CPU only, got device={device!r}")
+    configure_threads(num_threads, interop_threads)
+
+    source, local = model_name, False
+    artifact = None
+    if artifact_dir:
+        artifact = os.path.join(artifact_dir, f"{model_name.replace('/', '--')}-{str(dtype).replace('torch.', '')}")
+        if os.path.exists(os.path.join(artifact, "config.json")):
+            source, local = artifact, True
+
+    tokenizer = AutoTokenizer.from_pretrained(source, local_files_only=local)
     tokenizer.pad_token = tokenizer.eos_token
+    # Decoder-only batching: pad on the left so every prompt ends at the same column
+    tokenizer.padding_side = "left"
 
     model = AutoModelForCausalLM.from_pretrained(
-        model_name,
+        source,
         torch_dtype=dtype,
-    ).cuda()
+        # Build the module on the meta device and load weights straight into it
+        # (memory-mapped from safetensors) instead of random init + copy
+        low_cpu_mem_usage=True,
+        local_files_only=local,
+    ).to(device)
     model.eval()
 
+    # The artifact holds float weights; quantization is cheap and redone on every load
+    if artifact is not None and not local:
+        model.save_pretrained(artifact, safe_serialization=True)
+        tokenizer.save_pretrained(artifact)
+
+    if execution.quantize:
+        quantize_dynamic_int8(model)
+
     if compile_model:
+        if artifact_dir:
+            os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.join(artifact_dir, "inductor"))
         model = torch.compile(model, mode="reduce-overhead")
 
     return model, tokenizer
@@ -0,0 +1,139 @@
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+
+from metrics import (
+    PREFIX_CACHE_LOOKUPS,
+    PREFIX_CACHE_HITS,
+    PREFIX_CACHE_SAVED_TOKENS,
+    PREFIX_CACHE_BYTES,
+)
+
+if TYPE_CHECKING:
+    import torch
+
+# One layer's (key, value) for a block: each [heads, block_size, head_dim]
+LayerKV = List[Tuple["torch.Tensor", "torch.Tensor"]]
+
+
+class _Node:
+    __slots__ = ("block", "parent", "children", "kv", "nbytes")
+
+    def __init__(self, block: Tuple[int, ...], parent: Optional["_Node"], kv: Optional[LayerKV]):
+        self.block = block
+        self.parent = parent
+        self.children: Dict[Tuple[int, ...], "_Node"] = {}
+        self.kv = kv
+        self.nbytes = sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in kv or [])
+
+
+class PrefixCache:
+    """
+    Radix tree of past_key_values keyed by token-id blocks.
+
+    - Each edge is one block of block_size token ids; a node holds the KV for
+      that block, so a path from the root is a cached token prefix
+    - lookup() returns the longest cached block-aligned prefix of a prompt
+    - insert() stores the blocks of a prompt the tree doesn't have yet
+    - Nodes are kept in LRU order, with a node always touched after its
+      descendants, so the least-recently-used node is always a leaf and can be
+      evicted without orphaning anything
+    """
+
+    def __init__(self, block_size: int = 16, max_bytes: int = 256 * 1024 * 1024):
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._root = _Node((), None, None)
+        self._lru: "OrderedDict[_Node, None]" = OrderedDict()
+
+    def _blocks(self, token_ids: Sequence[int], limit: int) -> List[Tuple[int, ...]]:
+        n = limit // self.block_size
+        return [tuple(token_ids[i * self.block_size:(i + 1) * self.block_size]) for i in range(n)]
+
+    def _touch(self, path: List[_Node]):
+        # Deepest first so every parent ends up more recent than its children
+        for node in reversed(path):
+            self._lru[node] = None
+            self._lru.move_to_end(node)
+
+    def lookup(self, token_ids: Sequence[int]) -> Tuple[int, Optional[LayerKV]]:
+        """
+        Longest cached prefix of token_ids, leaving at least one token to prefill
+        (the model needs it to produce next-token logits).
+        Returns (matched_tokens, per-layer (k, v) of shape [1, heads, matched, head_dim]).
+        """
+        PREFIX_CACHE_LOOKUPS.inc()
+        path = []
+        node = self._root
+        for block in self._blocks(token_ids, len(token_ids) - 1):
+            node = node.children.get(block)
+            if node is None:
+                break
+            path.append(node)
+
+        if not path:
+            return 0, None
+
+        self._touch(path)
+        matched = len(path) * self.block_size
+        PREFIX_CACHE_HITS.inc()
+        PREFIX_CACHE_SAVED_TOKENS.inc(matched)
+
+        # Only the HF backend caches prefixes; torch is imported on first use so
+        # the scheduler (and the synthetic backend) can be imported without it
+        import torch
+
+        num_layers = len(path[0].kv)
+        kv = [
+            (
+                torch.cat([n.kv[layer][0] for n in path], dim=1).unsqueeze(0),
+                torch.cat([n.kv[layer][1] for n in path], dim=1).unsqueeze(0),
+            )
+            for layer in range(num_layers)
+        ]
+        return matched, kv
+
+    def insert(self, token_ids: Sequence[int], kv: LayerKV):
+        """
+        Store the full blocks of a prompt.
+        kv: per-layer (k, v) of shape [heads, >= len(token_ids), head_dim] whose
+        first len(token_ids) positions belong to token_ids
+        """
+        bytes_before = self.bytes
+        path = []
+        node = self._root
+        for i, block in enumerate(self._blocks(token_ids, len(token_ids))):
+            child = node.children.get(block)
+            if child is None:
+                lo, hi = i * self.block_size, (i + 1) * self.block_size
+                # clone so the block doesn't keep the whole batch's KV alive
+                block_kv = [(k[:, lo:hi].clone(), v[:, lo:hi].clone()) for k, v in kv]
+                child = _Node(block, node, block_kv)
+                node.children[block] = child
+                self.bytes += child.nbytes
+            path.append(child)
+            node = child
+
+        if path:
+            self._touch(path)
+            self._evict(protect=set(path))
+        # inc/dec rather than set: each worker has its own prefix cache
+        PREFIX_CACHE_BYTES.inc(self.bytes - bytes_before)
+
+    def _evict(self, protect):
+        if self.bytes <= self.max_bytes:
+            return
+        for node in list(self._lru):
+            if self.bytes <= self.max_bytes:
+                break
+            if node in protect or node.children:
+                continue
+            del self._lru[node]
+            del node.parent.children[node.block]
+            self.bytes -= node.nbytes
+
+    def clear(self):
+        PREFIX_CACHE_BYTES.dec(self.bytes)
+        self.bytes = 0
+        self._root = _Node((), None, None)
+        self._lru.clear()
@@ -0,0 +1,97 @@
+# sampling.py
+# Per-request sampling parameters. The API process only needs this module; the
+# batched tensor kernels that apply them are in backends/sampling.py.
+#
+# Every row of a batch carries its own parameters, so requests with different
+# settings share one batch and one decode step. Random draws are a function of
+# (seed, position), not of the batch a request lands in, so a seeded request
+# gets the same output whatever it is batched with.
+
+import json
+from dataclasses import dataclass
+from typing import Optional, Sequence, Tuple
+
+
+@dataclass(frozen=True)
+class SamplingParams:
+    """
+    temperature: 0 = greedy (argmax); top_k / top_p / seed are then irrelevant
+    top_k: keep the k most likely tokens (0 = no limit)
+    top_p: nucleus sampling, keep the smallest set of tokens with this much mass
+    repetition_penalty: > 1 discourages tokens already in the prompt or output
+        (positive logits divided by it, negative ones multiplied, as in transformers)
+    seed: makes a sampled output reproducible (and cacheable)
+    stop: generation ends at the first of these strings, which is cut from the output
+    """
+    temperature: float = 0.7
+    top_k: int = 50
+    top_p: float = 1.0
+    repetition_penalty: float = 1.0
+    seed: Optional[int] = None
+    stop: Tuple[str, ...] = ()
+
+    def __post_init__(self):
+        if self.temperature < 0:
+            raise ValueError(f"temperature must be >= 0, got {self.temperature}")
+        if self.top_k < 0:
+            raise ValueError(f"top_k must be >= 0, got {self.top_k}")
+        if not 0 < self.top_p <= 1:
+            raise ValueError(f"top_p must be in (0, 1], got {self.top_p}")
+        if self.repetition_penalty <= 0:
+            raise ValueError(f"repetition_penalty must be > 0, got {self.repetition_penalty}")
+        if self.seed is not None and not 0 <= self.seed < 2 ** 63:
+            raise ValueError(f"seed must be in [0, 2**63), got {self.seed}")
+        if any(not s for s in self.stop):
+            raise ValueError("stop sequences must be non-empty")
+        object.__setattr__(self, "stop", tuple(self.stop))
+
+    @property
+    def greedy(self) -> bool:
+        return self.temperature == 0
+
+    @property
+    def cacheable(self) -> bool:
+        """
+        The same prompt always gets the same output: greedy or seeded.
+        Unseeded sampled outputs are one draw among many and are neither
+        cached nor shared between identical in-flight requests.
+        """
+        return self.greedy or self.seed is not None
+
+    def variant(self) -> str:
+        """
+        Canonical form of everything that changes the output, for cache keys.
+        """
+        if self.greedy:
+            fields = ["greedy", self.repetition_penalty, self.stop]
+        else:
+            fields = [self.temperature, self.top_k, self.top_p, self.repetition_penalty, self.seed, self.stop]
+        return json.dumps(fields, separators=(",", ":"))
+
+
+# What batch_processor.run_batch always used
+DEFAULT_SAMPLING = SamplingParams()
+
+
+def truncate_at_stop(text: str, stop: Sequence[str]) -> Tuple[str, bool]:
+    """
+    Cut text at the earliest stop sequence; returns (text, whether one was found).
+    """
+    cut = min((i for i in (text.find(s) for s in stop) if i >= 0), default=-1)
+    if cut < 0:
+        return text, False
+    return text[:cut], True
+
+
+def stop_prefix_length(text: str, stop: Sequence[str]) -> int:
+    """
+    Length of the longest suffix of text that could still grow into a stop
+    sequence; streaming holds that much back until it is decided.
+    """
+    longest = 0
+    for s in stop:
+        for n in range(min(len(s) - 1, len(text)), longest, -1):
+            if text.endswith(s[:n]):
+                longest = n
+                break
+    return longest
@@ -0,0 +1,464 @@
+import asyncio
+import time
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Tuple, Union
+
+import tracing
+from backends import InferenceBackend
+from batch_former import LengthBucketBatcher
+from logs import get_logger
+from batch_processor import (
+    GenerationRequest,
+    RequestRejected,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_NAMES,
+    request_queue,
+    inference_executor,
+    drop_if_stale,
+    STREAM_END,
+)
+from prefix_cache import PrefixCache
+from sampling import truncate_at_stop
+from metrics import (
+    batch_size_histogram,
+    queue_wait_time_histogram,
+    decode_step_time_histogram,
+    GENERATED_TOKENS,
+    KV_CACHE_BYTES,
+    PREEMPTIONS,
+    REQUESTS_CANCELLED,
+    REQUESTS_SHED,
+)
+
+log = get_logger("scheduler")
+
+# How a preempted sequence gives back its KV cache:
+#   swap: copied to host memory and copied back when it resumes (backend.supports_swap)
+#   recompute: dropped; on resume the prompt and the tokens generated so far
+#   are prefilled again (much of it from the prefix cache, if there is one)
+PREEMPTION_MODES = ("swap", "recompute")
+
+
+# Per-sequence decode state tracked by the scheduler (compared by identity)
+@dataclass(eq=False)
+class SequenceState:
+    request: GenerationRequest
+    generated: List[int] = field(default_factory=list)
+    streamed: int = 0                    # tokens already pushed to request.stream
+    stopped: bool = False                # output contains one of the request's stop sequences
+    token_ids: Optional[List[int]] = None  # the prompt, tokenized when first scheduled
+    swapped: Any = None                  # backend's handle while preempted by swapping out
+
+    def reserved_tokens(self) -> int:
+        # Admission reserves the sequence's longest possible KV cache up front,
+        # so running sequences never outgrow the budget
+        return len(self.token_ids) + self.request.max_new_tokens
+
+    def append(self, token_id: int):
+        self.generated.append(token_id)
+
+    def check_stop(self, tokenizer, new_tokens: int):
+        """
+        Look for a stop sequence in the text of the last tokens: enough of
+        them to hold the longest stop sequence plus the new_tokens just added.
+        Only rows with stop sequences pay for the decode.
+        """
+        stop = self.request.sampling.stop
+        if not stop or self.stopped:
+            return
+        window = max(len(s) for s in stop) + new_tokens + 1
+        tail = tokenizer.decode(self.generated[-window:], skip_special_tokens=True)
+        self.stopped = truncate_at_stop(tail, stop)[1]
+
+    def flush_stream(self):
+        if self.request.stream is not None:
+            for token_id in self.generated[self.streamed:]:
+                self.request.stream.put_nowait(token_id)
+        self.streamed = len(self.generated)
+
+    def finished(self, eos_token_id: int) -> bool:
+        if not self.generated:
+            return False
+        return (
+            self.generated[-1] == eos_token_id
+            or self.stopped
+            or len(self.generated) >= self.request.max_new_tokens
+            # The caller went away: free the slot instead of finishing the answer
+            or self.request.future.cancelled()
+        )
+
+
+class ContinuousBatchScheduler:
+    """
+    Iteration-level batching:
+    - Owns the decode loop, one token per step for every running sequence
+      (or several, if the backend decodes speculatively)
+    - Admits new requests into free slots between steps (prefill)
+    - Retires sequences as soon as they hit EOS, a stop sequence or their own max_new_tokens
+    - Optionally bounds KV memory (kv_budget_bytes): a sequence is admitted only
+      if the batch's KV cache, at every sequence's prompt + max_new_tokens,
+      stays within the budget, as estimated by the backend. A request that
+      can't fit even alone is refused (413)
+    - Waiting sequences are admitted most urgent class first, oldest first,
+      and never overtaken by less urgent or newer ones, so a long request
+      waits for room rather than starving. If it is more urgent than
+      running sequences, those are preempted (least urgent, newest first)
+      until it fits, and resume ahead of newer work of their own class
+    The model side (KV cache layout, prefix reuse, sampling) is the
+    backend's (backends.InferenceBackend); the scheduler keeps the running
+    batch's rows in the same order as the backend's batch state.
+
+    step() only calls the backend and touches scheduler state, so it can run
+    on the inference thread; deliver() hands tokens and results to the
+    waiting requests and must run on the event loop thread.
+    """
+
+    def __init__(
+        self,
+        backend: InferenceBackend,
+        max_batch_size: int = 8,
+        prefix_cache: Optional[PrefixCache] = None,
+        kv_budget_bytes: Optional[int] = None,
+        preemption: Optional[str] = "recompute",
+    ):
+        """
+        kv_budget_bytes: KV cache bytes this scheduler's batch may hold (None = unbounded)
+        preemption: "swap" or "recompute" (PREEMPTION_MODES), None to never
+            preempt; swap falls back to recompute if the backend can't swap
+        """
+        if preemption is not None and preemption not in PREEMPTION_MODES:
+            raise ValueError(f"Unknown preemption mode {preemption!r}, expected one of {PREEMPTION_MODES}")
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.prefix_cache = prefix_cache
+        self.eos_token_id = backend.eos_token_id
+        self.kv_budget_bytes = kv_budget_bytes
+        self.preemption = preemption
+
+        self.running: List[SequenceState] = []
+        self.waiting: List[SequenceState] = []   # new, or preempted and waiting to resume
+        # Retired, not yet delivered: the text, or the error to fail the request with
+        self.finished: List[Tuple[SequenceState, Union[str, Exception]]] = []
+        self.batch = backend.new_batch(prefix_cache)
+        self._preempted: List[SequenceState] = []
+        self._kv_bytes = {"used": 0, "reserved": 0}  # this scheduler's share of KV_CACHE_BYTES
+
+    def free_slots(self) -> int:
+        return self.max_batch_size - len(self.running) - len(self.waiting)
+
+    def preemptible_slots(self, priority: int) -> int:
+        """
+        Slots a request of this priority could take over from less urgent
+        running sequences, beyond free_slots() (0 if preemption is off).
+        """
+        if self.preemption is None:
+            return 0
+        victims = sum(1 for s in self.running if s.request.priority > priority)
+        claimed = sum(1 for s in self.waiting if s.request.priority <= priority)
+        return max(0, victims - claimed)
+
+    def has_work(self) -> bool:
+        return bool(self.running or self.waiting)
+
+    def add_request(self, req: GenerationRequest):
+        queue_wait_time_histogram.observe(asyncio.get_event_loop().time() - req.enqueue_time)
+        tracing.spans.record("queue_wait", int(req.enqueue_time * 1e9), trace_id=req.trace_id)
+        self.waiting.append(SequenceState(request=req))
+
+    def deliver(self):
+        """
+        Push newly generated tokens to streams and resolve finished requests.
+        Runs on the event loop thread: futures and asyncio queues aren't thread-safe.
+        """
+        for s in self.running:
+            s.flush_stream()
+        for s, result in self.finished:
+            s.flush_stream()
+            if s.request.stream is not None:
+                s.request.stream.put_nowait(STREAM_END)
+            if s.request.future.cancelled():
+                REQUESTS_CANCELLED.inc()
+            elif not s.request.future.done():
+                if isinstance(result, Exception):
+                    s.request.future.set_exception(result)
+                else:
+                    s.request.future.set_result(result)
+        self.finished = []
+
+    def abort(self, error: Exception) -> int:
+        """
+        Fail every sequence the scheduler holds (running, waiting or preempted)
+        with error and start over with an empty batch, e.g. after step()
+        raised and left the backend's batch state half-updated.
+        deliver() then resolves their futures. Returns how many were failed.
+        """
+        failed = self.running + self.waiting + self._preempted
+        for s in failed:
+            s.swapped = None
+            self.finished.append((s, error))
+        self.running, self.waiting, self._preempted = [], [], []
+        self.batch = self.backend.new_batch(self.prefix_cache)
+        self._update_kv_bytes()
+        return len(failed)
+
+    def step(self):
+        """
+        Run one scheduler iteration: admit waiting sequences (prefill, or swap
+        back in), then decode one token for every running sequence.
+        """
+        if self.waiting:
+            self._admit_waiting()
+            self._retire()
+
+        if not self.running:
+            self._update_kv_bytes()
+            return
+
+        start = time.perf_counter()
+        batch_size_histogram.observe(len(self.running))
+
+        decode_start = tracing.now()
+        new_tokens = self.backend.decode_step(self.batch)
+        tracing.spans.record("decode", decode_start, size=len(self.running))
+        generated = 0
+        tokenizer = self.backend.tokenizer
+        for s, tokens in zip(self.running, new_tokens):
+            added = 0
+            for t in tokens:
+                s.append(t)
+                added += 1
+                # Speculative steps may overshoot EOS or the budget
+                if s.finished(self.eos_token_id):
+                    break
+            s.check_stop(tokenizer, added)
+            generated += added
+        GENERATED_TOKENS.inc(generated)
+
+        self._retire()
+        self._update_kv_bytes()
+        decode_step_time_histogram.observe(time.perf_counter() - start)
+
+    def _fits(self, sequences: List[SequenceState]) -> bool:
+        if len(sequences) > self.max_batch_size:
+            return False
+        if self.kv_budget_bytes is None:
+            return True
+        return self.backend.kv_bytes([s.reserved_tokens() for s in sequences]) <= self.kv_budget_bytes
+
+    def _admit_waiting(self):
+        # Tokenize new requests once, unpadded; the backend builds padded batches from the id lists
+        new = [s for s in self.waiting if s.token_ids is None]
+        if new:
+            start = tracing.now()
+            for s, ids in zip(new, self.backend.tokenize([s.request.prompt for s in new])):
+                s.token_ids = ids
+            tracing.spans.record("tokenize", start, size=len(new))
+
+        self.waiting.sort(key=lambda s: (s.request.priority, s.request.enqueue_time))
+        admitted, blocked = [], []
+        for s in self.waiting:
+            if blocked:
+                blocked.append(s)
+            elif s.request.future.cancelled():
+                s.swapped = None  # drop its host copy of the KV, if any
+                self.finished.append((s, ""))
+            elif self.kv_budget_bytes is not None and not self._fits([s]):
+                name = PRIORITY_NAMES.get(s.request.priority, str(s.request.priority))
+                REQUESTS_SHED.labels(reason="kv_budget_exceeded", priority=name).inc()
+                self.finished.append((s, RequestRejected("kv_budget_exceeded", status_code=413, retry_after=0)))
+            elif self._fits(self.running + admitted + [s]) or self._preempt_for(s, admitted):
+                admitted.append(s)
+            else:
+                blocked.append(s)
+        # Sequences preempted just now wait with the rest (sorted in next time)
+        self.waiting = blocked + self._preempted
+        self._preempted = []
+
+        swapped = [s for s in admitted if s.swapped is not None]
+        if swapped:
+            start = tracing.now()
+            self.backend.swap_in(self.batch, [s.swapped for s in swapped])
+            tracing.spans.record("swap_in", start, size=len(swapped))
+            for s in swapped:
+                s.swapped = None
+                self.running.append(s)
+        fresh = [s for s in admitted if s not in swapped]
+        if fresh:
+            self._prefill(fresh)
+
+    def _preempt_for(self, s: SequenceState, admitted: List[SequenceState]) -> bool:
+        """
+        Preempt the fewest running sequences less urgent than s (least urgent,
+        newest first) that make room for it; False, preempting nothing, if
+        even all of them wouldn't.
+        """
+        if self.preemption is None:
+            return False
+        candidates = sorted(
+            (r for r in self.running if r.request.priority > s.request.priority),
+            key=lambda r: (r.request.priority, r.request.enqueue_time),
+            reverse=True,
+        )
+        remaining = list(self.running)
+        for n, victim in enumerate(candidates, 1):
+            remaining.remove(victim)
+            if self._fits(remaining + admitted + [s]):
+                self._preempt(candidates[:n])
+                return True
+        return False
+
+    def _preempt(self, victims: List[SequenceState]):
+        start = tracing.now()
+        rows = [i for i, r in enumerate(self.running) if r in victims]
+        mode = "swap" if self.preemption == "swap" and self.backend.supports_swap else "recompute"
+        if mode == "swap":
+            for i, handle in zip(rows, self.backend.swap_out(self.batch, rows)):
+                self.running[i].swapped = handle
+        keep = [i for i in range(len(self.running)) if i not in rows]
+        self.backend.retire(self.batch, keep)
+        self._preempted.extend(self.running[i] for i in rows)
+        self.running = [self.running[i] for i in keep]
+        PREEMPTIONS.labels(mode=mode).inc(len(rows))
+        tracing.spans.record("preempt", start, size=len(rows))
+
+    def _prefill(self, sequences: List[SequenceState]):
+        # A preempted sequence (recompute) is prefilled with its prompt and
+        # everything it generated, and continues from there
+        start = tracing.now()
+        token_ids = [s.token_ids + s.generated for s in sequences]
+        joined = self.backend.prefill(self.batch, token_ids, [s.request.sampling for s in sequences])
+        tracing.spans.record("prefill", start, size=len(sequences))
+        for i, tok in joined:
+            s = sequences[i]
+            s.append(tok)
+            s.check_stop(self.backend.tokenizer, 1)
+            self.running.append(s)
+        GENERATED_TOKENS.inc(len(sequences))
+
+    def _update_kv_bytes(self):
+        """
+        Move KV_CACHE_BYTES by the change in this scheduler's running sequences
+        (the gauge sums every worker's scheduler).
+        """
+        lengths = {
+            "used": [len(s.token_ids) + len(s.generated) for s in self.running],
+            "reserved": [s.reserved_tokens() for s in self.running],
+        }
+        for kind, values in lengths.items():
+            current = self.backend.kv_bytes(values)
+            KV_CACHE_BYTES.labels(kind=kind).inc(current - self._kv_bytes[kind])
+            self._kv_bytes[kind] = current
+
+    def _retire(self):
+        keep, done = [], []
+        for i, s in enumerate(self.running):
+            if s.finished(self.eos_token_id):
+                done.append(s)
+            else:
+                keep.append(i)
+
+        if done:
+            start = tracing.now()
+            texts = self.backend.detokenize([s.generated for s in done])
+            # The stop sequence and anything decoded after it are not part of the answer
+            texts = [
+                truncate_at_stop(text, s.request.sampling.stop)[0].rstrip() if s.stopped else text
+                for s, text in zip(done, texts)
+            ]
+            tracing.spans.record("detokenize", start, size=len(done))
+            self.finished.extend(zip(done, texts))
+
+        if len(keep) < len(self.running):
+            self.backend.retire(self.batch, keep)
+            self.running = [self.running[i] for i in keep]
+
+
+def continuous_batcher(max_batch_size: int = 8, controller=None) -> LengthBucketBatcher:
+    """
+    The look-ahead continuous_batch_worker uses unless given one; requests
+    in it are accepted but not yet running.
+    """
+    # Sequences retire individually, so only prompt length matters and free
+    # slots are always filled (closest lengths first) rather than left empty
+    return LengthBucketBatcher(
+        max_pending=4 * (controller.max_batch_size if controller else max_batch_size),
+        max_bucket_distance=None,
+        use_output_length=False,
+    )
+
+
+async def continuous_batch_worker(
+    backend: InferenceBackend,
+    max_batch_size: int = 8,
+    prefix_cache: Optional[PrefixCache] = None,
+    executor: Optional[Executor] = None,
+    batcher: Optional[LengthBucketBatcher] = None,
+    controller=None,
+    queue: Optional[asyncio.Queue] = None,
+    kv_budget_bytes: Optional[int] = None,
+    preemption: Optional[str] = "recompute",
+):
+    """
+    Background task driving ContinuousBatchScheduler from a request queue
+    (the global request_queue unless given).
+    Replaces batch_worker's fixed batch loop: requests arriving mid-generation
+    join at the next step instead of waiting for the whole batch to finish.
+    Free slots are filled with requests of similar length (batcher) so the
+    joint prefill wastes little on padding.
+    Each step runs on the inference executor so the event loop keeps
+    accepting requests while the backend computes.
+    If a controller (serving.batch_controller.BatchController) is given,
+    max_batch_size follows its batch_size setpoint.
+    kv_budget_bytes / preemption: see ContinuousBatchScheduler; interactive
+    requests may also take the slots of running bulk requests.
+    If a step raises, the requests in the batch fail with a 500 and the loop
+    carries on with an empty batch.
+    """
+    scheduler = ContinuousBatchScheduler(
+        backend,
+        max_batch_size=max_batch_size,
+        prefix_cache=prefix_cache,
+        kv_budget_bytes=kv_budget_bytes,
+        preemption=preemption,
+    )
+    if batcher is None:  # not `or`: an empty batcher is falsy
+        batcher = continuous_batcher(max_batch_size, controller)
+    loop = asyncio.get_running_loop()
+    executor = executor or inference_executor
+    if queue is None:
+        queue = request_queue
+    while True:
+        if controller is not None:
+            scheduler.max_batch_size = controller.batch_size
+
+        if not scheduler.has_work() and not batcher:
+            # Idle: block until a request arrives
+            batcher.add(await queue.get())
+
+        # Look ahead at queued requests, then admit a length-matched group into free slots
+        form_start = tracing.now()
+        while batcher.has_room() and not queue.empty():
+            batcher.add(queue.get_nowait())
+        # Expired or abandoned requests never take a slot
+        now = loop.time()
+        batcher.remove_if(lambda r: drop_if_stale(r, now))
+        admitted = batcher.next_batch(scheduler.free_slots())
+        for req in admitted:
+            scheduler.add_request(req)
+        urgent = batcher.next_batch(
+            scheduler.preemptible_slots(PRIORITY_INTERACTIVE), max_priority=PRIORITY_INTERACTIVE
+        )
+        for req in urgent:
+            scheduler.add_request(req)
+        admitted += urgent
+        if admitted:
+            tracing.spans.record("batch_form", form_start, size=len(admitted))
+
+        try:
+            await loop.run_in_executor(executor, scheduler.step)
+        except Exception as e:
+            # A backend error (e.g. out of memory) fails this batch, not the worker
+            failed = scheduler.abort(RequestRejected("internal_error", status_code=500, retry_after=0))
+            log.error("Scheduler step failed, failed %d requests: %r", failed, e)
+        scheduler.deliver()
@@ -0,0 +1,72 @@
+# serving/admission.py
+import asyncio
+from typing import Callable, Optional
+
+from batch_processor import RequestRejected, PRIORITY_INTERACTIVE, PRIORITY_NAMES
+from metrics import REQUESTS_SHED
+
+
+class AdmissionController:
+    """
+    Decides at the door whether a new request can be served in time.
+
+    - Queue bound: refuse with 503 once max_queue_depth requests are waiting;
+      bulk requests are refused earlier (bulk_queue_fraction), so interactive
+      traffic keeps headroom under overload
+    - Deadline: refuse with 429 if the estimated queue wait (waiting requests /
+      pool throughput) already exceeds the request's timeout, instead of
+      computing an answer the client will have stopped waiting for
+    - Both carry a Retry-After hint: the time for the current backlog to drain
+
+    Admitted requests get a deadline; workers drop them unscheduled if it
+    passes while they are still queued (batch_processor.drop_if_stale).
+    """
+
+    def __init__(
+        self,
+        queue_depth: Callable[[], int],
+        capacity: Callable[[], float],
+        max_queue_depth: int = 256,
+        bulk_queue_fraction: float = 0.5,
+        default_timeout_s: float = 30.0,
+        min_retry_after_s: float = 1.0,
+    ):
+        """
+        queue_depth: requests currently waiting (e.g. summed over worker queues)
+        capacity: requests/sec the pool completes when saturated
+        default_timeout_s: deadline for requests that don't set their own
+        """
+        self.queue_depth = queue_depth
+        self.capacity = capacity
+        self.max_queue_depth = max_queue_depth
+        self.bulk_queue_fraction = bulk_queue_fraction
+        self.default_timeout_s = default_timeout_s
+        self.min_retry_after_s = min_retry_after_s
+
+    def estimated_wait(self, depth: int) -> float:
+        rate = self.capacity()
+        return depth / rate if rate > 0 else float("inf")
+
+    def admit(self, priority: int = PRIORITY_INTERACTIVE, timeout_s: Optional[float] = None) -> float:
+        """
+        Returns the request's deadline (event-loop time) or raises RequestRejected.
+        """
+        timeout_s = self.default_timeout_s if timeout_s is None else timeout_s
+        depth = self.queue_depth()
+        wait = self.estimated_wait(depth)
+        retry_after = max(self.min_retry_after_s, min(wait, self.default_timeout_s))
+
+        limit = self.max_queue_depth
+        if priority != PRIORITY_INTERACTIVE:
+            limit = int(limit * self.bulk_queue_fraction)
+        if depth >= limit:
+            self._shed("queue_full", priority)
+            raise RequestRejected("queue_full", status_code=503, retry_after=retry_after)
+        if wait > timeout_s:
+            self._shed("deadline_unmeetable", priority)
+            raise RequestRejected("deadline_unmeetable", status_code=429, retry_after=retry_after)
+
+        return asyncio.get_running_loop().time() + timeout_s
+
+    def _shed(self, reason: str, priority: int):
+        REQUESTS_SHED.labels(reason=reason, priority=PRIORITY_NAMES.get(priority, str(priority))).inc()
@@ -1,107 +1,585 @@
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-import torch
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
 import asyncio
+import math
+import os
 import time
-from serving.cache import InMemoryCache
+from typing import List, Literal, Optional
+from serving.cache import InMemoryCache, make_key
+from serving.disk_cache import DiskCache, TieredCache
+from serving.semantic_cache import SemanticCache, HashingEncoder, ModelEncoder
+from concurrent.futures import ThreadPoolExecutor
+from serving.single_flight import SingleFlight
+from serving import codec
 from prometheus_client import start_http_server
-from model import load_model
 from batch_processor import enqueue_request, batch_worker  
 import batch_processor
+from batch_processor import STREAM_END, PRIORITIES, RequestRejected
 from metrics import REQUEST_COUNTER, REQUEST_LATENCY, batch_size_histogram, queue_wait_time_histogram, CACHE_HITS, CACHE_MISSES
-from serving.load_balancer import RoundRobinLoadBalancer
-from serving.worker import Worker
-from serving.autoscaler import AutoScaler
+from serving.engine import ENGINE_SOCKET, EngineClient, InferenceEngine
+from serving.streaming import sse_event, stream_tokens
+from serving.startup import StartupState
+from serving.transport import TRANSPORTS
+from sampling import SamplingParams
+import tracing
+from logs import get_logger
+
+log = get_logger("app")
 
 
 app = FastAPI(title="LLM Inference API with Batching")
 
-# Create load balancer
-load_balancer = RoundRobinLoadBalancer()
+# Model, workers and admission control (serving/engine.py) run in this process,
+# unless ENGINE_SOCKET is set: then this process is one of several front ends of
+# a separate engine process (python -m serving.engine), reached over
+# ENGINE_TRANSPORT = shm (shared memory rings) | socket (the Unix socket itself)
+ENGINE_TRANSPORT = os.environ.get("ENGINE_TRANSPORT", "shm")
+if ENGINE_TRANSPORT not in TRANSPORTS:
+    raise ValueError(f"Unknown ENGINE_TRANSPORT {ENGINE_TRANSPORT!r}, expected one of {sorted(TRANSPORTS)}")
+
+# Second cache tier on local disk, shared by every server process on the host
+# and kept across restarts; set DISK_CACHE_PATH="" to use the memory tier only
+DISK_CACHE_PATH = os.environ.get("DISK_CACHE_PATH", "cache/llm_cache.sqlite3")
+
+# Optional near-duplicate tier: serve the output of a cached prompt whose
+# embedding has at least this cosine similarity (unset = exact matches only).
+# SEMANTIC_CACHE_ENCODER: "hashing" (char n-grams, no model) | "model" (hidden states)
+SEMANTIC_CACHE_THRESHOLD = os.environ.get("SEMANTIC_CACHE_THRESHOLD")
+SEMANTIC_CACHE_ENCODER = os.environ.get("SEMANTIC_CACHE_ENCODER", "hashing")
 
-# Load the model on startup
+# Per-phase spans (tracing.py) are also written to this file every
+# TRACE_EXPORT_INTERVAL_S seconds, as Chrome trace JSON or OTLP JSON
+# (TRACE_EXPORT_FORMAT = chrome | otlp); unset = only on demand via /debug/trace
+TRACE_EXPORT_PATH = os.environ.get("TRACE_EXPORT_PATH")
+TRACE_EXPORT_FORMAT = os.environ.get("TRACE_EXPORT_FORMAT", "chrome")
+TRACE_EXPORT_INTERVAL_S = float(os.environ.get("TRACE_EXPORT_INTERVAL_S", "10"))
+# /debug/profile writes torch profiler traces here
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "results/profiles")
+# Most prompts one /generate_batch call may carry (larger bodies get a 413)
+MAX_BATCH_PROMPTS = int(os.environ.get("MAX_BATCH_PROMPTS", "1024"))
+# Largest max_new_tokens a request may ask for (larger or < 1 gets a 422)
+MAX_NEW_TOKENS = int(os.environ.get("MAX_NEW_TOKENS", "4096"))
+
+
+# Serve HTTP right away (liveness, metrics) and bring the model up in the background;
+# /health/ready and /generate report 503 until every startup phase has finished
 @app.on_event("startup")
-def startup_event():
-    print("Loading model on startup...")
+async def startup_event():
+    app.state.startup = StartupState()
+
+    # Start Prometheus metrics server on port 8002
+    try:
+        start_http_server(8002, "0.0.0.0")
+        log.info("Prometheus metrics server started on port 8002 (external)")
+    except OSError as e:
+        # Front ends of one engine share the host; the first one (or the engine) has the port
+        if not ENGINE_SOCKET:
+            raise
+        log.warning("Metrics port 8002 unavailable in this front end: %r", e)
+
+    app.state.startup_task = asyncio.create_task(start_serving(app.state.startup))
+    app.state.profiling = False
+    if TRACE_EXPORT_PATH:
+        asyncio.create_task(export_traces(TRACE_EXPORT_PATH, TRACE_EXPORT_FORMAT, TRACE_EXPORT_INTERVAL_S))
+
+
+async def start_serving(startup: StartupState):
+    try:
+        if ENGINE_SOCKET:
+            with startup.track("connect_engine"):
+                # Waits for the engine process to finish its own startup
+                engine = EngineClient(ENGINE_SOCKET, ENGINE_TRANSPORT)
+                await engine.connect()
+        else:
+            engine = InferenceEngine()
+            await engine.start(startup)
+        app.state.engine = engine
+
+        with startup.track("caches"):
+            setup_caches(engine.backend if isinstance(engine, InferenceEngine) else None)
+    except Exception as e:
+        log.error("Startup failed: %s", startup.error or repr(e))
+        raise
+
+    startup.mark_ready()
+    log.info("Connected to the engine." if ENGINE_SOCKET else "Model loaded and workers started.")
 
-    model, tokenizer = load_model()
-    model.eval()
 
-    app.state.model = model
-    app.state.tokenizer = tokenizer
-    app.state.cache = InMemoryCache(ttl_seconds=300)  # 5 minute TTL
+def setup_caches(backend):
+    memory_cache = InMemoryCache(
+        ttl_seconds=300,              # 5 minute TTL
+        max_entries=10_000,
+        max_bytes=64 * 1024 * 1024,
+        policy="tinylfu",             # lru | lfu | tinylfu
+    )
+    app.state.cache = memory_cache
+    if DISK_CACHE_PATH:
+        app.state.cache = TieredCache(
+            memory_cache,
+            DiskCache(DISK_CACHE_PATH, ttl_seconds=24 * 3600, max_bytes=1024 * 1024 * 1024),
+        )
+    if SEMANTIC_CACHE_THRESHOLD:
+        use_model = SEMANTIC_CACHE_ENCODER == "model"
+        if use_model and backend is None:
+            raise ValueError("SEMANTIC_CACHE_ENCODER=model needs the model in this process (unset ENGINE_SOCKET)")
+        app.state.cache = SemanticCache(
+            app.state.cache,
+            memory_cache,
+            # The model encoder reuses the served model's hidden states (hf backend only)
+            encoder=ModelEncoder(backend.model, backend.tokenizer) if use_model else HashingEncoder(),
+            threshold=float(SEMANTIC_CACHE_THRESHOLD),
+            max_entries=10_000,
+            index="flat",
+            # A model forward pass must not run on the event loop
+            executor=ThreadPoolExecutor(max_workers=1, thread_name_prefix="semantic-encoder") if use_model else None,
+        )
+    if DISK_CACHE_PATH:
+        # Start warm: load the entries other processes (or the last run) used most
+        asyncio.create_task(app.state.cache.warm_start(max_entries=5_000))
+    # Identical in-flight cache misses share one generation
+    app.state.inflight = SingleFlight()
     # Start background cache cleanup task
     asyncio.create_task(app.state.cache.start_periodic_cleanup(interval_seconds=60))
-    
-    # Start autoscaler
-    app.state.autoscaler = AutoScaler(model, tokenizer, initial_workers=1)
-    asyncio.create_task(app.state.autoscaler.monitor())
-
-    # 🔑 Pass model + tokenizer into the batch worker
-    asyncio.create_task(
-        batch_worker(
-            model=app.state.model,
-            tokenizer=app.state.tokenizer,
-            batch_size=4,
-            max_wait_ms=200,
-        )
-    )
 
-    # Create multiple workers
-    NUM_WORKERS = 2  # you can increase later
-    for i in range(NUM_WORKERS):
-        worker = Worker(model, tokenizer, worker_id=str(i))
-        load_balancer.register_worker(worker.handle_request)
 
+@app.get("/health/live")
+def health_live():
+    # The process is up and serving HTTP; restart it only if this stops answering
+    return {"status": "ok"}
 
-    # Start Prometheus metrics server on port 8002
-    start_http_server(8002, "0.0.0.0")
-    print("Prometheus metrics server started on port 8002 (external)")
 
-    print("Model loaded and batch worker started.")
+@app.get("/health/ready")
+def health_ready():
+    # Route traffic here only once the model is loaded and warmed up
+    startup = app.state.startup
+    if not startup.ready:
+        return JSONResponse(
+            status_code=503,
+            content={"status": startup.phase, "error": startup.error},
+        )
+    return {"status": "ok", "startup_seconds": startup.timings}
 
 
 @app.get("/health")
 def health():
-    return {"status": "ok"}
+    return health_ready()
+
+
+async def export_traces(path: str, format: str, interval_s: float):
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval_s)
+        try:
+            # Copying and encoding the ring takes a while; keep it off the event loop
+            await loop.run_in_executor(None, tracing.spans.export, path, format)
+        except OSError as e:
+            log.error("Trace export to %s failed: %r", path, e)
 
-class GenerateRequest(BaseModel):
+
+@app.get("/debug/trace")
+def debug_trace(format: Literal["chrome", "otlp"] = "chrome"):
+    # Recent per-phase spans; save the body and open it in ui.perfetto.dev (chrome)
+    # or post it to an OpenTelemetry collector (otlp)
+    spans = tracing.spans
+    return spans.chrome_trace() if format == "chrome" else spans.otlp_trace()
+
+
+@app.get("/debug/profile")
+async def debug_profile(
+    seconds: float = 5.0,
+    mode: Literal["stacks", "torch"] = "stacks",
+    interval_ms: float = 5.0,
+):
+    """
+    Profile the live server for a window of `seconds`:
+    stacks: sampled Python stacks of every thread, folded (flamegraph.pl / speedscope)
+    torch: torch profiler operator table; the Chrome trace is saved under PROFILE_DIR
+    """
+    from serving.profiling import format_folded, sample_stacks, torch_profile
+
+    if app.state.profiling:
+        return JSONResponse(status_code=409, content={"detail": "a profile is already running"})
+    seconds = min(max(seconds, 0.1), 60.0)
+    app.state.profiling = True
+    loop = asyncio.get_running_loop()
+    try:
+        # The sampler runs on its own thread; the event loop keeps serving (and gets sampled)
+        if mode == "stacks":
+            counts = await loop.run_in_executor(None, sample_stacks, seconds, interval_ms / 1000)
+            return PlainTextResponse(format_folded(counts))
+        path = os.path.join(PROFILE_DIR, f"torch-{time.strftime('%Y%m%d-%H%M%S')}.json")
+        table = await loop.run_in_executor(None, torch_profile, seconds, path)
+        return PlainTextResponse(f"Chrome trace: {path}\n\n{table}")
+    finally:
+        app.state.profiling = False
+
+class GenerationSettings(BaseModel):
+    # Validated here: the engine transport packs it as an unsigned int
+    max_new_tokens: int = Field(64, ge=1, le=MAX_NEW_TOKENS)
+    priority: Literal["interactive", "bulk"] = "interactive"
+    timeout_s: Optional[float] = None  # give up if not scheduled in time (server default if unset)
+    # Sampling (sampling.SamplingParams); temperature 0 = greedy. Only greedy
+    # and seeded requests are cached: an unseeded sample is one draw of many
+    temperature: float = 0.7
+    top_k: int = 50
+    top_p: float = 1.0
+    repetition_penalty: float = 1.0
+    seed: Optional[int] = None
+    stop: List[str] = []
+
+    def sampling_params(self) -> SamplingParams:
+        return SamplingParams(
+            temperature=self.temperature,
+            top_k=self.top_k,
+            top_p=self.top_p,
+            repetition_penalty=self.repetition_penalty,
+            seed=self.seed,
+            stop=tuple(self.stop),
+        )
+
+
+class GenerateRequest(GenerationSettings):
     prompt: str
-    max_new_tokens: int = 64
+    stream: bool = False  # stream tokens back as Server-Sent Events
 
-@app.post("/generate")
-async def generate(req: GenerateRequest):
-    cache = app.state.cache
 
+class GenerateBatchRequest(GenerationSettings):
+    prompts: List[str]  # every prompt gets the same settings
+    stream: bool = False  # send each result as soon as it completes, instead of all of them in order
+    priority: Literal["interactive", "bulk"] = "bulk"
+
+
+@app.exception_handler(RequestRejected)
+async def request_rejected_handler(request: Request, exc: RequestRejected):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.reason},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
+
+
+async def cancel_on_disconnect(request: Request, awaitable, poll_interval: float = 0.25):
+    """
+    Await `awaitable`, cancelling it if the client disconnects first,
+    so abandoned requests are dropped before they take a batch slot.
+    """
+    task = asyncio.ensure_future(awaitable)
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=poll_interval)
+        if done:
+            return task.result()
+        if await request.is_disconnected():
+            task.cancel()
+            # Nobody reads this response; 499 is the conventional "client closed request"
+            raise RequestRejected("client_disconnected", status_code=499, retry_after=0)
+
+
+@app.post("/generate")
+async def generate(req: GenerateRequest, request: Request):
     # Increment Prometheus request count
     REQUEST_COUNTER.inc()
+    try:
+        sampling = req.sampling_params()
+    except ValueError as e:
+        return JSONResponse(status_code=422, content={"detail": str(e)})
+
+    if not app.state.startup.ready:
+        raise RequestRejected("starting", status_code=503, retry_after=5.0)
+    cache = app.state.cache
+    trace_id = tracing.start_trace()
+    variant = sampling.variant() if sampling.cacheable else None
+
+    if req.stream:
+        # Admission is decided before the event stream starts, so a refusal is a plain HTTP error
+        cached = None
+        if variant is not None:
+            lookup_start = tracing.now()
+            cached = await cache.get(req.prompt, req.max_new_tokens, variant)
+            tracing.spans.record("cache_lookup", lookup_start, trace_id=trace_id)
+        deadline = None
+        if cached is None:
+            deadline = app.state.engine.admit(PRIORITIES[req.priority], req.timeout_s)
+        return StreamingResponse(generate_stream(req, sampling, cached, deadline), media_type="text/event-stream")
 
     # Measure latency
     with REQUEST_LATENCY.time():
+        def miss():
+            return generate_uncached(req.prompt, req.max_new_tokens, PRIORITIES[req.priority], req.timeout_s, sampling)
+
+        # Unseeded samples bypass the cache and aren't shared with identical requests in flight
+        if variant is None:
+            result = await cancel_on_disconnect(request, miss())
+            return json_response({
+                "output": result,
+                "cache_hit": False,
+            })
+
         # Check cache first
-        cached = await cache.get(req.prompt, req.max_new_tokens)
+        lookup_start = tracing.now()
+        cached = await cache.get(req.prompt, req.max_new_tokens, variant)
+        tracing.spans.record("cache_lookup", lookup_start, trace_id=trace_id)
         # cached = None  # Disable cache for testing
         if cached is not None:
             CACHE_HITS.inc()
-            return {
+            return json_response({
                 "output": cached,
                 "cache_hit": True,
-            }
+            })
 
         
-        # Route through load balancer
-        # Cache miss → batch inference
+        # Cache miss → batch inference, unless an identical request is already in flight
         CACHE_MISSES.inc()
-        result = await load_balancer.route_request(req.prompt, req.max_new_tokens)
-
-        # Store in cache
-        await cache.set(req.prompt, req.max_new_tokens, result)
+        result = await cancel_on_disconnect(request, app.state.inflight.run(
+            make_key(req.prompt, req.max_new_tokens, variant), miss
+        ))
 
-        return {
+        return json_response({
             "output": result,
             "cache_hit": False,
+        })
+
+
+@app.post("/generate_batch")
+async def generate_batch(request: Request):
+    """
+    Many prompts with the same settings in one call. The body is a GenerateBatchRequest
+    in JSON or msgpack (by Content-Type). Cached prompts are found with one multi-key
+    lookup and the misses are enqueued together, so they share batches.
+    Response: {"results": [...]} in prompt order, or with stream=true one
+    {"index": i, ...} item per prompt as it completes (NDJSON, or msgpack objects
+    back to back if the client accepts msgpack). A result is {"output", "cache_hit"},
+    or {"error", "status_code", "retry_after"} for a prompt dropped before it ran.
+    A group refused at admission fails as a whole, like a /generate request
+    (behind a separate engine, every prompt gets the refusal as its error).
+    """
+    try:
+        req = GenerateBatchRequest.model_validate(
+            codec.loads(await request.body(), request.headers.get("content-type"))
+        )
+        sampling = req.sampling_params()
+    except codec.UnsupportedMediaType as e:
+        return JSONResponse(status_code=415, content={"detail": str(e)})
+    except ValueError as e:
+        return JSONResponse(status_code=422, content={"detail": str(e)})
+    if len(req.prompts) > MAX_BATCH_PROMPTS:
+        return JSONResponse(status_code=413, content={"detail": f"at most {MAX_BATCH_PROMPTS} prompts per call"})
+
+    REQUEST_COUNTER.inc(len(req.prompts))
+    if not app.state.startup.ready:
+        raise RequestRejected("starting", status_code=503, retry_after=5.0)
+    tracing.start_trace()
+    start = time.perf_counter()
+    media_type = codec.response_type(request.headers.get("accept"), stream=req.stream)
+    results, tasks = await generate_group(req, sampling)
+
+    if req.stream:
+        return StreamingResponse(stream_batch(results, tasks, start, media_type), media_type=media_type)
+
+    try:
+        outcomes = await cancel_on_disconnect(request, asyncio.gather(*tasks, return_exceptions=True))
+    finally:
+        for task in tasks:
+            task.cancel()
+    for i, outcome in zip(tasks.values(), outcomes):
+        results[i] = batch_result(outcome)
+    # Every prompt's latency is the whole call's
+    latency = time.perf_counter() - start
+    for _ in results:
+        REQUEST_LATENCY.observe(latency)
+
+    serialize_start = tracing.now()
+    response = Response(codec.dumps({"results": results}, media_type), media_type=media_type)
+    tracing.spans.record("serialize", serialize_start, trace_id=tracing.current_trace_id.get())
+    return response
+
+
+async def generate_group(req: GenerateBatchRequest, sampling: SamplingParams):
+    """
+    Look the group up in the cache and start generating what it missed.
+    Returns (results, tasks): results[i] is the result of prompt i if it was
+    cached (else None); tasks maps a task for every other prompt to its index.
+    Misses already in flight are shared with that request; the rest (each distinct
+    prompt once) go to the engine as one route_batch, after one admission check.
+    """
+    cache = app.state.cache
+    inflight = app.state.inflight
+    engine = app.state.engine
+    prompts = req.prompts
+    variant = sampling.variant() if sampling.cacheable else None
+    priority = PRIORITIES[req.priority]
+
+    results: List[Optional[dict]] = [None] * len(prompts)
+    if variant is None:
+        # Unseeded samples bypass the cache, and each prompt is its own draw
+        misses = list(range(len(prompts)))
+        new = prompts
+    else:
+        lookup_start = tracing.now()
+        cached = await cache.get_many(prompts, req.max_new_tokens, variant)
+        tracing.spans.record("cache_lookup", lookup_start, trace_id=tracing.current_trace_id.get())
+        for i, value in enumerate(cached):
+            if value is not None:
+                results[i] = {"output": value, "cache_hit": True}
+        misses = [i for i, value in enumerate(cached) if value is None]
+        CACHE_HITS.inc(len(prompts) - len(misses))
+        CACHE_MISSES.inc(len(misses))
+        new = list(dict.fromkeys(
+            prompts[i] for i in misses if make_key(prompts[i], req.max_new_tokens, variant) not in inflight
+        ))
+
+    routed = []
+    if new:
+        deadline = engine.admit(priority, req.timeout_s)
+        routed = await engine.route_batch(
+            new, req.max_new_tokens, deadline=deadline, priority=priority, timeout_s=req.timeout_s, sampling=sampling
+        )
+    if variant is None:
+        return results, {asyncio.ensure_future(future): i for i, future in zip(misses, routed)}
+
+    generations = dict(zip(new, routed))
+
+    def work(prompt: str):
+        future = generations.pop(prompt, None)
+        if future is None:
+            # The request we meant to share finished while the group was being routed
+            return generate_uncached(prompt, req.max_new_tokens, priority, req.timeout_s, sampling)
+        return cache_result(prompt, req.max_new_tokens, variant, future)
+
+    def release_unused():
+        # A prompt another request registered while ours was being routed joins
+        # that request instead, so its routed copy is never awaited: cancel it
+        # (which cancels it in the engine). Runs once every task has started.
+        for future in generations.values():
+            future.cancel()
+        generations.clear()
+
+    tasks = {}
+    for i in misses:
+        key = make_key(prompts[i], req.max_new_tokens, variant)
+        tasks[asyncio.ensure_future(inflight.run(key, lambda prompt=prompts[i]: work(prompt)))] = i
+    asyncio.get_running_loop().call_soon(release_unused)
+    return results, tasks
+
+
+async def cache_result(prompt: str, max_new_tokens: int, variant: str, future) -> str:
+    result = await future
+    await app.state.cache.set(prompt, max_new_tokens, result, variant=variant)
+    return result
+
+
+def batch_result(outcome) -> dict:
+    if isinstance(outcome, RequestRejected):
+        return {
+            "error": outcome.reason,
+            "status_code": outcome.status_code,
+            "retry_after": math.ceil(outcome.retry_after),
         }
+    if isinstance(outcome, BaseException):
+        raise outcome
+    return {"output": outcome, "cache_hit": False}
+
+
+async def stream_batch(results: List[Optional[dict]], tasks: dict, start: float, media_type: str):
+    """
+    stream=true body of /generate_batch: cache hits first, then every other
+    prompt as it completes, each tagged with its index.
+    """
+    try:
+        for i, result in enumerate(results):
+            if result is not None:
+                REQUEST_LATENCY.observe(time.perf_counter() - start)
+                yield codec.dumps({"index": i, **result}, media_type)
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = batch_result(task.exception() or task.result())
+                REQUEST_LATENCY.observe(time.perf_counter() - start)
+                yield codec.dumps({"index": tasks[task], **result}, media_type)
+    finally:
+        # Client disconnected mid-stream: stop generating for it
+        for task in tasks:
+            task.cancel()
+
+
+def json_response(content: dict) -> JSONResponse:
+    # Rendering the body here (rather than returning the dict) makes serialization a timed span
+    start = tracing.now()
+    response = JSONResponse(content)
+    tracing.spans.record("serialize", start, trace_id=tracing.current_trace_id.get())
+    return response
+
+
+async def generate_uncached(
+    prompt: str, max_new_tokens: int, priority: int, timeout_s: Optional[float], sampling: SamplingParams
+):
+    """
+    Route a cache miss through the load balancer and store the result (if cacheable).
+    Runs once per key even when several identical requests are waiting on it;
+    only this first request goes through admission, since the others add no load.
+    """
+    engine = app.state.engine
+    deadline = engine.admit(priority, timeout_s)
+    result = await engine.route_request(
+        prompt, max_new_tokens, deadline=deadline, priority=priority, timeout_s=timeout_s, sampling=sampling
+    )
+    if sampling.cacheable:
+        await app.state.cache.set(prompt, max_new_tokens, result, variant=sampling.variant())
+    return result
+
+
+async def generate_stream(
+    req: GenerateRequest, sampling: SamplingParams, cached: Optional[str], deadline: Optional[float]
+):
+    """
+    SSE body for stream=True: text deltas as they are decoded,
+    then a final "done" event carrying the full output
+    (or an "error" event if the request expired before it was scheduled, or,
+    behind a remote engine, was refused admission).
+    """
+    cache = app.state.cache
+    start = time.perf_counter()
+
+    # Cache hits stream right away as a single delta
+    if cached is not None:
+        CACHE_HITS.inc()
+        yield sse_event({"text": cached})
+        yield sse_event({"output": cached, "cache_hit": True}, event="done")
+        REQUEST_LATENCY.observe(time.perf_counter() - start)
+        return
+
+    if sampling.cacheable:
+        CACHE_MISSES.inc()
+    engine = app.state.engine
+    channel = asyncio.Queue()
+    task = asyncio.create_task(
+        engine.route_request(
+            req.prompt, req.max_new_tokens, stream=channel, deadline=deadline,
+            priority=PRIORITIES[req.priority], timeout_s=req.timeout_s, sampling=sampling,
+        )
+    )
+    # Make sure the stream ends even if generation fails before finishing
+    task.add_done_callback(lambda _: channel.put_nowait(STREAM_END))
+    try:
+        async for event in stream_tokens(engine.tokenizer, channel, start, sampling.stop):
+            yield event
+        result = await task
+    except RequestRejected as exc:
+        yield sse_event({"detail": exc.reason, "retry_after": math.ceil(exc.retry_after)}, event="error")
+        return
+    finally:
+        # Client disconnected mid-stream: stop generating for it
+        if not task.done():
+            task.cancel()
+
+    if sampling.cacheable:
+        await cache.set(req.prompt, req.max_new_tokens, result, variant=sampling.variant())
+    serialize_start = tracing.now()
+    done = sse_event({"output": result, "cache_hit": False}, event="done")
+    tracing.spans.record("serialize", serialize_start, trace_id=tracing.current_trace_id.get())
+    yield done
+    REQUEST_LATENCY.observe(time.perf_counter() - start)
 
 
 # Middleware to report request latency
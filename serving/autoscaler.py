@@ -1,51 +1,134 @@
 import asyncio
-from metrics import queue_wait_time_histogram
+import time
+from logs import get_logger
+from metrics import ACTIVE_WORKERS, ARRIVAL_RATE_FORECAST, SERVICE_RATE_ESTIMATE, DESIRED_WORKERS
+from serving.scaling_policy import PredictivePolicy, ScalingObservation
 from serving.worker import Worker
-from model import load_model
-from batch_processor import request_queue
+
+log = get_logger("autoscaler")
 
 class AutoScaler:
-    def __init__(self, model, tokenizer, initial_workers=1, max_workers=4, min_workers=1):
-        self.model = model
-        self.tokenizer = tokenizer
+    def __init__(
+        self,
+        backend,
+        load_balancer,
+        initial_workers=1,
+        max_workers=4,
+        min_workers=1,
+        policy=None,
+        **worker_kwargs,
+    ):
+        """
+        Owns the pool of execution units (serving.worker.Worker), all running
+        the same inference backend (backends.InferenceBackend).
+        Adding a worker starts its batching loop and registers it with the load balancer;
+        removing one unregisters it first, then drains its in-flight requests.
+        policy: decides the worker count each monitor interval
+            (serving.scaling_policy; PredictivePolicy by default)
+        worker_kwargs are passed to every Worker (max_batch_size, threads_per_worker, ...).
+        """
+        self.backend = backend
+        self.load_balancer = load_balancer
         self.max_workers = max_workers
         self.min_workers = min_workers
+        self.policy = policy or PredictivePolicy()
+        self.worker_kwargs = worker_kwargs
         self.workers = []
-        self.worker_tasks = []
+        self.draining = set()
+        self._draining_workers = set()
+        self._retired_counts = (0, 0)
+        self._next_id = 0
 
         # Start with initial_workers
         for i in range(initial_workers):
             self.add_worker()
 
+    def total_queue_depth(self) -> int:
+        """
+        Backlog across workers: queued plus pulled into each batching loop's
+        look-ahead but not running yet (see Worker.queue_depth).
+        """
+        return sum(w.queue_depth() for w in self.workers)
+
+    def capacity(self) -> float:
+        """
+        Estimated requests/sec the pool completes when saturated
+        (the policy's per-worker service rate x workers), or inf if the policy has no estimate.
+        """
+        rate = getattr(self.policy, "service_rate", None)
+        return rate * len(self.workers) if rate else float("inf")
+
+    def request_counts(self):
+        """
+        Cumulative (accepted, completed) requests over every worker,
+        including ones that are draining or already gone.
+        """
+        accepted, completed = self._retired_counts
+        for w in self.workers + list(self._draining_workers):
+            accepted += w.accepted
+            completed += w.completed
+        return accepted, completed
+
+    def _retire(self, worker):
+        self._draining_workers.discard(worker)
+        accepted, completed = self._retired_counts
+        self._retired_counts = (accepted + worker.accepted, completed + worker.completed)
+
     def add_worker(self):
-        worker_id = len(self.workers)
-        if worker_id >= self.max_workers:
+        if len(self.workers) >= self.max_workers:
             return
-        worker = Worker(self.model, self.tokenizer, worker_id)
+        worker = Worker(self.backend, self._next_id, **self.worker_kwargs)
+        self._next_id += 1
+        worker.start()
         self.workers.append(worker)
+        self.load_balancer.register_worker(worker.handle_request)
         # Update Prometheus gauge
-        from metrics import ACTIVE_WORKERS
         ACTIVE_WORKERS.set(len(self.workers))
-        print(f"[AutoScaler] Added worker {worker_id}")
+        log.info("Added worker %s", worker.worker_id)
 
     def remove_worker(self):
         if len(self.workers) <= self.min_workers:
             return
         worker = self.workers.pop()
-        from metrics import ACTIVE_WORKERS
+        # Stop routing to it, then let it finish what it already accepted
+        self.load_balancer.unregister_worker(worker.handle_request)
         ACTIVE_WORKERS.set(len(self.workers))
-        print(f"[AutoScaler] Removed worker {worker.worker_id}")
+        self._draining_workers.add(worker)
+        task = asyncio.create_task(worker.drain())
+        self.draining.add(task)
+        task.add_done_callback(self.draining.discard)
+        task.add_done_callback(lambda _: self._retire(worker))
+        log.info("Removing worker %s (draining %d in-flight)", worker.worker_id, worker.in_flight)
+
+    def scale_to(self, desired: int):
+        desired = max(self.min_workers, min(self.max_workers, desired))
+        while len(self.workers) < desired:
+            self.add_worker()
+        while len(self.workers) > desired:
+            self.remove_worker()
 
     async def monitor(self, interval=1.0):
+        last_time = time.monotonic()
+        last_accepted, last_completed = self.request_counts()
         while True:
-            queue_size = request_queue.qsize()
-            num_workers = len(self.workers)
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            accepted, completed = self.request_counts()
+            obs = ScalingObservation(
+                now=now,
+                interval=now - last_time,
+                arrivals=accepted - last_accepted,
+                completions=completed - last_completed,
+                queue_depth=self.total_queue_depth(),
+                workers=len(self.workers),
+            )
+            last_time, last_accepted, last_completed = now, accepted, completed
 
-            # Scaling logic (smaller thresholds for testing)
-            if queue_size > 2 and num_workers < self.max_workers:
-                self.add_worker()
-            elif queue_size == 0 and num_workers > self.min_workers:
-                self.remove_worker()
+            desired = self.policy.desired_workers(obs)
+            DESIRED_WORKERS.set(desired)
+            if isinstance(self.policy, PredictivePolicy):
+                ARRIVAL_RATE_FORECAST.set(self.policy.forecast_rate)
+                SERVICE_RATE_ESTIMATE.set(self.policy.service_rate)
+            self.scale_to(desired)
 
-            print(f"[AutoScaler] Queue size: {queue_size}, Workers: {len(self.workers)}")
-            await asyncio.sleep(interval)
+            log.debug("Queue size: %d, Arrivals: %d, Workers: %d", obs.queue_depth, obs.arrivals, len(self.workers))
@@ -0,0 +1,220 @@
+# serving/batch_controller.py
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Callable, Deque, List, Tuple
+
+from batch_processor import request_queue
+from metrics import (
+    REQUEST_LATENCY,
+    queue_wait_time_histogram,
+    batch_size_histogram,
+    decode_step_time_histogram,
+    GENERATED_TOKENS,
+    BATCH_SIZE_SETPOINT,
+    MAX_WAIT_MS_SETPOINT,
+)
+
+
+class HistogramWindow:
+    """
+    Sliding-window view over a cumulative Prometheus histogram.
+    Snapshots are taken once per tick; stats are computed from the difference
+    between the newest and oldest snapshot in the window.
+    """
+
+    def __init__(self, histogram, window_ticks: int):
+        self.histogram = histogram
+        self.snapshots: Deque[Tuple[List[Tuple[float, float]], float, float]] = deque(maxlen=window_ticks + 1)
+
+    def _read(self):
+        buckets, total, count = [], 0.0, 0.0
+        for metric in self.histogram.collect():
+            for s in metric.samples:
+                if s.name.endswith("_bucket"):
+                    buckets.append((float(s.labels["le"]), s.value))
+                elif s.name.endswith("_sum"):
+                    total = s.value
+                elif s.name.endswith("_count"):
+                    count = s.value
+        return buckets, total, count
+
+    def tick(self):
+        self.snapshots.append(self._read())
+
+    def count(self) -> float:
+        if len(self.snapshots) < 2:
+            return 0.0
+        return self.snapshots[-1][2] - self.snapshots[0][2]
+
+    def mean(self) -> float:
+        n = self.count()
+        return (self.snapshots[-1][1] - self.snapshots[0][1]) / n if n else 0.0
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile by linear interpolation inside the histogram bucket
+        (the same approach as PromQL's histogram_quantile).
+        """
+        n = self.count()
+        if not n:
+            return 0.0
+        new, old = self.snapshots[-1][0], self.snapshots[0][0]
+        rank = q * n
+        prev_le, prev_count = 0.0, 0.0
+        for (le, c_new), (_, c_old) in zip(new, old):
+            c = c_new - c_old
+            if c >= rank:
+                if math.isinf(le):
+                    return prev_le
+                width = c - prev_count
+                return prev_le + (le - prev_le) * ((rank - prev_count) / width if width else 1.0)
+            prev_le, prev_count = le, c
+        return prev_le
+
+
+def _counter_value(counter) -> float:
+    for metric in counter.collect():
+        for s in metric.samples:
+            if s.name.endswith("_total"):
+                return s.value
+    return 0.0
+
+
+class BatchController:
+    """
+    Feedback controller for the batching setpoints (batch size and wait window).
+
+    Signals, over a sliding window:
+    - p95 end-to-end latency (REQUEST_LATENCY) vs. the configured SLO
+    - arrival rate: requests dequeued (queue_wait_time_histogram count) plus queue growth
+    - queue depth (request_queue.qsize() unless another queue_depth is given)
+    - per-batch step time and observed batch sizes (batch_size_histogram)
+
+    Policy:
+    - Over the SLO while arrivals outpace service: the queue is the problem,
+      so grow the batch for throughput
+    - Over the SLO otherwise: batching itself costs too much, so shrink the
+      batch and the wait window (multiplicative decrease)
+    - Under the SLO with a backlog: grow the batch (additive increase)
+    - The wait window is set to roughly the time needed to collect a batch
+      at the current arrival rate, capped at a fraction of the SLO
+
+    Workers read batch_size / max_wait_ms on every loop iteration,
+    so changes apply without a restart. The continuous batching worker has no
+    wait window and only follows batch_size (its max running sequences).
+    """
+
+    def __init__(
+        self,
+        latency_slo_s: float = 2.0,
+        batch_size: int = 4,
+        max_wait_ms: float = 200,
+        min_batch_size: int = 1,
+        max_batch_size: int = 32,
+        max_wait_fraction: float = 0.2,
+        window_ticks: int = 10,
+        step_time_histogram=decode_step_time_histogram,
+        continuous: bool = True,
+        queue_depth: Callable[[], int] = request_queue.qsize,
+    ):
+        """
+        latency_slo_s: p95 end-to-end latency target
+        step_time_histogram: decode_step_time_histogram for the continuous
+            worker, batch_run_time_histogram for the static batch_worker
+        continuous: a step advances every sequence by one token (continuous
+            batching) rather than completing a whole batch (static batching)
+        queue_depth: requests waiting to be batched (e.g. summed over worker queues)
+        """
+        self.latency_slo_s = latency_slo_s
+        self.batch_size = batch_size
+        self.max_wait_ms = max_wait_ms
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.max_wait_fraction = max_wait_fraction
+        self.continuous = continuous
+        self.queue_depth = queue_depth
+
+        self.latency = HistogramWindow(REQUEST_LATENCY, window_ticks)
+        self.queue_wait = HistogramWindow(queue_wait_time_histogram, window_ticks)
+        self.batch_sizes = HistogramWindow(batch_size_histogram, window_ticks)
+        self.step_time = HistogramWindow(step_time_histogram, window_ticks)
+        self.queue_depths: Deque[Tuple[float, int]] = deque(maxlen=window_ticks + 1)
+        self.generated_tokens: Deque[float] = deque(maxlen=window_ticks + 1)
+        self._publish()
+
+    def _publish(self):
+        BATCH_SIZE_SETPOINT.set(self.batch_size)
+        MAX_WAIT_MS_SETPOINT.set(self.max_wait_ms)
+
+    def observe(self):
+        now = time.monotonic()
+        for window in (self.latency, self.queue_wait, self.batch_sizes, self.step_time):
+            window.tick()
+        self.queue_depths.append((now, self.queue_depth()))
+        self.generated_tokens.append(_counter_value(GENERATED_TOKENS))
+
+    def arrival_rate(self) -> float:
+        if len(self.queue_depths) < 2:
+            return 0.0
+        (t0, depth0), (t1, depth1) = self.queue_depths[0], self.queue_depths[-1]
+        elapsed = t1 - t0
+        return max(0.0, (self.queue_wait.count() + depth1 - depth0) / elapsed) if elapsed > 0 else 0.0
+
+    def service_rate(self) -> float:
+        """
+        Requests/sec the engine can complete at the current batch size.
+        Static: one full batch per step. Continuous: each step yields one token
+        per running sequence, so divide by the observed tokens per request.
+        """
+        step = self.step_time.mean()
+        if step <= 0:
+            return float("inf")
+        steps_per_request = 1.0
+        if self.continuous:
+            requests = self.queue_wait.count()
+            tokens = self.generated_tokens[-1] - self.generated_tokens[0] if self.generated_tokens else 0.0
+            steps_per_request = max(1.0, tokens / requests) if requests else 1.0
+        return self.batch_size / (step * steps_per_request)
+
+    def update(self):
+        """
+        One control step; call after observe().
+        """
+        if self.latency.count() == 0:
+            return
+
+        p95 = self.latency.quantile(0.95)
+        arrival = self.arrival_rate()
+        backlog = self.queue_depth()
+        queue_growing = len(self.queue_depths) >= 2 and self.queue_depths[-1][1] > self.queue_depths[0][1]
+
+        if p95 > self.latency_slo_s:
+            if queue_growing or arrival > self.service_rate():
+                self.batch_size = min(self.max_batch_size, self.batch_size * 2)
+            else:
+                self.batch_size = max(self.min_batch_size, int(self.batch_size * 0.75))
+                self.max_wait_ms *= 0.5
+        elif backlog > 0 and self.batch_sizes.mean() >= self.batch_size * 0.9:
+            # Batches are full and work is waiting: trade a bit of latency for throughput
+            self.batch_size = min(self.max_batch_size, self.batch_size + 1)
+
+        # Wait about as long as it takes for the batch to fill, within the SLO budget
+        cap_ms = self.latency_slo_s * self.max_wait_fraction * 1000
+        fill_ms = (self.batch_size - 1) / arrival * 1000 if arrival > 0 else cap_ms
+        target_ms = min(cap_ms, fill_ms)
+        if p95 <= self.latency_slo_s:
+            # Recover gradually after a decrease
+            target_ms = min(target_ms, self.max_wait_ms * 2)
+        else:
+            target_ms = min(target_ms, self.max_wait_ms)
+        self.max_wait_ms = max(1.0, target_ms)
+
+        self._publish()
+
+    async def run(self, interval: float = 1.0):
+        while True:
+            await asyncio.sleep(interval)
+            self.observe()
+            self.update()
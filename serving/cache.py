@@ -1,64 +1,318 @@
 # serving/cache.py
 import asyncio
+import heapq
 import time
-from typing import Dict, Tuple, Optional
+from collections import OrderedDict, defaultdict
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
 from prometheus_client import Gauge, Counter
 
 # Prometheus metric for cache size
 CACHE_SIZE = Gauge("llm_cache_size", "Current number of entries in the cache")
+CACHE_BYTES = Gauge("llm_cache_bytes", "Approximate bytes held by cache entries")
+CACHE_EVICTIONS = Counter(
+    "llm_cache_evictions_total",
+    "Number of entries removed from the cache",
+    ["reason"]  # capacity | expired
+)
+CACHE_REJECTIONS = Counter(
+    "llm_cache_admission_rejections_total",
+    "Number of new entries the admission filter refused to cache"
+)
+
+# Rough per-entry bookkeeping cost (dict slot, tuples, policy node, heap item)
+ENTRY_OVERHEAD_BYTES = 200
+
+
+def make_key(prompt: str, max_new_tokens: int, variant: str = "") -> Tuple[str, int, str]:
+    """
+    Cache key for a generation request (also used to coalesce in-flight requests).
+    variant: everything else that changes the output (sampling.SamplingParams.variant())
+    """
+    return (prompt, max_new_tokens, variant)
+
+
+# -----------------------------
+# Eviction policies
+# -----------------------------
+class LRUPolicy:
+    """
+    Least-recently-used: OrderedDict in access order, O(1) per operation.
+    """
+
+    def __init__(self):
+        self._order: "OrderedDict[Hashable, None]" = OrderedDict()
+
+    def on_insert(self, key):
+        self._order[key] = None
+
+    def on_access(self, key):
+        self._order.move_to_end(key)
+
+    def on_remove(self, key):
+        self._order.pop(key, None)
+
+    def victim(self):
+        return next(iter(self._order))
+
+
+class LFUPolicy:
+    """
+    Least-frequently-used with O(1) frequency buckets.
+    Ties within a frequency are broken by recency (oldest first).
+    """
+
+    def __init__(self):
+        self._freq: Dict[Hashable, int] = {}
+        self._buckets: Dict[int, "OrderedDict[Hashable, None]"] = defaultdict(OrderedDict)
+        self._min_freq = 0
+
+    def on_insert(self, key):
+        self._freq[key] = 1
+        self._buckets[1][key] = None
+        self._min_freq = 1
+
+    def on_access(self, key):
+        freq = self._freq[key]
+        bucket = self._buckets[freq]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[freq]
+            if self._min_freq == freq:
+                self._min_freq = freq + 1
+        self._freq[key] = freq + 1
+        self._buckets[freq + 1][key] = None
+
+    def on_remove(self, key):
+        freq = self._freq.pop(key, None)
+        if freq is None:
+            return
+        bucket = self._buckets[freq]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[freq]
+            if self._min_freq == freq and self._buckets:
+                self._min_freq = min(self._buckets)
+
+    def victim(self):
+        return next(iter(self._buckets[self._min_freq]))
+
+
+class TinyLFUAdmission:
+    """
+    Frequency sketch (count-min, 4 rows) used as an admission filter:
+    a new key only displaces the eviction victim if it has been seen more often.
+    Counters are halved periodically so old popularity fades.
+    """
+
+    def __init__(self, width: int = 4096, depth: int = 4):
+        self._width = width
+        self._rows = [[0] * width for _ in range(depth)]
+        self._additions = 0
+        self._reset_at = 10 * width
+
+    def _indexes(self, key):
+        for i in range(len(self._rows)):
+            yield i, hash((i, key)) % self._width
+
+    def record(self, key):
+        for i, j in self._indexes(key):
+            self._rows[i][j] += 1
+        self._additions += 1
+        if self._additions >= self._reset_at:
+            self._rows = [[c >> 1 for c in row] for row in self._rows]
+            self._additions //= 2
+
+    def estimate(self, key) -> int:
+        return min(self._rows[i][j] for i, j in self._indexes(key))
+
+    def admit(self, candidate, victim) -> bool:
+        return self.estimate(candidate) > self.estimate(victim)
+
+
+POLICIES = {
+    "lru": LRUPolicy,
+    "lfu": LFUPolicy,
+    "tinylfu": LRUPolicy,  # LRU eviction behind a TinyLFU admission filter
+}
+
 
 class InMemoryCache:
-    def __init__(self, ttl_seconds: int = 300):
+    def __init__(
+        self,
+        ttl_seconds: int = 300,
+        max_entries: int = 10_000,
+        max_bytes: int = 64 * 1024 * 1024,
+        policy: str = "lru",
+    ):
         """
         ttl_seconds: time-to-live for cache entries (default: 5 minutes)
+        max_entries / max_bytes: capacity bounds; the policy picks what to evict
+        policy: "lru", "lfu" or "tinylfu"
+
+        Expired entries are removed lazily: on lookup, and by popping the
+        front of an expiry heap, so no operation scans the whole cache.
+        Every operation is O(1) (amortized) and never awaits, so no lock is
+        needed on the event loop.
         """
-        self._cache: Dict[Tuple[str, int], Tuple[str, float]] = {}
-        self._lock = asyncio.Lock()
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown cache policy {policy!r}, expected one of {sorted(POLICIES)}")
+        # key -> (value, expires_at, size_bytes)
+        self._cache: Dict[Tuple[str, int, str], Tuple[str, float, int]] = {}
+        self._expiry_heap: List[Tuple[float, Tuple[str, int, str]]] = []
         self._ttl = ttl_seconds
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        self._policy = POLICIES[policy]()
+        self._admission = TinyLFUAdmission() if policy == "tinylfu" else None
+        self._removal_listeners: List[Callable[[Tuple[str, int, str]], None]] = []
 
-        # Track hits/misses (optional, already in metrics.py)
-        # You could remove these if you want to reuse CACHE_HITS / CACHE_MISSES
-        # self.hits = 0
-        # self.misses = 0
+    def add_removal_listener(self, listener: Callable[[Tuple[str, int, str]], None]):
+        """
+        Call listener(key) whenever an entry is evicted or expires, so tiers
+        that index this cache's keys (serving.semantic_cache) stay consistent.
+        """
+        self._removal_listeners.append(listener)
+
+    def contains(self, key: Tuple[str, int, str]) -> bool:
+        """
+        True if key holds an unexpired entry; unlike get(), doesn't count as an access.
+        """
+        entry = self._cache.get(key)
+        return entry is not None and time.time() < entry[1]
+
+    def keys(self) -> List[Tuple[str, int, str]]:
+        return list(self._cache)
+
+    @staticmethod
+    def _entry_size(key: Tuple[str, int, str], value: str) -> int:
+        return len(key[0].encode()) + len(key[2]) + len(value.encode()) + ENTRY_OVERHEAD_BYTES
 
-    async def get(self, prompt: str, max_new_tokens: int) -> Optional[str]:
+    async def get(self, prompt: str, max_new_tokens: int, variant: str = "") -> Optional[str]:
         """
         Retrieve a cached value if it exists and hasn't expired.
         """
-        key = (prompt, max_new_tokens)
-        async with self._lock:
+        key = make_key(prompt, max_new_tokens, variant)
+        if self._admission is not None:
+            self._admission.record(key)
+        self._expire(time.time())
+
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        value, expires_at, _ = entry
+        if time.time() >= expires_at:
+            # Expired → remove entry
+            self._remove(key, reason="expired")
+            return None
+        self._policy.on_access(key)
+        return value
+
+    async def get_many(self, prompts: List[str], max_new_tokens: int, variant: str = "") -> List[Optional[str]]:
+        """
+        get() for several prompts with the same settings, in order; expired
+        entries are swept once for the whole lookup.
+        """
+        now = time.time()
+        self._expire(now)
+        values = []
+        for prompt in prompts:
+            key = make_key(prompt, max_new_tokens, variant)
+            if self._admission is not None:
+                self._admission.record(key)
             entry = self._cache.get(key)
-            if entry:
-                value, timestamp = entry
-                # Check TTL
-                if time.time() - timestamp < self._ttl:
-                    return value
-                else:
-                    # Expired → remove entry
-                    del self._cache[key]
-                    CACHE_SIZE.set(len(self._cache))
-        return None
-
-    async def set(self, prompt: str, max_new_tokens: int, value: str):
-        """
-        Store a value in the cache with a timestamp.
-        """
-        key = (prompt, max_new_tokens)
-        async with self._lock:
-            self._cache[key] = (value, time.time())
-            CACHE_SIZE.set(len(self._cache))
+            if entry is not None and now < entry[1]:
+                self._policy.on_access(key)
+                values.append(entry[0])
+            else:
+                if entry is not None:
+                    self._remove(key, reason="expired")
+                values.append(None)
+        return values
+
+    async def set(
+        self,
+        prompt: str,
+        max_new_tokens: int,
+        value: str,
+        ttl_seconds: Optional[float] = None,
+        variant: str = "",
+    ):
+        """
+        Store a value in the cache, evicting entries if it is over capacity.
+        ttl_seconds: shorter lifetime for this entry (e.g. the time left on a
+            copy promoted from a lower tier); capped at the cache's TTL
+        """
+        key = make_key(prompt, max_new_tokens, variant)
+        now = time.time()
+        self._expire(now)
+
+        size = self._entry_size(key, value)
+        if size > self._max_bytes:
+            return
+
+        if key in self._cache:
+            self._remove(key, reason=None)
+        elif self._admission is not None and self._over_capacity(size):
+            # Only displace the current victim if the newcomer is more popular
+            if self._cache and not self._admission.admit(key, self._policy.victim()):
+                CACHE_REJECTIONS.inc()
+                return
+
+        while self._cache and self._over_capacity(size):
+            self._remove(self._policy.victim(), reason="capacity")
+
+        expires_at = now + (self._ttl if ttl_seconds is None else min(self._ttl, ttl_seconds))
+        self._cache[key] = (value, expires_at, size)
+        self._bytes += size
+        self._policy.on_insert(key)
+        heapq.heappush(self._expiry_heap, (expires_at, key))
+        self._update_gauges()
+
+    def _over_capacity(self, incoming_bytes: int) -> bool:
+        return (
+            len(self._cache) + 1 > self._max_entries
+            or self._bytes + incoming_bytes > self._max_bytes
+        )
+
+    def _remove(self, key, reason: Optional[str]):
+        _, _, size = self._cache.pop(key)
+        self._bytes -= size
+        self._policy.on_remove(key)
+        if reason is not None:
+            CACHE_EVICTIONS.labels(reason=reason).inc()
+            for listener in self._removal_listeners:
+                listener(key)
+        self._update_gauges()
+
+    def _expire(self, now: float):
+        """
+        Pop entries whose TTL has passed off the front of the expiry heap.
+        Heap items for keys that were overwritten or evicted are skipped.
+        """
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            expires_at, key = heapq.heappop(heap)
+            entry = self._cache.get(key)
+            if entry is not None and entry[1] == expires_at:
+                self._remove(key, reason="expired")
+
+        # Drop stale heap items if they pile up from overwrites/evictions
+        if len(heap) > 2 * len(self._cache) + 64:
+            self._expiry_heap = [(entry[1], k) for k, entry in self._cache.items()]
+            heapq.heapify(self._expiry_heap)
+
+    def _update_gauges(self):
+        CACHE_SIZE.set(len(self._cache))
+        CACHE_BYTES.set(self._bytes)
 
     async def cleanup(self):
         """
         Remove expired entries.
-        Can be called periodically as a background task.
-        """
-        async with self._lock:
-            now = time.time()
-            expired_keys = [k for k, (_, ts) in self._cache.items() if now - ts >= self._ttl]
-            for k in expired_keys:
-                del self._cache[k]
-            CACHE_SIZE.set(len(self._cache))
+        Only pops already-expired items off the expiry heap, so it is cheap
+        to call as a periodic background task.
+        """
+        self._expire(time.time())
 
     async def start_periodic_cleanup(self, interval_seconds: int = 60):
         """
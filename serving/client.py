@@ -0,0 +1,151 @@
+# serving/client.py
+# Async client for the HTTP API (serving/app.py). One aiohttp session with a
+# pooled connector is shared by every call, so concurrent requests reuse
+# keep-alive connections instead of opening one (and a TCP handshake) each:
+#
+#   async with GenerationClient("http://localhost:8000") as client:
+#       text = (await client.generate("hello", max_new_tokens=16))["output"]
+#       results = await client.generate_batch(prompts, max_new_tokens=16, temperature=0)
+
+import json
+from typing import AsyncIterator, List, Optional, Tuple
+
+import aiohttp
+
+from serving import codec
+
+
+class GenerationError(Exception):
+    """
+    A non-200 answer: status is the HTTP status (429/503 with retry_after
+    seconds when the server sheds load).
+    """
+
+    def __init__(self, status: int, detail, retry_after: Optional[float] = None):
+        super().__init__(f"{status}: {detail}")
+        self.status = status
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class GenerationClient:
+    """
+    Settings (max_new_tokens, priority, timeout_s, temperature, top_k, top_p,
+    repetition_penalty, seed, stop) are passed as keyword arguments and sent as-is.
+    """
+
+    def __init__(
+        self,
+        base_url: str = "http://localhost:8000",
+        max_connections: int = 100,
+        keepalive_s: float = 30.0,
+        timeout_s: float = 300.0,
+        encoding: str = "json",
+    ):
+        """
+        max_connections: size of the connection pool; requests beyond it wait for a free connection
+        keepalive_s: how long an idle connection stays open for reuse
+        encoding: "json" or "msgpack" for /generate_batch bodies (msgpack needs the package on both ends)
+        """
+        if encoding not in ("json", "msgpack"):
+            raise ValueError(f"Unknown encoding {encoding!r}, expected 'json' or 'msgpack'")
+        if encoding == "msgpack" and codec.msgpack is None:
+            raise ValueError("encoding='msgpack' needs the msgpack package")
+        self.base_url = base_url.rstrip("/")
+        self.max_connections = max_connections
+        self.keepalive_s = keepalive_s
+        self.timeout_s = timeout_s
+        self.media_type = codec.MSGPACK if encoding == "msgpack" else codec.JSON
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=self.keepalive_s)
+            self.session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout_s)
+            )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    @staticmethod
+    async def _check(resp: aiohttp.ClientResponse):
+        if resp.status == 200:
+            return
+        body = await resp.read()
+        try:
+            detail = json.loads(body).get("detail", body.decode())
+        except (ValueError, AttributeError):
+            detail = body.decode(errors="replace")
+        retry_after = resp.headers.get("Retry-After")
+        raise GenerationError(resp.status, detail, float(retry_after) if retry_after else None)
+
+    async def generate(self, prompt: str, **settings) -> dict:
+        """
+        POST /generate: {"output", "cache_hit"}.
+        """
+        async with self.session.post(f"{self.base_url}/generate", json={"prompt": prompt, **settings}) as resp:
+            await self._check(resp)
+            return await resp.json()
+
+    async def generate_stream(self, prompt: str, **settings) -> AsyncIterator[Tuple[str, dict]]:
+        """
+        POST /generate with stream=true: yields ("text", {"text"}) per delta, then
+        ("done", {"output", "cache_hit"}) or ("error", {"detail", "retry_after"}).
+        """
+        payload = {"prompt": prompt, **settings, "stream": True}
+        async with self.session.post(f"{self.base_url}/generate", json=payload) as resp:
+            await self._check(resp)
+            event = None
+            async for raw in resp.content:
+                line = raw.decode().strip()
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    yield event or "text", json.loads(line[len("data:"):])
+                    event = None
+
+    def _batch_request(self, prompts: List[str], stream: bool, settings: dict) -> dict:
+        body = codec.dumps({"prompts": prompts, **settings, "stream": stream}, self.media_type)
+        return {
+            "data": body,
+            "headers": {"Content-Type": self.media_type, "Accept": self.media_type},
+        }
+
+    async def generate_batch(self, prompts: List[str], **settings) -> List[dict]:
+        """
+        POST /generate_batch: one result per prompt, in order; each is
+        {"output", "cache_hit"} or {"error", "status_code", "retry_after"}.
+        """
+        request = self._batch_request(prompts, False, settings)
+        async with self.session.post(f"{self.base_url}/generate_batch", **request) as resp:
+            await self._check(resp)
+            return codec.loads(await resp.read(), resp.content_type)["results"]
+
+    async def generate_batch_stream(self, prompts: List[str], **settings) -> AsyncIterator[dict]:
+        """
+        POST /generate_batch with stream=true: yields each result as it completes,
+        with its prompt's "index".
+        """
+        request = self._batch_request(prompts, True, settings)
+        async with self.session.post(f"{self.base_url}/generate_batch", **request) as resp:
+            await self._check(resp)
+            if resp.content_type in (codec.MSGPACK, "application/x-msgpack"):
+                unpacker = codec.msgpack.Unpacker(raw=False)
+                async for chunk in resp.content.iter_any():
+                    unpacker.feed(chunk)
+                    for item in unpacker:
+                        yield item
+            else:
+                async for line in resp.content:
+                    if line.strip():
+                        yield codec.loads(line)
@@ -0,0 +1,63 @@
+# serving/codec.py
+# Request/response bodies of /generate_batch: JSON (parsed and rendered with
+# orjson when it is installed, the json module otherwise) or msgpack (only if
+# the msgpack package is installed). Streamed responses are NDJSON, or for
+# msgpack, msgpack objects back to back (msgpack.Unpacker reads them one by one).
+
+import json
+from typing import Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = "application/json"
+NDJSON = "application/x-ndjson"
+MSGPACK = "application/msgpack"
+_MSGPACK_TYPES = (MSGPACK, "application/x-msgpack")
+
+
+class UnsupportedMediaType(Exception):
+    """
+    A body in an encoding this server can't read (415).
+    """
+
+
+def _media_type(header: Optional[str]) -> str:
+    return (header or "").split(";")[0].strip().lower()
+
+
+def loads(body: bytes, content_type: Optional[str] = None):
+    media_type = _media_type(content_type)
+    if media_type in _MSGPACK_TYPES:
+        if msgpack is None:
+            raise UnsupportedMediaType("msgpack bodies need the msgpack package on the server")
+        return msgpack.unpackb(body, raw=False)
+    if media_type not in ("", JSON):
+        raise UnsupportedMediaType(f"unsupported content type {media_type!r}")
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+def response_type(accept: Optional[str], stream: bool = False) -> str:
+    """
+    msgpack if the client accepts it (and it is installed), else JSON (NDJSON when streaming).
+    """
+    accepted = {_media_type(part) for part in (accept or "").split(",")}
+    if msgpack is not None and accepted & set(_MSGPACK_TYPES):
+        return MSGPACK
+    return NDJSON if stream else JSON
+
+
+def dumps(content, media_type: str = JSON) -> bytes:
+    """
+    One body, or one item of a stream (NDJSON items end with a newline).
+    """
+    if media_type == MSGPACK:
+        return msgpack.packb(content)
+    data = orjson.dumps(content) if orjson is not None else json.dumps(content, separators=(",", ":")).encode()
+    return data + b"\n" if media_type == NDJSON else data
@@ -0,0 +1,358 @@
+# serving/disk_cache.py
+import asyncio
+import hashlib
+import os
+import sqlite3
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from prometheus_client import Counter, Gauge
+
+from logs import get_logger
+from metrics import CACHE_TIER_HITS, CACHE_TIER_MISSES, cache_tier_lookup_histogram
+from serving.cache import InMemoryCache, make_key
+
+log = get_logger("cache")
+
+DISK_CACHE_BYTES = Gauge("llm_disk_cache_bytes", "Bytes of generated text held by the disk cache tier")
+DISK_CACHE_EVICTIONS = Counter(
+    "llm_disk_cache_evictions_total",
+    "Number of entries removed from the disk cache tier by compaction",
+    ["reason"]  # capacity | expired
+)
+
+
+class DiskCache:
+    """
+    Persistent cache tier in SQLite, shared by every server process on the host.
+
+    - WAL journal: readers in any process never block on a writer (or each other),
+      and a write is one append to the log
+    - Reads go through SQLite's memory-mapped I/O (mmap_size), so hot pages are
+      served from the OS page cache shared across processes without a copy per read
+    - Keys are 16-byte blake2b digests of make_key(); rows also keep the prompt,
+      max_new_tokens and variant so hot entries can be loaded back into memory on startup
+    - TTL is checked on every read; expired rows are deleted by compact(), which also
+      trims the coldest rows to max_bytes and checkpoints the WAL
+    - Hit counts are buffered and written in batches, so reads don't turn into writes
+
+    All SQLite work runs on one dedicated thread holding the connection;
+    the async methods never block the event loop.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl_seconds: int = 24 * 3600,
+        max_bytes: int = 1024 * 1024 * 1024,
+        mmap_bytes: int = 256 * 1024 * 1024,
+        hit_flush_every: int = 64,
+    ):
+        """
+        path: database file; every process pointing at it shares the tier
+        ttl_seconds: time-to-live for disk entries (default: 1 day)
+        max_bytes: size budget (prompt + output bytes) enforced by compact()
+        mmap_bytes: how much of the database file SQLite maps into memory for reads
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._ttl = ttl_seconds
+        self._max_bytes = max_bytes
+        self._mmap_bytes = mmap_bytes
+        self._hit_flush_every = hit_flush_every
+        self._hits: Dict[bytes, int] = defaultdict(int)  # only touched on the cache thread
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="disk-cache")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending_writes = set()
+        self._executor.submit(self._connect).result()
+
+    @staticmethod
+    def _key(prompt: str, max_new_tokens: int, variant: str) -> bytes:
+        return hashlib.blake2b(repr(make_key(prompt, max_new_tokens, variant)).encode(), digest_size=16).digest()
+
+    # -----------------------------
+    # Cache thread
+    # -----------------------------
+    def _connect(self):
+        # Autocommit; multi-statement changes use explicit transactions
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # durable at checkpoints; a crash loses at most recent cache writes
+        conn.execute(f"PRAGMA mmap_size={int(self._mmap_bytes)}")
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")  # takes effect when the file is created
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key BLOB PRIMARY KEY,
+                prompt TEXT NOT NULL,
+                max_new_tokens INTEGER NOT NULL,
+                variant TEXT NOT NULL DEFAULT '',
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                size INTEGER NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                last_access REAL NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+        # Databases from before sampling parameters were part of the key
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(entries)")}
+        if "variant" not in columns:
+            conn.execute("ALTER TABLE entries ADD COLUMN variant TEXT NOT NULL DEFAULT ''")
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_expires_at ON entries (expires_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        self._conn = conn
+
+    def _get(self, key: bytes, now: float) -> Optional[Tuple[str, float]]:
+        row = self._conn.execute(
+            "SELECT value, expires_at FROM entries WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        if row is not None:
+            self._hits[key] += 1
+            if len(self._hits) >= self._hit_flush_every:
+                self._flush_hits(now)
+        return row
+
+    def _get_many(self, keys: List[bytes], now: float) -> Dict[bytes, Tuple[str, float]]:
+        found = {}
+        # Stay under SQLite's limit on bound parameters per statement
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._conn.execute(
+                f"SELECT key, value, expires_at FROM entries WHERE key IN ({placeholders}) AND expires_at > ?",
+                (*chunk, now),
+            )
+            found.update((key, (value, expires_at)) for key, value, expires_at in rows)
+        for key in found:
+            self._hits[key] += 1
+        if len(self._hits) >= self._hit_flush_every:
+            self._flush_hits(now)
+        return found
+
+    def _set(self, key: bytes, prompt: str, max_new_tokens: int, variant: str, value: str, now: float):
+        size = len(prompt.encode()) + len(value.encode())
+        self._conn.execute(
+            """
+            INSERT INTO entries (key, prompt, max_new_tokens, variant, value, expires_at, size, hits, last_access)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                value = excluded.value, expires_at = excluded.expires_at,
+                size = excluded.size, last_access = excluded.last_access
+            """,
+            (key, prompt, max_new_tokens, variant, value, now + self._ttl, size, now),
+        )
+
+    def _flush_hits(self, now: float):
+        if not self._hits:
+            return
+        hits, self._hits = self._hits, defaultdict(int)
+        self._conn.executemany(
+            "UPDATE entries SET hits = hits + ?, last_access = ? WHERE key = ?",
+            [(n, now, key) for key, n in hits.items()],
+        )
+
+    def _compact(self, now: float) -> Tuple[int, int]:
+        self._flush_hits(now)
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            expired = conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,)).rowcount
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            victims: List[Tuple[bytes]] = []
+            if total > self._max_bytes:
+                excess = total - self._max_bytes
+                for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_access"):
+                    victims.append((key,))
+                    excess -= size
+                    if excess <= 0:
+                        break
+                conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+                total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        # Return freed pages to the OS and fold the WAL back into the database file
+        conn.execute("PRAGMA incremental_vacuum")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        DISK_CACHE_BYTES.set(total)
+        return expired, len(victims)
+
+    def _hot_entries(self, limit: int, now: float) -> List[Tuple[str, int, str, str, float]]:
+        self._flush_hits(now)
+        return self._conn.execute(
+            """
+            SELECT prompt, max_new_tokens, variant, value, expires_at FROM entries
+            WHERE expires_at > ? ORDER BY hits DESC, last_access DESC LIMIT ?
+            """,
+            (now, limit),
+        ).fetchall()
+
+    # -----------------------------
+    # Event loop API
+    # -----------------------------
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def get(self, prompt: str, max_new_tokens: int, variant: str = "") -> Optional[Tuple[str, float]]:
+        """
+        Returns (value, expires_at) if the entry exists and hasn't expired.
+        """
+        return await self._run(self._get, self._key(prompt, max_new_tokens, variant), time.time())
+
+    async def get_many(
+        self, prompts: List[str], max_new_tokens: int, variant: str = ""
+    ) -> List[Optional[Tuple[str, float]]]:
+        """
+        get() for several prompts with the same settings, in order, as one query on the disk thread.
+        """
+        keys = [self._key(prompt, max_new_tokens, variant) for prompt in prompts]
+        found = await self._run(self._get_many, list(set(keys)), time.time())
+        return [found.get(key) for key in keys]
+
+    async def set(self, prompt: str, max_new_tokens: int, value: str, variant: str = ""):
+        await self._run(
+            self._set, self._key(prompt, max_new_tokens, variant), prompt, max_new_tokens, variant, value, time.time()
+        )
+
+    def set_nowait(self, prompt: str, max_new_tokens: int, value: str, variant: str = ""):
+        """
+        Write-behind: queue the write on the cache thread without waiting for it.
+        """
+        future = self._executor.submit(
+            self._set, self._key(prompt, max_new_tokens, variant), prompt, max_new_tokens, variant, value, time.time()
+        )
+        self._pending_writes.add(future)
+        future.add_done_callback(self._write_done)
+
+    def _write_done(self, future):
+        self._pending_writes.discard(future)
+        if future.exception() is not None:
+            log.error("Disk cache write failed: %r", future.exception())
+
+    async def compact(self) -> Tuple[int, int]:
+        """
+        Delete expired rows, trim the coldest rows to max_bytes and checkpoint the WAL.
+        Safe to run from several processes; each run is one write transaction.
+        Returns (expired, evicted).
+        """
+        expired, evicted = await self._run(self._compact, time.time())
+        DISK_CACHE_EVICTIONS.labels(reason="expired").inc(expired)
+        DISK_CACHE_EVICTIONS.labels(reason="capacity").inc(evicted)
+        return expired, evicted
+
+    async def hot_entries(self, limit: int) -> List[Tuple[str, int, str, str, float]]:
+        """
+        Most-hit unexpired entries as (prompt, max_new_tokens, variant, value, expires_at).
+        """
+        return await self._run(self._hot_entries, limit, time.time())
+
+    def close(self):
+        self._executor.submit(self._flush_hits, time.time())
+        self._executor.submit(self._conn.close)
+        self._executor.shutdown(wait=True)
+
+
+class TieredCache:
+    """
+    InMemoryCache in front of a DiskCache, with the same get/set interface.
+
+    - get: memory first; a disk hit is promoted into memory with its remaining TTL
+      (get_many: the same for a group of prompts, with one disk query)
+    - set: memory immediately, disk write-behind on the disk thread
+    - warm_start: load the disk tier's most-hit entries into memory, so a restarted
+      (or newly forked) server process doesn't start cold
+    """
+
+    def __init__(self, memory: InMemoryCache, disk: DiskCache):
+        self.memory = memory
+        self.disk = disk
+
+    async def get(self, prompt: str, max_new_tokens: int, variant: str = "") -> Optional[str]:
+        start = time.perf_counter()
+        value = await self.memory.get(prompt, max_new_tokens, variant)
+        cache_tier_lookup_histogram.labels(tier="memory").observe(time.perf_counter() - start)
+        if value is not None:
+            CACHE_TIER_HITS.labels(tier="memory").inc()
+            return value
+        CACHE_TIER_MISSES.labels(tier="memory").inc()
+
+        start = time.perf_counter()
+        entry = await self.disk.get(prompt, max_new_tokens, variant)
+        cache_tier_lookup_histogram.labels(tier="disk").observe(time.perf_counter() - start)
+        if entry is None:
+            CACHE_TIER_MISSES.labels(tier="disk").inc()
+            return None
+        CACHE_TIER_HITS.labels(tier="disk").inc()
+
+        value, expires_at = entry
+        await self.memory.set(prompt, max_new_tokens, value, ttl_seconds=expires_at - time.time(), variant=variant)
+        return value
+
+    async def get_many(self, prompts: List[str], max_new_tokens: int, variant: str = "") -> List[Optional[str]]:
+        """
+        get() for several prompts with the same settings: one memory pass, then
+        one disk query for whatever memory missed.
+        """
+        start = time.perf_counter()
+        values = await self.memory.get_many(prompts, max_new_tokens, variant)
+        cache_tier_lookup_histogram.labels(tier="memory").observe(time.perf_counter() - start)
+        misses = [i for i, value in enumerate(values) if value is None]
+        CACHE_TIER_HITS.labels(tier="memory").inc(len(values) - len(misses))
+        CACHE_TIER_MISSES.labels(tier="memory").inc(len(misses))
+        if not misses:
+            return values
+
+        start = time.perf_counter()
+        entries = await self.disk.get_many([prompts[i] for i in misses], max_new_tokens, variant)
+        cache_tier_lookup_histogram.labels(tier="disk").observe(time.perf_counter() - start)
+        now = time.time()
+        for i, entry in zip(misses, entries):
+            if entry is not None:
+                value, expires_at = entry
+                await self.memory.set(prompts[i], max_new_tokens, value, ttl_seconds=expires_at - now, variant=variant)
+                values[i] = value
+        hits = sum(entry is not None for entry in entries)
+        CACHE_TIER_HITS.labels(tier="disk").inc(hits)
+        CACHE_TIER_MISSES.labels(tier="disk").inc(len(entries) - hits)
+        return values
+
+    async def set(self, prompt: str, max_new_tokens: int, value: str, variant: str = ""):
+        await self.memory.set(prompt, max_new_tokens, value, variant=variant)
+        self.disk.set_nowait(prompt, max_new_tokens, value, variant)
+
+    async def warm_start(self, max_entries: int = 5_000) -> int:
+        """
+        Load up to max_entries of the hottest disk entries into memory.
+        Returns how many were loaded.
+        """
+        start = time.perf_counter()
+        entries = await self.disk.hot_entries(max_entries)
+        now = time.time()
+        # Coldest first, so the hottest entries end up most recently used
+        for prompt, max_new_tokens, variant, value, expires_at in reversed(entries):
+            await self.memory.set(prompt, max_new_tokens, value, ttl_seconds=expires_at - now, variant=variant)
+        log.info("Warm start loaded %d entries in %.2fs", len(entries), time.perf_counter() - start)
+        return len(entries)
+
+    async def cleanup(self):
+        await self.memory.cleanup()
+        await self.disk.compact()
+
+    async def start_periodic_cleanup(self, interval_seconds: int = 60):
+        """
+        Expire memory entries and compact the disk tier every interval_seconds.
+        A failed pass (e.g. database locked or disk full) is logged and retried
+        on the next interval.
+        """
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await self.cleanup()
+            except sqlite3.Error as e:
+                log.error("Cache cleanup failed: %r", e)
@@ -0,0 +1,620 @@
+# serving/engine.py
+# The inference engine: backend, workers behind the load balancer, batch size
+# controller, autoscaler and admission control.
+#
+# By default it runs inside the HTTP server process (serving/app.py). With
+# ENGINE_SOCKET set, the server is a lightweight front end instead (HTTP, JSON,
+# caches, single-flight) and cache misses go to one engine process over a
+# serving/transport.py channel, so several front ends can share a model:
+#
+#   python -m serving.engine --socket /tmp/llm-engine.sock
+#   ENGINE_SOCKET=/tmp/llm-engine.sock uvicorn serving.app:app --port 8000 --workers 4
+#
+# The engine side turns each incoming frame into a load_balancer.route_request
+# call, i.e. an enqueue_request / GenerationRequest on some worker's queue, so
+# the batching loops can't tell a remote request from a local one. A BATCH frame
+# (a /generate_batch group) becomes one load_balancer.route_batch call.
+
+import argparse
+import asyncio
+import itertools
+import os
+from array import array
+from typing import List, Optional
+
+import tracing
+from batch_processor import PRIORITY_INTERACTIVE, STREAM_END, RequestRejected
+from logs import get_logger
+from sampling import SamplingParams
+from serving.admission import AdmissionController
+from serving.batch_controller import BatchController
+from serving.load_balancer import make_load_balancer
+from serving.startup import StartupState, warm_up
+from serving.transport import (
+    BATCH, BATCH_PROMPT_OVERHEAD, CANCEL, ERROR, REQUEST, RESULT, TOKEN_TYPECODE, TOKENS,
+    SocketChannel, ShmChannel, ShmRing,
+    decode, decode_batch, decode_error, decode_hello, decode_request, decode_text, decode_tokens,
+    encode_batch, encode_cancel, encode_error, encode_hello, encode_request, encode_result, encode_tokens,
+)
+
+log = get_logger("engine")
+
+# round_robin | least_outstanding | power_of_two | consistent_hash (prefix/KV cache affinity)
+LB_POLICY = os.environ.get("LB_POLICY", "consistent_hash")
+# Local copy of the converted model (safetensors, mmap-loaded) and torch.compile
+# cache, so restarts skip the hub download and dtype conversion; "" disables it
+MODEL_ARTIFACT_DIR = os.environ.get("MODEL_ARTIFACT_DIR", "cache/models")
+# Execution profile from model.PROFILES: fp32 | bf16 | int8 (dynamic, CPU only);
+# python -m experiments.execution_profile_benchmark compares them against fp32
+MODEL_PROFILE = os.environ.get("MODEL_PROFILE", "fp32")
+MODEL_NAME = os.environ.get("MODEL_NAME", "distilgpt2")
+# Speculative decoding: a smaller model with the same tokenizer drafts
+# SPECULATIVE_DRAFT_TOKENS tokens per step for MODEL_NAME to verify (unset = off)
+SPECULATIVE_DRAFT_MODEL = os.environ.get("SPECULATIVE_DRAFT_MODEL")
+SPECULATIVE_DRAFT_TOKENS = int(os.environ.get("SPECULATIVE_DRAFT_TOKENS", "4"))
+# Inference backend (backends.BACKENDS): "hf" serves MODEL_NAME; "synthetic" serves
+# fake tokens at SYNTHETIC_STEP_MS per forward pass, to load-test the serving
+# stack itself without a model
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "hf")
+SYNTHETIC_STEP_MS = float(os.environ.get("SYNTHETIC_STEP_MS", "10"))
+# Engine process: Unix socket front ends connect to, and the size of each
+# shared memory ring (one per direction per front end)
+ENGINE_SOCKET = os.environ.get("ENGINE_SOCKET")
+ENGINE_RING_BYTES = int(os.environ.get("ENGINE_RING_BYTES", str(4 * 1024 * 1024)))
+# KV cache memory of all workers' running batches together (split evenly
+# between MAX_WORKERS; 0 = unbounded), and how running bulk requests give way
+# to interactive ones: "recompute" (drop their KV, prefill it again later),
+# "swap" (copy it to host memory and back) or "off"
+KV_BUDGET_BYTES = int(os.environ.get("KV_BUDGET_BYTES", str(2 * 1024 ** 3)))
+KV_PREEMPTION = os.environ.get("KV_PREEMPTION", "recompute")
+# Warm-up runs these batch sizes x prompt lengths through every worker before readiness
+WARM_UP_BATCH_SIZES = (1, 4, 8)
+WARM_UP_PROMPT_TOKENS = (16, 128)
+
+
+def load_backend():
+    from backends import make_backend
+
+    if INFERENCE_BACKEND == "synthetic":
+        from backends.synthetic import LatencyModel
+        return make_backend("synthetic", latency=LatencyModel(step_ms=SYNTHETIC_STEP_MS))
+
+    from model import load_model
+
+    model, tokenizer = load_model(MODEL_NAME, profile=MODEL_PROFILE, artifact_dir=MODEL_ARTIFACT_DIR or None)
+    model.eval()
+    draft_model = None
+    if SPECULATIVE_DRAFT_MODEL:
+        draft_model, _ = load_model(
+            SPECULATIVE_DRAFT_MODEL, profile=MODEL_PROFILE, artifact_dir=MODEL_ARTIFACT_DIR or None
+        )
+    return make_backend(
+        INFERENCE_BACKEND,
+        model=model,
+        tokenizer=tokenizer,
+        draft_model=draft_model,
+        num_draft_tokens=SPECULATIVE_DRAFT_TOKENS,
+    )
+
+
+class InferenceEngine:
+    """
+    Everything behind the caches. admit() applies admission control and returns
+    the request's deadline; route_request() runs it on a worker, route_batch()
+    a group of requests.
+    """
+
+    def __init__(self, lb_policy: str = LB_POLICY):
+        self.load_balancer = make_load_balancer(lb_policy)
+        self.backend = None
+        self.batch_controller = None
+        self.autoscaler = None
+        self.admission = None
+
+    @property
+    def tokenizer(self):
+        return self.backend.tokenizer
+
+    async def start(self, startup: StartupState):
+        """
+        Load the backend, start the workers and warm them up, as startup phases.
+        """
+        loop = asyncio.get_running_loop()
+        with startup.track("import"):
+            # torch/transformers take seconds to import; keep them off the module import path
+            import backends.hf
+            from serving.autoscaler import AutoScaler
+
+        with startup.track("load_model"):
+            log.info("Loading %s backend on startup...", INFERENCE_BACKEND)
+            # Blocking load runs on a thread so liveness and metrics keep answering
+            self.backend = await loop.run_in_executor(None, load_backend)
+
+        with startup.track("start_workers"):
+            self._start_workers(AutoScaler)
+
+        with startup.track("warm_up"):
+            await warm_up(
+                self.autoscaler.workers,
+                batch_sizes=WARM_UP_BATCH_SIZES,
+                prompt_tokens=WARM_UP_PROMPT_TOKENS,
+            )
+
+        # Background loops start only now, so warm-up traffic doesn't feed the forecasts
+        asyncio.create_task(self.batch_controller.run(interval=1.0))
+        asyncio.create_task(self.autoscaler.monitor())
+
+    def _start_workers(self, AutoScaler):
+        # Batch size is retuned at runtime against a p95 latency SLO
+        self.batch_controller = BatchController(
+            latency_slo_s=2.0,
+            batch_size=8,
+            max_batch_size=32,
+            continuous=True,
+            queue_depth=lambda: self.autoscaler.total_queue_depth(),
+        )
+
+        # 🔑 Each worker owns a queue, a continuous batching loop and an inference thread.
+        # The autoscaler starts/drains workers and keeps the load balancer in sync.
+        NUM_WORKERS = 2  # you can increase later
+        MAX_WORKERS = 4
+        self.autoscaler = AutoScaler(
+            self.backend,
+            self.load_balancer,
+            initial_workers=NUM_WORKERS,
+            max_workers=MAX_WORKERS,
+            min_workers=1,
+            max_batch_size=8,
+            controller=self.batch_controller,
+            # Reuse KV for shared prompt prefixes (system prompts, templates)
+            prefix_cache_bytes=256 * 1024 * 1024,
+            # Split the cores between replicas instead of oversubscribing
+            threads_per_worker=max(1, (os.cpu_count() or 1) // MAX_WORKERS),
+            # Bound KV memory even with every worker running, so long
+            # generations wait (or bulk ones are preempted) instead of OOMing
+            kv_budget_bytes=KV_BUDGET_BYTES // MAX_WORKERS or None,
+            preemption=None if KV_PREEMPTION == "off" else KV_PREEMPTION,
+        )
+
+        # Refuse work early (429/503 + Retry-After) instead of letting queues grow without bound
+        self.admission = AdmissionController(
+            queue_depth=self.autoscaler.total_queue_depth,
+            capacity=self.autoscaler.capacity,
+            max_queue_depth=256,
+            default_timeout_s=30.0,
+        )
+
+    def admit(self, priority: int = PRIORITY_INTERACTIVE, timeout_s: Optional[float] = None) -> float:
+        return self.admission.admit(priority, timeout_s)
+
+    async def route_request(
+        self,
+        prompt: str,
+        max_new_tokens: int,
+        stream: Optional[asyncio.Queue] = None,
+        deadline: Optional[float] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        timeout_s: Optional[float] = None,
+        sampling: Optional[SamplingParams] = None,
+    ) -> str:
+        """
+        timeout_s: unused here, admit() has already turned it into the deadline
+        """
+        return await self.load_balancer.route_request(
+            prompt, max_new_tokens, stream=stream, deadline=deadline, priority=priority, sampling=sampling
+        )
+
+    async def route_batch(
+        self,
+        prompts: List[str],
+        max_new_tokens: int,
+        deadline: Optional[float] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        timeout_s: Optional[float] = None,
+        sampling: Optional[SamplingParams] = None,
+    ) -> List[asyncio.Future]:
+        """
+        Enqueue a group of non-streaming requests together (load_balancer.route_batch);
+        returns a future per prompt, in order. The group is admitted once, by the
+        caller. timeout_s: unused here, as in route_request
+        """
+        return self.load_balancer.route_batch(
+            prompts, max_new_tokens, deadline=deadline, priority=priority, sampling=sampling
+        )
+
+
+def tokenizer_spec(tokenizer) -> dict:
+    """
+    What a front end needs to rebuild the engine's tokenizer (to turn streamed
+    token ids into text) without loading transformers.
+    """
+    if hasattr(tokenizer, "backend_tokenizer"):
+        return {"kind": "hf", "tokenizer_json": tokenizer.backend_tokenizer.to_str()}
+    return {"kind": "synthetic", "vocab_size": tokenizer.vocab_size}
+
+
+def tokenizer_from_spec(spec: dict):
+    if spec["kind"] == "hf":
+        # The Rust tokenizer alone: no torch/transformers import in the front end
+        from tokenizers import Tokenizer
+        return Tokenizer.from_str(spec["tokenizer_json"])
+    from backends.synthetic import SyntheticTokenizer
+    return SyntheticTokenizer(spec["vocab_size"])
+
+
+# -----------------------------
+# Engine process
+# -----------------------------
+async def serve(engine: InferenceEngine, path: str, ring_bytes: int = ENGINE_RING_BYTES):
+    """
+    Accept front end connections on a Unix socket until cancelled.
+    """
+    if os.path.exists(path):
+        os.unlink(path)  # left over from an engine that didn't shut down cleanly
+    server = await asyncio.start_unix_server(
+        lambda reader, writer: _serve_connection(engine, reader, writer, ring_bytes), path
+    )
+    log.info("Engine listening on %s", path)
+    async with server:
+        await server.serve_forever()
+
+
+async def _serve_connection(engine: InferenceEngine, reader, writer, ring_bytes: int):
+    handshake = SocketChannel(reader, writer)
+    try:
+        _, _, body = decode(await handshake.recv())
+    except ConnectionError:
+        return
+    hello = decode_hello(body)
+    reply = {"transport": "socket", "tokenizer": tokenizer_spec(engine.tokenizer)}
+    channel = handshake
+    if hello.get("transport") == "shm":
+        try:
+            request_ring, response_ring = ShmRing(capacity=ring_bytes), ShmRing(capacity=ring_bytes)
+        except OSError as e:
+            log.warning("Shared memory unavailable (%r), falling back to the socket transport", e)
+        else:
+            reply.update(transport="shm", rings={"request": request_ring.name, "response": response_ring.name})
+            channel = ShmChannel(response_ring, request_ring, reader, writer)
+    await handshake.send(encode_hello(reply))
+    log.info("Front end connected (%s transport)", reply["transport"])
+
+    requests = {}  # request id -> task
+    try:
+        while True:
+            kind, request_id, body = decode(await channel.recv())
+            if kind == REQUEST:
+                task = asyncio.create_task(_serve_request(engine, channel, request_id, *decode_request(body)))
+                requests[request_id] = task
+                task.add_done_callback(lambda _, request_id=request_id: requests.pop(request_id, None))
+            elif kind == BATCH:
+                _serve_batch(engine, channel, request_id, requests, *decode_batch(body))
+            elif kind == CANCEL and request_id in requests:
+                requests[request_id].cancel()
+    except ConnectionError:
+        log.info("Front end disconnected, cancelling its %d requests", len(requests))
+    finally:
+        # The rings are unmapped below; nothing may still be writing to them
+        tasks = list(requests.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        channel.close()
+
+
+async def _serve_request(
+    engine: InferenceEngine,
+    channel,
+    request_id: int,
+    prompt: str,
+    max_new_tokens: int,
+    priority: int,
+    stream: bool,
+    timeout_s: Optional[float],
+    sampling: SamplingParams,
+):
+    tracing.start_trace()
+
+    async def run():
+        deadline = engine.admit(priority, timeout_s)
+        if not stream:
+            return await engine.route_request(
+                prompt, max_new_tokens, deadline=deadline, priority=priority, sampling=sampling
+            )
+        return await _stream_request(engine, channel, request_id, prompt, max_new_tokens, deadline, priority, sampling)
+
+    await _reply(channel, request_id, run())
+
+
+def _serve_batch(
+    engine: InferenceEngine,
+    channel,
+    first_id: int,
+    requests: dict,
+    prompts: List[str],
+    max_new_tokens: int,
+    priority: int,
+    timeout_s: Optional[float],
+    sampling: SamplingParams,
+):
+    """
+    Admit the group once and enqueue it right away (before the next frame is read),
+    with one reply task per prompt under its own request id.
+    """
+    tracing.start_trace()
+    try:
+        deadline = engine.admit(priority, timeout_s)
+    except RequestRejected as exc:
+        refused = asyncio.get_running_loop().create_future()
+        refused.set_exception(exc)
+        results = [refused] * len(prompts)
+    else:
+        results = engine.load_balancer.route_batch(
+            prompts, max_new_tokens, deadline=deadline, priority=priority, sampling=sampling
+        )
+    for request_id, result in enumerate(results, start=first_id):
+        task = asyncio.create_task(_reply(channel, request_id, result))
+        requests[request_id] = task
+        task.add_done_callback(lambda _, request_id=request_id: requests.pop(request_id, None))
+
+
+async def _reply(channel, request_id: int, result):
+    """
+    Await the request's result and send it back as a RESULT or ERROR frame;
+    dropped if the front end has disconnected.
+    """
+    try:
+        frame = encode_result(request_id, await result)
+    except RequestRejected as exc:
+        frame = encode_error(request_id, exc.reason, exc.status_code, exc.retry_after)
+    except ConnectionError:
+        return  # a streamed request lost its front end mid-stream
+    except Exception as e:
+        log.error("Request failed in the engine: %r", e)
+        frame = encode_error(request_id, "internal_error", 500, 0.0)
+    try:
+        await channel.send(frame)
+    except ConnectionError:
+        pass
+
+
+async def _stream_request(engine, channel, request_id, prompt, max_new_tokens, deadline, priority, sampling) -> str:
+    tokens = asyncio.Queue()
+    task = asyncio.create_task(
+        engine.route_request(
+            prompt, max_new_tokens, stream=tokens, deadline=deadline, priority=priority, sampling=sampling
+        )
+    )
+    # Make sure the stream ends even if generation fails before finishing
+    task.add_done_callback(lambda _: tokens.put_nowait(STREAM_END))
+    try:
+        done = False
+        while not done:
+            # Every token decoded since the last frame goes out in one TOKENS frame
+            token_ids = array(TOKEN_TYPECODE)
+            token_id = await tokens.get()
+            while True:
+                if token_id is STREAM_END:
+                    done = True
+                    break
+                token_ids.append(token_id)
+                if tokens.empty():
+                    break
+                token_id = tokens.get_nowait()
+            if token_ids:
+                await channel.send(encode_tokens(request_id, token_ids))
+        return await task
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+async def run_engine(path: str, metrics_port: int):
+    from prometheus_client import start_http_server
+
+    # Batching, latency and queue metrics live in this process
+    start_http_server(metrics_port, "0.0.0.0")
+    engine = InferenceEngine()
+    await engine.start(StartupState())
+    await serve(engine, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inference engine process for ENGINE_SOCKET front ends")
+    parser.add_argument("--socket", default=ENGINE_SOCKET or "/tmp/llm-engine.sock")
+    parser.add_argument("--metrics-port", type=int, default=8002)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(run_engine(args.socket, args.metrics_port))
+    except KeyboardInterrupt:
+        pass
+
+
+# -----------------------------
+# Front end side
+# -----------------------------
+class EngineClient:
+    """
+    A remote InferenceEngine, with the same admit/route_request interface.
+    The engine applies admission control when the request arrives, so admit()
+    has nothing to do here; refusals come back from route_request as
+    RequestRejected, like every other engine-side error. If the engine goes
+    away, pending requests fail with 503 and the client reconnects.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        transport: str = "shm",
+        retry_interval_s: float = 0.5,
+        max_batch_frame_bytes: int = 256 * 1024,
+    ):
+        """
+        max_batch_frame_bytes: size of a BATCH frame; keep well under the engine's ring size
+        """
+        self.path = path
+        self.transport = transport
+        self.retry_interval_s = retry_interval_s
+        self.max_batch_frame_bytes = max_batch_frame_bytes
+        self.channel = None
+        self.tokenizer = None
+        self._pending = {}  # request id -> (future, stream queue or None)
+        self._request_ids = itertools.count(1)
+
+    async def connect(self):
+        """
+        Wait until the engine accepts the connection (it listens once warmed up).
+        """
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+                handshake = SocketChannel(reader, writer)
+                await handshake.send(encode_hello({"transport": self.transport}))
+                reply = decode_hello(decode(await handshake.recv())[2])
+                break
+            except (FileNotFoundError, ConnectionError):
+                # Not listening yet, or an engine going down as we connected
+                await asyncio.sleep(self.retry_interval_s)
+        self.tokenizer = tokenizer_from_spec(reply["tokenizer"])
+        if reply["transport"] == "shm":
+            rings = reply["rings"]
+            self.channel = ShmChannel(ShmRing(rings["request"]), ShmRing(rings["response"]), reader, writer)
+        else:
+            self.channel = handshake
+        log.info("Connected to the engine at %s (%s transport)", self.path, reply["transport"])
+        asyncio.create_task(self._read_responses(self.channel))
+
+    async def _read_responses(self, channel):
+        try:
+            while True:
+                kind, request_id, body = decode(await channel.recv())
+                pending = self._pending.get(request_id)
+                if pending is None:
+                    continue  # cancelled
+                future, stream = pending
+                if kind == TOKENS:
+                    if stream is not None:
+                        for token_id in decode_tokens(body):
+                            stream.put_nowait(token_id)
+                elif kind == RESULT:
+                    del self._pending[request_id]
+                    if not future.done():
+                        future.set_result(decode_text(body))
+                elif kind == ERROR:
+                    del self._pending[request_id]
+                    if not future.done():
+                        reason, status_code, retry_after = decode_error(body)
+                        future.set_exception(RequestRejected(reason, status_code=status_code, retry_after=retry_after))
+        except ConnectionError:
+            log.error("Lost the engine at %s, reconnecting", self.path)
+        self.channel = None
+        channel.close()
+        for future, _ in self._pending.values():
+            if not future.done():
+                future.set_exception(RequestRejected("engine_unavailable", status_code=503, retry_after=5.0))
+        self._pending.clear()
+        await self.connect()
+
+    def admit(self, priority: int = PRIORITY_INTERACTIVE, timeout_s: Optional[float] = None) -> None:
+        return None
+
+    async def route_request(
+        self,
+        prompt: str,
+        max_new_tokens: int,
+        stream: Optional[asyncio.Queue] = None,
+        deadline: Optional[float] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        timeout_s: Optional[float] = None,
+        sampling: Optional[SamplingParams] = None,
+    ) -> str:
+        """
+        deadline: unused, the engine derives its own from timeout_s
+        """
+        channel = self.channel
+        if channel is None:
+            raise RequestRejected("engine_unavailable", status_code=503, retry_after=5.0)
+        request_id = next(self._request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = (future, stream)
+        try:
+            await channel.send(
+                encode_request(request_id, prompt, max_new_tokens, priority, stream is not None, timeout_s, sampling)
+            )
+            return await future
+        except asyncio.CancelledError:
+            # Client went away: free the request's batch slot in the engine
+            if self._pending.pop(request_id, None) is not None and self.channel is channel:
+                asyncio.create_task(self._cancel(channel, request_id))
+            raise
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def route_batch(
+        self,
+        prompts: List[str],
+        max_new_tokens: int,
+        deadline: Optional[float] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        timeout_s: Optional[float] = None,
+        sampling: Optional[SamplingParams] = None,
+    ) -> List[asyncio.Future]:
+        """
+        Send the group as BATCH frames of at most max_batch_frame_bytes each (a
+        prompt larger than that alone gets its own), back to back; returns a
+        future per prompt, in order.
+        Cancelling a future cancels that request in the engine.
+        deadline: unused, the engine derives its own from timeout_s
+        """
+        channel = self.channel
+        if channel is None:
+            raise RequestRejected("engine_unavailable", status_code=503, retry_after=5.0)
+        if not prompts:
+            return []
+        # Sized in encoded bytes, not characters: non-ASCII text takes up to 4 bytes a character
+        fixed = len(encode_batch(0, [], max_new_tokens, priority, timeout_s, sampling))
+        groups, size = [[]], fixed
+        for prompt in (p.encode() for p in prompts):
+            added = BATCH_PROMPT_OVERHEAD + len(prompt)
+            if groups[-1] and size + added > self.max_batch_frame_bytes:
+                groups.append([])
+                size = fixed
+            groups[-1].append(prompt)
+            size += added
+
+        loop = asyncio.get_running_loop()
+        futures, frames = [], []
+        for group in groups:
+            first_id = next(self._request_ids)
+            # A frame's ids are consecutive: move the counter past them
+            self._request_ids = itertools.count(first_id + len(group))
+            for request_id in range(first_id, first_id + len(group)):
+                future = loop.create_future()
+                self._pending[request_id] = (future, None)
+                future.add_done_callback(lambda f, request_id=request_id: self._batch_done(channel, request_id, f))
+                futures.append(future)
+            frames.append(encode_batch(first_id, group, max_new_tokens, priority, timeout_s, sampling))
+        try:
+            for frame in frames:
+                await channel.send(frame)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+        return futures
+
+    def _batch_done(self, channel, request_id: int, future: asyncio.Future):
+        # Resolved by _read_responses, or cancelled by the caller: free the request's slot in the engine
+        if self._pending.pop(request_id, None) is not None and future.cancelled() and self.channel is channel:
+            asyncio.create_task(self._cancel(channel, request_id))
+
+    @staticmethod
+    async def _cancel(channel, request_id: int):
+        try:
+            await channel.send(encode_cancel(request_id))
+        except ConnectionError:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,261 @@
 # load_balancer.py
 import asyncio
+import bisect
+import hashlib
+import math
+import random
+import time
+from typing import List, Optional
+
+import tracing
+from batch_processor import PRIORITY_INTERACTIVE
+from sampling import SamplingParams
+
+
+class WorkerStats:
+    """
+    Per-worker load signals kept by the balancer.
+    in_flight: requests routed to the worker and not yet finished (queued + running)
+    ewma_latency: smoothed seconds per requested token
+    """
+
+    __slots__ = ("in_flight", "ewma_latency")
 
-class RoundRobinLoadBalancer:
     def __init__(self):
+        self.in_flight = 0
+        self.ewma_latency = 0.0
+
+
+def _release(stats: WorkerStats):
+    stats.in_flight -= 1
+
+
+class LoadBalancer:
+    """
+    Base class: worker registry, per-worker in-flight counts and EWMA latency.
+    Subclasses implement choose().
+
+    Choosing a worker never awaits, so on the event loop no lock is needed:
+    each request reads and updates the stats atomically with respect to the others.
+    """
+
+    def __init__(self, ewma_alpha: float = 0.2):
         self.workers = []
-        self.next_index = 0
-        self.lock = asyncio.Lock()
+        self.stats = {}
+        self.ewma_alpha = ewma_alpha
 
     def register_worker(self, worker_callable):
         """
         Add a worker to the pool.
-        worker_callable: async function that takes (prompt, max_new_tokens) and returns output
+        worker_callable: async function that takes (prompt, max_new_tokens, stream=, deadline=, priority=)
+            and returns output
         """
         self.workers.append(worker_callable)
+        self.stats[worker_callable] = WorkerStats()
 
-    async def route_request(self, prompt: str, max_new_tokens: int):
+    def unregister_worker(self, worker_callable):
         """
-        Send the request to the next worker in round-robin order.
+        Remove a worker from the pool; requests already routed to it are unaffected.
         """
-        async with self.lock:
-            if not self.workers:
-                raise RuntimeError("No workers registered in load balancer")
+        if worker_callable in self.workers:
+            self.workers.remove(worker_callable)
+            self.stats.pop(worker_callable, None)
+
+    def choose(self, prompt: str):
+        raise NotImplementedError
+
+    def cost(self, worker) -> float:
+        """
+        Expected wait on a worker: outstanding requests weighted by its recent speed.
+        Falls back to the plain in-flight count until latency has been observed.
+        """
+        s = self.stats[worker]
+        return (s.in_flight + 1) * (s.ewma_latency or 1.0)
+
+    async def route_request(
+        self,
+        prompt: str,
+        max_new_tokens: int,
+        stream=None,
+        deadline=None,
+        priority: int = PRIORITY_INTERACTIVE,
+        sampling: Optional[SamplingParams] = None,
+    ):
+        """
+        Send the request to the worker picked by the policy.
+        stream: optional asyncio.Queue that receives token ids while decoding
+        deadline, priority, sampling: passed through to the worker (see enqueue_request)
+        """
+        route_start = tracing.now()
+        if not self.workers:
+            raise RuntimeError("No workers registered in load balancer")
+
+        worker = self.choose(prompt)
+        stats = self.stats[worker]
+        stats.in_flight += 1
+        tracing.spans.record("lb_route", route_start, trace_id=tracing.current_trace_id.get())
+        try:
+            return await self._call(worker, stats, prompt, max_new_tokens, stream, deadline, priority, sampling)
+        finally:
+            stats.in_flight -= 1
+
+    def route_batch(
+        self,
+        prompts: List[str],
+        max_new_tokens: int,
+        deadline=None,
+        priority: int = PRIORITY_INTERACTIVE,
+        sampling: Optional[SamplingParams] = None,
+    ) -> List[asyncio.Task]:
+        """
+        Route a group of prompts with the same settings; returns one task per prompt, in order.
+        The group is split into at most one contiguous chunk per worker, each chunk
+        going where the policy sends its first prompt. A chunk's tasks are created
+        together, so all of its requests are on the worker's queue before its batching
+        loop next runs and land in the same batches (as far as slots allow).
+        Cancelling a task cancels that request only.
+        """
+        route_start = tracing.now()
+        if not self.workers:
+            raise RuntimeError("No workers registered in load balancer")
+
+        chunk_size = math.ceil(len(prompts) / min(len(prompts), len(self.workers))) if prompts else 1
+        tasks = []
+        for start in range(0, len(prompts), chunk_size):
+            chunk = prompts[start:start + chunk_size]
+            worker = self.choose(chunk[0])
+            stats = self.stats[worker]
+            # Counted now, so the next chunk's choice sees this one
+            stats.in_flight += len(chunk)
+            for prompt in chunk:
+                task = asyncio.ensure_future(
+                    self._call(worker, stats, prompt, max_new_tokens, None, deadline, priority, sampling)
+                )
+                # A callback rather than a finally: a task cancelled before it starts never runs its body
+                task.add_done_callback(lambda _, stats=stats: _release(stats))
+                tasks.append(task)
+        tracing.spans.record("lb_route", route_start, trace_id=tracing.current_trace_id.get(), size=len(prompts))
+        return tasks
+
+    async def _call(self, worker, stats: WorkerStats, prompt, max_new_tokens, stream, deadline, priority, sampling):
+        # Call the worker; the caller keeps stats.in_flight
+        start = time.perf_counter()
+        result = await worker(
+            prompt, max_new_tokens, stream=stream, deadline=deadline, priority=priority, sampling=sampling
+        )
+
+        per_token = (time.perf_counter() - start) / max(1, max_new_tokens)
+        if stats.ewma_latency:
+            stats.ewma_latency += self.ewma_alpha * (per_token - stats.ewma_latency)
+        else:
+            stats.ewma_latency = per_token
+        return result
+
+
+class RoundRobinLoadBalancer(LoadBalancer):
+    """
+    Cycle through workers regardless of their load.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.next_index = 0
+
+    def choose(self, prompt: str):
+        self.next_index %= len(self.workers)
+        worker = self.workers[self.next_index]
+        self.next_index = (self.next_index + 1) % len(self.workers)
+        return worker
+
+
+class LeastOutstandingLoadBalancer(LoadBalancer):
+    """
+    Pick the worker with the lowest expected wait (outstanding requests x EWMA latency).
+    """
+
+    def choose(self, prompt: str):
+        return min(self.workers, key=self.cost)
+
+
+class PowerOfTwoLoadBalancer(LoadBalancer):
+    """
+    Power-of-two-choices: sample two workers at random and take the less loaded one.
+    Nearly as good as least-outstanding, without comparing every worker.
+    """
+
+    def choose(self, prompt: str):
+        if len(self.workers) == 1:
+            return self.workers[0]
+        a, b = random.sample(self.workers, 2)
+        return a if self.cost(a) <= self.cost(b) else b
+
+
+class ConsistentHashLoadBalancer(LoadBalancer):
+    """
+    Cache affinity: hash the prompt prefix onto a ring of virtual nodes, so repeats
+    of a prefix land on the worker already holding its KV/prefix cache.
+    Bounded load: if the owner already has more than load_factor x the average
+    in-flight requests, walk the ring to the next worker that doesn't.
+    """
+
+    def __init__(self, prefix_chars: int = 256, virtual_nodes: int = 64, load_factor: float = 1.25, **kwargs):
+        super().__init__(**kwargs)
+        self.prefix_chars = prefix_chars
+        self.virtual_nodes = virtual_nodes
+        self.load_factor = load_factor
+        self._ring_hashes = []
+        self._ring_workers = []
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+    def _worker_key(self, worker_callable) -> str:
+        owner = getattr(worker_callable, "__self__", worker_callable)
+        return str(getattr(owner, "worker_id", id(owner)))
+
+    def _rebuild_ring(self):
+        points = sorted(
+            (self._hash(f"{self._worker_key(w)}#{v}"), i)
+            for i, w in enumerate(self.workers)
+            for v in range(self.virtual_nodes)
+        )
+        self._ring_hashes = [h for h, _ in points]
+        self._ring_workers = [self.workers[i] for _, i in points]
+
+    def register_worker(self, worker_callable):
+        super().register_worker(worker_callable)
+        self._rebuild_ring()
+
+    def unregister_worker(self, worker_callable):
+        super().unregister_worker(worker_callable)
+        self._rebuild_ring()
+
+    def choose(self, prompt: str):
+        total = sum(s.in_flight for s in self.stats.values())
+        limit = math.ceil(self.load_factor * (total + 1) / len(self.workers))
+
+        start = bisect.bisect(self._ring_hashes, self._hash(prompt[:self.prefix_chars]))
+        n = len(self._ring_workers)
+        for i in range(n):
+            worker = self._ring_workers[(start + i) % n]
+            if self.stats[worker].in_flight + 1 <= limit:
+                return worker
+        return self._ring_workers[start % n]
+
+
+POLICIES = {
+    "round_robin": RoundRobinLoadBalancer,
+    "least_outstanding": LeastOutstandingLoadBalancer,
+    "power_of_two": PowerOfTwoLoadBalancer,
+    "consistent_hash": ConsistentHashLoadBalancer,
+}
 
-            worker = self.workers[self.next_index]
-            self.next_index = (self.next_index + 1) % len(self.workers)
 
-        # Call the worker
-        return await worker(prompt, max_new_tokens)
+def make_load_balancer(policy: str = "round_robin", **kwargs) -> LoadBalancer:
+    """
+    Build the load balancer named in config.
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown load balancing policy {policy!r}, expected one of {sorted(POLICIES)}")
+    return POLICIES[policy](**kwargs)
@@ -0,0 +1,76 @@
+# serving/profiling.py
+# On-demand profiling windows for /debug/profile. Both are blocking and run on
+# a thread of their own while the server keeps serving.
+#
+# - sample_stacks: a py-spy-like wall-clock sampler in pure Python. Every
+#   interval it reads every other thread's current frame (sys._current_frames)
+#   and counts the stacks; the result is in folded format ("thread;frame;frame N"),
+#   which flamegraph.pl, speedscope and inferno read directly
+# - torch_profile: torch.profiler over the window (CPU, plus CUDA if available),
+#   saved as a Chrome trace and summarized as an operator table. Needs a torch
+#   recent enough to profile every thread; older ones only see this thread
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+
+def _folded(frame, thread_name: str) -> str:
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    parts.append(thread_name)
+    return ";".join(reversed(parts))
+
+
+def sample_stacks(seconds: float, interval_s: float = 0.005) -> Counter:
+    """
+    Sample every thread's Python stack for `seconds`; returns folded stack -> samples.
+    Threads blocked in C (a forward pass, a socket wait) show the Python frame
+    that called in. Costs one stack walk per thread per sample, on this thread.
+    """
+    me = threading.get_ident()
+    counts = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident != me:
+                counts[_folded(frame, names.get(ident, str(ident)))] += 1
+        time.sleep(interval_s)
+    return counts
+
+
+def format_folded(counts: Counter) -> str:
+    return "".join(f"{stack} {n}\n" for stack, n in counts.most_common())
+
+
+def torch_profile(seconds: float, trace_path: Optional[str] = None, row_limit: int = 30) -> str:
+    """
+    Run torch.profiler for `seconds` while the workers keep serving; optionally
+    export a Chrome trace. Returns the top operators by self CPU time.
+    """
+    import torch
+    from torch.profiler import ProfilerActivity, profile
+
+    activities = [ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(ProfilerActivity.CUDA)
+    # By default only ops on the thread that starts the profiler are recorded;
+    # the model runs on the workers' inference threads
+    try:
+        from torch._C._profiler import _ExperimentalConfig
+        config = _ExperimentalConfig(profile_all_threads=True)
+    except (ImportError, TypeError):
+        config = None
+    with profile(activities=activities, record_shapes=True, experimental_config=config) as prof:
+        time.sleep(seconds)
+    if trace_path:
+        os.makedirs(os.path.dirname(trace_path) or ".", exist_ok=True)
+        prof.export_chrome_trace(trace_path)
+    return prof.key_averages().table(sort_by="self_cpu_time_total", row_limit=row_limit)
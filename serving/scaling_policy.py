@@ -0,0 +1,146 @@
+# serving/scaling_policy.py
+# Autoscaling decisions, kept free of model/server imports so the same
+# policies run live (serving.autoscaler) and offline (experiments/autoscaler_simulator.py).
+import math
+from dataclasses import dataclass
+
+
+@dataclass
+class ScalingObservation:
+    now: float            # seconds (monotonic or trace time)
+    interval: float       # seconds since the previous observation
+    arrivals: int         # requests routed to workers during the interval
+    completions: int      # requests finished during the interval
+    queue_depth: int      # requests accepted but not running yet (worker queues + batching look-ahead)
+    workers: int          # provisioned workers right now
+    starting: int = 0     # of which still starting up (not serving yet)
+
+
+class QueueThresholdPolicy:
+    """
+    The original rule: add a worker when more than `scale_up_queue` requests
+    are queued, remove one as soon as the queue is empty.
+    """
+
+    def __init__(self, scale_up_queue: int = 2):
+        self.scale_up_queue = scale_up_queue
+
+    def desired_workers(self, obs: ScalingObservation) -> int:
+        if obs.queue_depth > self.scale_up_queue:
+            return obs.workers + 1
+        if obs.queue_depth == 0:
+            return obs.workers - 1
+        return obs.workers
+
+
+class HoltForecaster:
+    """
+    Holt's linear (double exponential) smoothing of a rate series:
+    a level plus a trend, so a ramping load is extrapolated instead of chased.
+    """
+
+    def __init__(self, alpha: float = 0.5, beta: float = 0.2):
+        self.alpha = alpha
+        self.beta = beta
+        self.level = None
+        self.trend = 0.0
+
+    def update(self, value: float):
+        if self.level is None:
+            self.level = value
+            return
+        previous = self.level
+        self.level = self.alpha * value + (1 - self.alpha) * (self.level + self.trend)
+        self.trend = self.beta * (self.level - previous) + (1 - self.beta) * self.trend
+
+    def forecast(self, steps: float) -> float:
+        if self.level is None:
+            return 0.0
+        return max(0.0, self.level + steps * self.trend)
+
+
+class PredictivePolicy:
+    """
+    Capacity planning from forecast arrival rate and measured service rate.
+
+    - Arrival rate: Holt forecast `horizon_s` ahead (roughly a worker's startup time)
+    - Service rate per worker: EWMA of completions per worker-second, only
+      sampled while requests were backlogged, i.e. queued or held in a worker's
+      batching look-ahead (otherwise completions just mirror arrivals)
+    - Little's law: L = lambda * S requests are in service on average, with
+      S = 1 / mu worker-seconds per request, so L / target_utilization workers
+      keep headroom for bursts
+    - Plus enough capacity to clear the current backlog within the queue-time SLO
+    - Hysteresis: scale up at once (after up_cooldown_s); scale down one worker
+      at a time, only when there is no backlog, the target is at least
+      `down_band` below the current count, and down_cooldown_s has passed since
+      the last change
+    """
+
+    def __init__(
+        self,
+        target_utilization: float = 0.7,
+        queue_time_slo_s: float = 1.0,
+        horizon_s: float = 5.0,
+        initial_service_rate: float = 1.0,
+        service_alpha: float = 0.2,
+        up_cooldown_s: float = 5.0,
+        down_cooldown_s: float = 30.0,
+        down_band: int = 1,
+        forecaster: HoltForecaster = None,
+    ):
+        self.target_utilization = target_utilization
+        self.queue_time_slo_s = queue_time_slo_s
+        self.horizon_s = horizon_s
+        self.service_rate = initial_service_rate
+        self.service_alpha = service_alpha
+        self.up_cooldown_s = up_cooldown_s
+        self.down_cooldown_s = down_cooldown_s
+        self.down_band = down_band
+        self.arrival = forecaster or HoltForecaster()
+        self.last_up = -math.inf
+        self.last_change = -math.inf
+
+        # Last computed values, exported as gauges by the live autoscaler
+        self.forecast_rate = 0.0
+        self.target = 0
+
+    def required_workers(self, arrival_rate: float, queue_depth: int) -> float:
+        mu = max(self.service_rate, 1e-6)
+        in_service = arrival_rate / mu                      # Little's law: L = lambda * S
+        workers = in_service / self.target_utilization
+        workers += queue_depth / (mu * self.queue_time_slo_s)
+        return workers
+
+    def desired_workers(self, obs: ScalingObservation) -> int:
+        if obs.interval <= 0:
+            return obs.workers
+
+        self.arrival.update(obs.arrivals / obs.interval)
+        # queue_depth must include requests a worker's batching loop has pulled
+        # off its queue (Worker.queue_depth): those are waiting too, and
+        # counting only the queue reads a saturated worker as idle
+        backlog = obs.queue_depth
+        serving = obs.workers - obs.starting
+        if backlog > 0 and serving > 0 and obs.completions > 0:
+            sample = obs.completions / (obs.interval * serving)
+            self.service_rate += self.service_alpha * (sample - self.service_rate)
+
+        self.forecast_rate = self.arrival.forecast(self.horizon_s / obs.interval)
+        self.target = math.ceil(self.required_workers(self.forecast_rate, backlog))
+
+        if self.target > obs.workers:
+            if obs.now - self.last_up >= self.up_cooldown_s:
+                self.last_up = self.last_change = obs.now
+                return self.target
+            return obs.workers
+
+        if (
+            self.target <= obs.workers - self.down_band
+            and backlog == 0
+            and obs.now - self.last_change >= self.down_cooldown_s
+        ):
+            self.last_change = obs.now
+            return obs.workers - 1
+
+        return obs.workers
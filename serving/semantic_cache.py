@@ -0,0 +1,347 @@
+# serving/semantic_cache.py
+import asyncio
+import re
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+from prometheus_client import Gauge, Histogram
+
+from metrics import CACHE_TIER_HITS, CACHE_TIER_MISSES, cache_tier_lookup_histogram
+from serving.cache import InMemoryCache, make_key
+
+SEMANTIC_CACHE_SIZE = Gauge("llm_semantic_cache_size", "Prompt embeddings held by the semantic cache tier")
+semantic_similarity_histogram = Histogram(
+    "llm_semantic_cache_similarity",
+    "Cosine similarity of the nearest cached prompt at lookup",
+    buckets=[0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.925, 0.95, 0.975, 0.99, 1.0]
+)
+
+
+# -----------------------------
+# Encoders: text -> L2-normalized float32 vectors
+# -----------------------------
+class HashingEncoder:
+    """
+    Feature-hashed character n-grams and words of the normalized prompt.
+    Case, punctuation and whitespace differences vanish in normalization, and
+    small edits change few n-grams, so near-duplicates land close together.
+    Microseconds per prompt on CPU and no model weights.
+    """
+
+    _strip = re.compile(r"[^\w\s]")
+    _space = re.compile(r"\s+")
+
+    def __init__(self, dim: int = 512, ngram: int = 3):
+        self.dim = dim
+        self.ngram = ngram
+
+    def _features(self, text: str):
+        text = self._space.sub(" ", self._strip.sub(" ", text.lower())).strip()
+        padded = f" {text} "
+        for i in range(len(padded) - self.ngram + 1):
+            yield padded[i:i + self.ngram]
+        for word in text.split():
+            yield "w:" + word
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode())
+                # Signed hashing: collisions cancel out instead of piling up
+                out[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.maximum(norms, 1e-12)
+
+
+class ModelEncoder:
+    """
+    Mean-pooled last hidden state of the already-loaded model (no LM head).
+    Closer to meaning than HashingEncoder, but costs a forward pass over the
+    prompt, so SemanticCache runs it on an executor thread.
+    """
+
+    def __init__(self, model, tokenizer, max_tokens: int = 128):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.dim = model.config.hidden_size
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        import torch
+
+        inputs = self.tokenizer(
+            texts, return_tensors="pt", padding=True, truncation=True, max_length=self.max_tokens
+        ).to(self.model.device)
+        with torch.no_grad():
+            hidden = self.model.base_model(**inputs).last_hidden_state
+        mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        pooled = (hidden * mask).sum(1) / mask.sum(1).clamp(min=1)
+        pooled = torch.nn.functional.normalize(pooled.float(), dim=-1)
+        return pooled.cpu().numpy()
+
+
+# -----------------------------
+# Vector indexes (inner product on normalized vectors = cosine similarity)
+# -----------------------------
+class FlatIndex:
+    """
+    Brute force: one matrix-vector product over every stored vector.
+    Storage is preallocated for `capacity` vectors, so memory is fixed up front.
+    """
+
+    def __init__(self, dim: int, capacity: int):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.valid = np.zeros(capacity, dtype=bool)
+        self._free = list(range(capacity - 1, -1, -1))
+        self._high_water = 0  # slots >= this have never been used
+
+    def __len__(self):
+        return len(self.vectors) - len(self._free)
+
+    def add(self, vector: np.ndarray) -> int:
+        slot = self._free.pop()
+        self.vectors[slot] = vector
+        self.valid[slot] = True
+        self._high_water = max(self._high_water, slot + 1)
+        return slot
+
+    def remove(self, slot: int):
+        self.valid[slot] = False
+        self._free.append(slot)
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        if len(scores) > k:
+            best = np.argpartition(-scores, k)[:k]
+        else:
+            best = np.arange(len(scores))
+        return best[np.argsort(-scores[best])]
+
+    def search(self, query: np.ndarray, k: int = 4) -> List[Tuple[int, float]]:
+        # Score the used prefix in place (no gather copy) and mask out free slots
+        scores = self.vectors[:self._high_water] @ query
+        scores[~self.valid[:self._high_water]] = -np.inf
+        return [(int(i), float(scores[i])) for i in self._top_k(scores, k) if self.valid[i]]
+
+
+class IVFIndex(FlatIndex):
+    """
+    Inverted file: vectors are grouped under their nearest of `nlist` k-means
+    centroids, and a search only scans the `nprobe` closest groups.
+    Scans everything (like FlatIndex) until `train_size` vectors exist, then
+    trains; retrains whenever the index has grown 4x since the last training.
+    """
+
+    def __init__(self, dim: int, capacity: int, nlist: int = 64, nprobe: int = 8, train_size: int = 2048, seed: int = 0):
+        super().__init__(dim, capacity)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_size = train_size
+        self.centroids: Optional[np.ndarray] = None
+        self.assignment = np.full(capacity, -1, dtype=np.int64)  # centroid per slot, -1 if free
+        self._trained_at = 0
+        self._rng = np.random.default_rng(seed)
+
+    def _train(self, iterations: int = 10):
+        slots = np.flatnonzero(self.valid[:self._high_water])
+        data = self.vectors[slots]
+        centroids = data[self._rng.choice(len(data), self.nlist, replace=False)]
+        for _ in range(iterations):
+            labels = np.argmax(data @ centroids.T, axis=1)
+            for c in range(self.nlist):
+                members = data[labels == c]
+                if len(members):
+                    centroids[c] = members.sum(0)
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        self.centroids = centroids
+        self.assignment[slots] = np.argmax(data @ centroids.T, axis=1)
+        self._trained_at = len(slots)
+
+    def add(self, vector: np.ndarray) -> int:
+        slot = super().add(vector)
+        if self.centroids is not None:
+            self.assignment[slot] = int(np.argmax(self.centroids @ vector))
+        n = len(self)
+        if n >= self.train_size and n >= 4 * self._trained_at and n >= self.nlist:
+            self._train()
+        return slot
+
+    def remove(self, slot: int):
+        self.assignment[slot] = -1
+        super().remove(slot)
+
+    def search(self, query: np.ndarray, k: int = 4) -> List[Tuple[int, float]]:
+        if self.centroids is None:
+            return super().search(query, k)
+        probe = np.argpartition(-(self.centroids @ query), min(self.nprobe, self.nlist) - 1)[:self.nprobe]
+        slots = np.flatnonzero(np.isin(self.assignment[:self._high_water], probe))
+        scores = self.vectors[slots] @ query
+        return [(int(slots[i]), float(scores[i])) for i in self._top_k(scores, k)]
+
+
+INDEXES = {
+    "flat": FlatIndex,
+    "ivf": IVFIndex,
+}
+
+
+class SemanticCache:
+    """
+    Near-duplicate tier in front of the exact-match cache, with the same get/set interface.
+
+    - get: exact tiers first; on a miss, embed the prompt and return the output
+      cached for the most similar earlier prompt with the same max_new_tokens,
+      if its cosine similarity is at least `threshold` (get_many: the same for a
+      group of prompts, embedding all the exact misses at once)
+    - The index stores only embeddings and exact-cache keys; outputs stay in the
+      memory tier, and an entry is dropped from the index whenever the memory
+      tier evicts or expires its key, so the two tiers never disagree
+    - Bounded: at most max_entries embeddings (preallocated), least recently
+      matched dropped first
+    """
+
+    def __init__(
+        self,
+        exact,
+        memory: InMemoryCache,
+        encoder=None,
+        threshold: float = 0.92,
+        max_entries: int = 10_000,
+        index: str = "flat",
+        executor: Optional[Executor] = None,
+        top_k: int = 4,
+    ):
+        """
+        exact: the exact-match cache (InMemoryCache or TieredCache) consulted first
+        memory: the in-memory tier holding the outputs semantic hits return
+        encoder: HashingEncoder (default) or ModelEncoder
+        index: "flat" (brute force) or "ivf" (for large max_entries)
+        executor: run the encoder off the event loop (needed for ModelEncoder)
+        """
+        if index not in INDEXES:
+            raise ValueError(f"Unknown semantic index {index!r}, expected one of {sorted(INDEXES)}")
+        self.exact = exact
+        self.memory = memory
+        self.encoder = encoder or HashingEncoder()
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.executor = executor
+        self.top_k = top_k
+        self.index = INDEXES[index](self.encoder.dim, max_entries)
+        self._slots: "OrderedDict[Hashable, int]" = OrderedDict()  # key -> slot, in match order
+        self._keys: Dict[int, Hashable] = {}
+        memory.add_removal_listener(self._forget)
+
+    async def _encode(self, prompt: str) -> np.ndarray:
+        return (await self._encode_many([prompt]))[0]
+
+    async def _encode_many(self, prompts: List[str]) -> np.ndarray:
+        if self.executor is None:
+            return self.encoder.encode(prompts)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.encoder.encode, prompts)
+
+    async def get(self, prompt: str, max_new_tokens: int, variant: str = "") -> Optional[str]:
+        value = await self.exact.get(prompt, max_new_tokens, variant)
+        if value is not None or not self._slots:
+            return value
+
+        start = time.perf_counter()
+        value = await self.lookup(prompt, max_new_tokens, variant)
+        cache_tier_lookup_histogram.labels(tier="semantic").observe(time.perf_counter() - start)
+        if value is None:
+            CACHE_TIER_MISSES.labels(tier="semantic").inc()
+        else:
+            CACHE_TIER_HITS.labels(tier="semantic").inc()
+        return value
+
+    async def get_many(self, prompts: List[str], max_new_tokens: int, variant: str = "") -> List[Optional[str]]:
+        """
+        get() for several prompts with the same settings: the exact tiers' get_many,
+        then the prompts they missed embedded in one encoder call.
+        """
+        values = await self.exact.get_many(prompts, max_new_tokens, variant)
+        misses = [i for i, value in enumerate(values) if value is None]
+        if not misses or not self._slots:
+            return values
+
+        start = time.perf_counter()
+        queries = await self._encode_many([prompts[i] for i in misses])
+        for i, query in zip(misses, queries):
+            values[i] = await self._match(query, max_new_tokens, variant)
+        cache_tier_lookup_histogram.labels(tier="semantic").observe(time.perf_counter() - start)
+        hits = sum(values[i] is not None for i in misses)
+        CACHE_TIER_HITS.labels(tier="semantic").inc(hits)
+        CACHE_TIER_MISSES.labels(tier="semantic").inc(len(misses) - hits)
+        return values
+
+    async def lookup(self, prompt: str, max_new_tokens: int, variant: str = "") -> Optional[str]:
+        return await self._match(await self._encode(prompt), max_new_tokens, variant)
+
+    async def _match(self, query: np.ndarray, max_new_tokens: int, variant: str) -> Optional[str]:
+        matches = self.index.search(query, self.top_k)
+        if matches:
+            semantic_similarity_histogram.observe(matches[0][1])
+        for slot, score in matches:
+            if score < self.threshold:
+                break
+            key = self._keys[slot]
+            # Near-duplicate prompts only; the rest of the request must match exactly
+            if key[1:] != (max_new_tokens, variant):
+                continue
+            value = await self.memory.get(*key)
+            if value is None:
+                continue
+            self._slots.move_to_end(key)
+            return value
+        return None
+
+    async def set(self, prompt: str, max_new_tokens: int, value: str, variant: str = ""):
+        await self.exact.set(prompt, max_new_tokens, value, variant=variant)
+        key = make_key(prompt, max_new_tokens, variant)
+        # Only index outputs the memory tier actually kept (its admission filter may refuse)
+        if key in self._slots or not self.memory.contains(key):
+            return
+        vector = await self._encode(prompt)
+        self._add(key, vector)
+
+    def _add(self, key, vector: np.ndarray):
+        if key in self._slots or not self.memory.contains(key):
+            return
+        while len(self._slots) >= self.max_entries:
+            self._forget(next(iter(self._slots)))
+        slot = self.index.add(vector)
+        self._slots[key] = slot
+        self._keys[slot] = key
+        SEMANTIC_CACHE_SIZE.set(len(self._slots))
+
+    def _forget(self, key):
+        slot = self._slots.pop(key, None)
+        if slot is None:
+            return
+        del self._keys[slot]
+        self.index.remove(slot)
+        SEMANTIC_CACHE_SIZE.set(len(self._slots))
+
+    async def warm_start(self, *args, **kwargs) -> int:
+        """
+        Warm the exact tiers, then index whatever the memory tier now holds.
+        """
+        loaded = await self.exact.warm_start(*args, **kwargs) if hasattr(self.exact, "warm_start") else 0
+        keys = [k for k in self.memory.keys() if k not in self._slots][-self.max_entries:]
+        if keys:
+            vectors = await self._encode_many([k[0] for k in keys])
+            for key, vector in zip(keys, vectors):
+                self._add(key, vector)
+        return loaded
+
+    async def cleanup(self):
+        await self.exact.cleanup()
+
+    async def start_periodic_cleanup(self, interval_seconds: int = 60):
+        await self.exact.start_periodic_cleanup(interval_seconds)
@@ -0,0 +1,57 @@
+# serving/single_flight.py
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable
+
+from metrics import COALESCED_REQUESTS
+
+
+class SingleFlight:
+    """
+    In-flight request registry: identical concurrent requests share one execution.
+
+    - The first caller for a key starts the work as a separate task
+    - Later callers with the same key await that task instead of enqueueing
+    - Errors from the work are raised to every waiter
+    - A waiter being cancelled (e.g. client disconnect) only detaches that waiter;
+      the shared work is cancelled once no waiters are left
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[Hashable, int] = {}
+
+    def __len__(self):
+        return len(self._inflight)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable]):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda _: self._forget(key, task))
+        else:
+            COALESCED_REQUESTS.inc()
+
+        self._waiters[key] += 1
+        try:
+            # shield: cancelling this waiter must not cancel the shared task
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and self._waiters.get(key) == 1:
+                task.cancel()
+            raise
+        finally:
+            if self._inflight.get(key) is task:
+                self._waiters[key] -= 1
+
+    def _forget(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            del self._waiters[key]
+        # Consume the exception so an abandoned task doesn't log "never retrieved"
+        if not task.cancelled():
+            task.exception()
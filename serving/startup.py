@@ -0,0 +1,87 @@
+# serving/startup.py
+import asyncio
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence
+
+from logs import get_logger
+from metrics import STARTUP_PHASE_SECONDS, READY
+
+log = get_logger("startup")
+
+
+class StartupState:
+    """
+    Tracks the startup pipeline of one server process.
+
+    The process is live as soon as it serves HTTP; it is ready only once every
+    phase (imports, model load, workers, warm-up) has finished.
+    Phase durations are exported as llm_startup_phase_seconds{phase}.
+    """
+
+    def __init__(self):
+        self.phase = "starting"
+        self.ready = False
+        self.error: Optional[str] = None
+        self.timings: Dict[str, float] = {}
+        self._start = time.perf_counter()
+        READY.set(0)
+
+    @contextmanager
+    def track(self, phase: str):
+        self.phase = phase
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.phase = "failed"
+            self.error = f"{phase}: {e!r}"
+            raise
+        elapsed = time.perf_counter() - start
+        self.timings[phase] = elapsed
+        STARTUP_PHASE_SECONDS.labels(phase=phase).set(elapsed)
+        log.info("%s took %.2fs", phase, elapsed)
+
+    def mark_ready(self):
+        total = time.perf_counter() - self._start
+        self.timings["total"] = total
+        STARTUP_PHASE_SECONDS.labels(phase="total").set(total)
+        self.phase = "ready"
+        self.ready = True
+        READY.set(1)
+        log.info("Ready after %.2fs", total)
+
+
+def warm_up_prompts(batch_size: int, prompt_tokens: int) -> List[str]:
+    """
+    Distinct prompts of roughly prompt_tokens tokens. Each starts with a different
+    word, so they share no prefix-cache blocks and every one takes the full prefill path.
+    """
+    filler = " the" * max(0, prompt_tokens - 2)
+    return [f"warmup{i}{filler}" for i in range(batch_size)]
+
+
+async def warm_up(
+    workers,
+    batch_sizes: Sequence[int] = (1, 4, 8),
+    prompt_tokens: Sequence[int] = (16, 128),
+    max_new_tokens: int = 8,
+):
+    """
+    Run generations through every worker across representative batch shapes, so
+    lazy kernel initialization, allocator growth and torch.compile graph capture
+    happen before the first real request instead of during it.
+    Every worker is warmed concurrently, one batch at a time; their prefix caches
+    are cleared afterwards so warm-up prompts don't occupy them.
+    """
+    async def warm(worker):
+        for tokens in prompt_tokens:
+            for batch_size in batch_sizes:
+                await asyncio.gather(*[
+                    worker.handle_request(prompt, max_new_tokens)
+                    for prompt in warm_up_prompts(batch_size, tokens)
+                ])
+        if worker.prefix_cache is not None:
+            worker.prefix_cache.clear()
+
+    await asyncio.gather(*[warm(w) for w in workers])
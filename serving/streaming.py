@@ -0,0 +1,95 @@
+# serving/streaming.py
+import asyncio
+import json
+import time
+from typing import AsyncIterator, Optional, Sequence
+
+from batch_processor import STREAM_END
+from sampling import stop_prefix_length, truncate_at_stop
+from metrics import time_to_first_token_histogram, inter_token_latency_histogram
+
+
+class IncrementalDetokenizer:
+    """
+    Turns a stream of token ids into text deltas.
+    Only a small window of recent tokens is re-decoded per step, and text is held
+    back while it ends in an incomplete multi-byte character (U+FFFD).
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.token_ids = []
+        self.prefix_offset = 0  # start of the window re-decoded for context
+        self.read_offset = 0    # tokens before this are already emitted
+        self.started = False
+
+    def push(self, token_id: int) -> str:
+        self.token_ids.append(token_id)
+        prefix_text = self.tokenizer.decode(
+            self.token_ids[self.prefix_offset:self.read_offset], skip_special_tokens=True
+        )
+        new_text = self.tokenizer.decode(self.token_ids[self.prefix_offset:], skip_special_tokens=True)
+        if len(new_text) <= len(prefix_text) or new_text.endswith("\ufffd"):
+            return ""
+
+        delta = new_text[len(prefix_text):]
+        self.prefix_offset = self.read_offset
+        self.read_offset = len(self.token_ids)
+
+        # Match the non-streaming output, which strips leading newlines/spaces
+        if not self.started:
+            delta = delta.lstrip("\n ")
+            self.started = bool(delta)
+        return delta
+
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    """
+    Format one Server-Sent Event.
+    """
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+async def stream_tokens(
+    tokenizer, channel: asyncio.Queue, start_time: float, stop: Sequence[str] = ()
+) -> AsyncIterator[str]:
+    """
+    Drain a request's token channel and yield SSE text deltas.
+    Records time-to-first-token and inter-token latency.
+    start_time: time.perf_counter() when the request arrived
+    stop: the request's stop sequences; text that may be the start of one is
+    held back until it is decided, and nothing from a stop sequence on is sent
+    """
+    detokenizer = IncrementalDetokenizer(tokenizer)
+    last_token_time = None
+    held = ""      # possible start of a stop sequence, not sent yet
+    stopped = False
+    while True:
+        token_id = await channel.get()
+        if token_id is STREAM_END:
+            if held and not stopped:
+                yield sse_event({"text": held})
+            return
+
+        now = time.perf_counter()
+        if last_token_time is None:
+            time_to_first_token_histogram.observe(now - start_time)
+        else:
+            inter_token_latency_histogram.observe(now - last_token_time)
+        last_token_time = now
+
+        delta = detokenizer.push(token_id)
+        if stop and delta:
+            # Tokens decoded past the stop sequence still arrive; drop them
+            if stopped:
+                continue
+            text, stopped = truncate_at_stop(held + delta, stop)
+            if stopped:
+                # Like the final output, which is stripped at the stop sequence
+                text = text.rstrip()
+            keep = 0 if stopped else stop_prefix_length(text, stop)
+            held = text[len(text) - keep:]
+            delta = text[:len(text) - keep]
+        if delta:
+            yield sse_event({"text": delta})
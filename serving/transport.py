@@ -0,0 +1,397 @@
+# serving/transport.py
+# Front end <-> inference engine transport (serving/engine.py).
+#
+# Messages are binary frames: a (type, request id) header and a body of packed
+# fields, utf-8 text or a token id array, so nothing is pickled and token ids
+# cross as 4 bytes each. Two channels carry the same frames:
+# - ShmChannel: a pair of single-producer/single-consumer rings in POSIX shared
+#   memory, one per direction. A frame is copied into the ring by the sender and
+#   out by the receiver; no syscalls on the data path. The Unix socket used for
+#   the handshake stays open as a doorbell (a byte wakes a reader that parked on
+#   an empty ring) and for liveness: when it closes the peer is gone.
+# - SocketChannel: length-prefixed frames over the Unix socket itself; the
+#   fallback where /dev/shm is unavailable or small.
+
+import asyncio
+import json
+import math
+import struct
+import sys
+from array import array
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import List, Optional, Tuple, Union
+
+from sampling import DEFAULT_SAMPLING, SamplingParams
+
+TRANSPORTS = ("shm", "socket")
+
+# Frame types
+HELLO = 0    # handshake, JSON body (socket only)
+REQUEST = 1
+TOKENS = 2   # newly decoded token ids of a streaming request
+RESULT = 3   # final text; ends the request
+ERROR = 4    # RequestRejected on the engine side; ends the request
+CANCEL = 5   # front end no longer wants the result
+BATCH = 6    # a group of non-streaming requests with the same settings; one id each, from the header's up
+
+_LENGTH = struct.Struct("<I")
+_HEADER = struct.Struct("<BQ")        # frame type, request id
+_REQUEST = struct.Struct("<IBBd")     # max_new_tokens, priority, stream, timeout_s (NaN = engine default)
+# temperature, top_k, top_p, repetition_penalty, has seed, seed, stop sequence count;
+# each stop sequence follows as u16 length + utf-8, then the prompt
+_SAMPLING = struct.Struct("<dIddBQH")
+_STOP_LENGTH = struct.Struct("<H")
+_ERROR = struct.Struct("<Hd")         # HTTP status, retry_after
+_COUNT = struct.Struct("<I")          # BATCH: prompt count, then each prompt as u32 length + utf-8
+BATCH_PROMPT_OVERHEAD = _LENGTH.size  # bytes a BATCH frame spends per prompt besides its utf-8
+TOKEN_TYPECODE = "i"                  # int32; both ends are on the same host, so native byte order
+
+
+def encode_hello(info: dict) -> bytes:
+    return _HEADER.pack(HELLO, 0) + json.dumps(info).encode()
+
+
+def _encode_settings(
+    max_new_tokens: int, priority: int, stream: bool, timeout_s: Optional[float], sampling: Optional[SamplingParams]
+) -> bytes:
+    sampling = sampling or DEFAULT_SAMPLING
+    stop = [s.encode() for s in sampling.stop]
+    return b"".join([
+        _REQUEST.pack(max_new_tokens, priority, stream, math.nan if timeout_s is None else timeout_s),
+        _SAMPLING.pack(
+            sampling.temperature,
+            sampling.top_k,
+            sampling.top_p,
+            sampling.repetition_penalty,
+            sampling.seed is not None,
+            sampling.seed or 0,
+            len(stop),
+        ),
+        *(_STOP_LENGTH.pack(len(s)) + s for s in stop),
+    ])
+
+
+def encode_request(
+    request_id: int,
+    prompt: str,
+    max_new_tokens: int,
+    priority: int = 0,
+    stream: bool = False,
+    timeout_s: Optional[float] = None,
+    sampling: Optional[SamplingParams] = None,
+) -> bytes:
+    return b"".join([
+        _HEADER.pack(REQUEST, request_id),
+        _encode_settings(max_new_tokens, priority, stream, timeout_s, sampling),
+        prompt.encode(),
+    ])
+
+
+def encode_batch(
+    first_id: int,
+    prompts: List[Union[str, bytes]],
+    max_new_tokens: int,
+    priority: int = 0,
+    timeout_s: Optional[float] = None,
+    sampling: Optional[SamplingParams] = None,
+) -> bytes:
+    """
+    prompts[i] gets request id first_id + i; its RESULT/ERROR (or CANCEL) uses that id.
+    Prompts may be given already utf-8 encoded.
+    """
+    encoded = [p if isinstance(p, bytes) else p.encode() for p in prompts]
+    return b"".join([
+        _HEADER.pack(BATCH, first_id),
+        _encode_settings(max_new_tokens, priority, False, timeout_s, sampling),
+        _COUNT.pack(len(encoded)),
+        *(_LENGTH.pack(len(p)) + p for p in encoded),
+    ])
+
+
+def encode_tokens(request_id: int, token_ids: array) -> bytes:
+    return _HEADER.pack(TOKENS, request_id) + token_ids.tobytes()
+
+
+def encode_result(request_id: int, text: str) -> bytes:
+    return _HEADER.pack(RESULT, request_id) + text.encode()
+
+
+def encode_error(request_id: int, reason: str, status_code: int, retry_after: float) -> bytes:
+    return _HEADER.pack(ERROR, request_id) + _ERROR.pack(status_code, retry_after) + reason.encode()
+
+
+def encode_cancel(request_id: int) -> bytes:
+    return _HEADER.pack(CANCEL, request_id)
+
+
+def decode(frame: bytes) -> Tuple[int, int, memoryview]:
+    """
+    (frame type, request id, body)
+    """
+    kind, request_id = _HEADER.unpack_from(frame)
+    return kind, request_id, memoryview(frame)[_HEADER.size:]
+
+
+def decode_hello(body: memoryview) -> dict:
+    return json.loads(bytes(body))
+
+
+def _decode_settings(body: memoryview) -> Tuple[int, int, bool, Optional[float], SamplingParams, int]:
+    """
+    (max_new_tokens, priority, stream, timeout_s, sampling, offset of what follows)
+    """
+    max_new_tokens, priority, stream, timeout_s = _REQUEST.unpack_from(body)
+    temperature, top_k, top_p, repetition_penalty, has_seed, seed, n_stop = _SAMPLING.unpack_from(body, _REQUEST.size)
+    offset = _REQUEST.size + _SAMPLING.size
+    stop = []
+    for _ in range(n_stop):
+        (length,) = _STOP_LENGTH.unpack_from(body, offset)
+        offset += _STOP_LENGTH.size
+        stop.append(str(body[offset:offset + length], "utf-8"))
+        offset += length
+    sampling = SamplingParams(
+        temperature=temperature,
+        top_k=top_k,
+        top_p=top_p,
+        repetition_penalty=repetition_penalty,
+        seed=seed if has_seed else None,
+        stop=tuple(stop),
+    )
+    return max_new_tokens, priority, bool(stream), None if math.isnan(timeout_s) else timeout_s, sampling, offset
+
+
+def decode_request(body: memoryview) -> Tuple[str, int, int, bool, Optional[float], SamplingParams]:
+    """
+    (prompt, max_new_tokens, priority, stream, timeout_s, sampling)
+    """
+    max_new_tokens, priority, stream, timeout_s, sampling, offset = _decode_settings(body)
+    return str(body[offset:], "utf-8"), max_new_tokens, priority, stream, timeout_s, sampling
+
+
+def decode_batch(body: memoryview) -> Tuple[List[str], int, int, Optional[float], SamplingParams]:
+    """
+    (prompts, max_new_tokens, priority, timeout_s, sampling)
+    """
+    max_new_tokens, priority, _, timeout_s, sampling, offset = _decode_settings(body)
+    (count,) = _COUNT.unpack_from(body, offset)
+    offset += _COUNT.size
+    prompts = []
+    for _ in range(count):
+        (length,) = _LENGTH.unpack_from(body, offset)
+        offset += _LENGTH.size
+        prompts.append(str(body[offset:offset + length], "utf-8"))
+        offset += length
+    return prompts, max_new_tokens, priority, timeout_s, sampling
+
+
+def decode_tokens(body: memoryview) -> array:
+    token_ids = array(TOKEN_TYPECODE)
+    token_ids.frombytes(body)
+    return token_ids
+
+
+def decode_text(body: memoryview) -> str:
+    return str(body, "utf-8")
+
+
+def decode_error(body: memoryview) -> Tuple[str, int, float]:
+    """
+    (reason, status_code, retry_after)
+    """
+    status_code, retry_after = _ERROR.unpack_from(body)
+    return str(body[_ERROR.size:], "utf-8"), status_code, retry_after
+
+
+class ShmRing:
+    """
+    Single-producer/single-consumer byte ring in a shared memory segment.
+    Header: head (bytes consumed), tail (bytes published), the reader's parked
+    flag and the capacity. head and tail only grow; a position's offset in the
+    data area is pos % capacity, and frames (u32 length + bytes) wrap around it.
+    The writer publishes tail only after copying the frame in, so a reader never
+    sees a partial frame; this leans on the CPU keeping stores in order, as x86 does.
+    """
+
+    _HEAD = 0
+    _TAIL = 8
+    _PARKED = 16
+    _CAPACITY = 24
+    _DATA = 64  # header padded to a cache line
+
+    def __init__(self, name: Optional[str] = None, capacity: int = 1 << 20):
+        """
+        name: attach to an existing ring; None creates one (this process owns it and unlinks it on close)
+        """
+        self.owner = name is None
+        if self.owner:
+            self.shm = SharedMemory(create=True, size=self._DATA + capacity)
+            struct.pack_into("<QQIxxxxQ", self.shm.buf, 0, 0, 0, 0, capacity)
+        else:
+            self.shm = _attach(name)
+        self.name = self.shm.name
+        self.buf = self.shm.buf
+        (self.capacity,) = struct.unpack_from("<Q", self.buf, self._CAPACITY)
+
+    def _load(self, offset: int) -> int:
+        return struct.unpack_from("<Q", self.buf, offset)[0]
+
+    def _copy_in(self, pos: int, data):
+        start = pos % self.capacity
+        first = min(len(data), self.capacity - start)
+        self.buf[self._DATA + start:self._DATA + start + first] = data[:first]
+        if first < len(data):
+            self.buf[self._DATA:self._DATA + len(data) - first] = data[first:]
+
+    def _copy_out(self, pos: int, n: int) -> bytes:
+        start = pos % self.capacity
+        first = min(n, self.capacity - start)
+        data = bytes(self.buf[self._DATA + start:self._DATA + start + first])
+        if first < n:
+            data += bytes(self.buf[self._DATA:self._DATA + n - first])
+        return data
+
+    def try_write(self, frame: bytes) -> bool:
+        """
+        Append a frame; False if the ring doesn't have room for it yet.
+        """
+        n = _LENGTH.size + len(frame)
+        if n > self.capacity:
+            raise ValueError(f"Frame of {len(frame)} bytes does not fit a {self.capacity} byte ring")
+        tail = self._load(self._TAIL)
+        if tail + n - self._load(self._HEAD) > self.capacity:
+            return False
+        self._copy_in(tail, _LENGTH.pack(len(frame)))
+        self._copy_in(tail + _LENGTH.size, memoryview(frame))
+        struct.pack_into("<Q", self.buf, self._TAIL, tail + n)
+        return True
+
+    def try_read(self) -> Optional[bytes]:
+        """
+        Take the oldest frame, or None if the ring is empty.
+        """
+        head = self._load(self._HEAD)
+        if head == self._load(self._TAIL):
+            return None
+        (length,) = _LENGTH.unpack(self._copy_out(head, _LENGTH.size))
+        frame = self._copy_out(head + _LENGTH.size, length)
+        struct.pack_into("<Q", self.buf, self._HEAD, head + _LENGTH.size + length)
+        return frame
+
+    @property
+    def parked(self) -> bool:
+        return bool(struct.unpack_from("<I", self.buf, self._PARKED)[0])
+
+    @parked.setter
+    def parked(self, value: bool):
+        struct.pack_into("<I", self.buf, self._PARKED, int(value))
+
+    def close(self):
+        # Views of the segment must be released before it can be unmapped
+        self.buf.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _attach(name: str) -> SharedMemory:
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)
+    # Before 3.13 attaching registers the segment with this process's resource
+    # tracker, which would unlink it (under the owner) when this process exits
+    shm = SharedMemory(name=name)
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+class SocketChannel:
+    """
+    Length-prefixed frames over a stream socket.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    async def send(self, frame: bytes):
+        self.writer.write(_LENGTH.pack(len(frame)) + frame)
+        await self.writer.drain()
+
+    async def recv(self) -> bytes:
+        """
+        Next frame; raises ConnectionError once the peer has gone.
+        """
+        try:
+            (length,) = _LENGTH.unpack(await self.reader.readexactly(_LENGTH.size))
+            return await self.reader.readexactly(length)
+        except asyncio.IncompleteReadError:
+            raise ConnectionError("peer closed the connection")
+
+    def close(self):
+        self.writer.close()
+
+
+class ShmChannel:
+    """
+    Frames over two ShmRings, with the socket as doorbell. A reader that finds
+    its ring empty sets the ring's parked flag and waits on the socket; a writer
+    that sees the flag clears it and sends one byte. Under load the rings are
+    rarely empty and no doorbell is rung. The wait is capped at max_park_s, so a
+    wake-up lost to the flag race costs at most that much latency.
+    """
+
+    def __init__(
+        self,
+        send_ring: ShmRing,
+        recv_ring: ShmRing,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        max_park_s: float = 0.01,
+    ):
+        self.send_ring = send_ring
+        self.recv_ring = recv_ring
+        self.reader = reader
+        self.writer = writer
+        self.max_park_s = max_park_s
+        self.closed = False
+
+    async def send(self, frame: bytes):
+        # Ring full: the reader is behind; back off until it catches up
+        delay = 0.0
+        while True:
+            if self.closed or self.writer.is_closing():
+                raise ConnectionError("peer closed the connection")
+            if self.send_ring.try_write(frame):
+                break
+            await asyncio.sleep(delay)
+            delay = min(max(2 * delay, 1e-5), 1e-3)
+        if self.send_ring.parked:
+            self.send_ring.parked = False
+            self.writer.write(b"\x00")
+
+    async def recv(self) -> bytes:
+        """
+        Next frame; raises ConnectionError once the peer has gone.
+        """
+        while True:
+            frame = self.recv_ring.try_read()
+            if frame is not None:
+                return frame
+            self.recv_ring.parked = True
+            # A frame published before the flag was seen would not ring the doorbell
+            frame = self.recv_ring.try_read()
+            if frame is not None:
+                self.recv_ring.parked = False
+                return frame
+            try:
+                data = await asyncio.wait_for(self.reader.read(4096), self.max_park_s)
+            except asyncio.TimeoutError:
+                continue
+            if not data:
+                raise ConnectionError("peer closed the connection")
+
+    def close(self):
+        self.closed = True
+        self.writer.close()
+        self.send_ring.close()
+        self.recv_ring.close()
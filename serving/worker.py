@@ -1,23 +1,143 @@
 # serving/worker.py
 import asyncio
-import torch
-from batch_processor import enqueue_request
+import copy
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from batch_processor import enqueue_request, MAX_QUEUE_SIZE, PRIORITY_INTERACTIVE
 from metrics import WORKER_REQUEST_COUNTER
+from prefix_cache import PrefixCache
+from sampling import SamplingParams
+from scheduler import continuous_batch_worker, continuous_batcher
+
+
+def _set_torch_threads(num_threads: int):
+    # Imported here, on the inference thread, so a synthetic-backend worker never loads torch
+    import torch
+
+    torch.set_num_threads(num_threads)
+
 
 class Worker:
-    def __init__(self, model, tokenizer, worker_id):
-        self.model = model
-        self.tokenizer = tokenizer
+    """
+    One execution unit: its own request queue, continuous batching loop and
+    inference thread (plus its own prefix cache, and optionally its own model copy).
+    The model side is an inference backend (backends.InferenceBackend).
+
+    The batching loop runs as a task on the server's event loop, but every
+    model step runs on this worker's dedicated thread, so N workers keep up
+    to N forward passes in flight at once (torch releases the GIL while computing).
+    """
+
+    def __init__(
+        self,
+        backend,
+        worker_id,
+        max_batch_size: int = 8,
+        controller=None,
+        prefix_cache_bytes: Optional[int] = 256 * 1024 * 1024,
+        threads_per_worker: Optional[int] = None,
+        copy_model: bool = False,
+        max_queue_size: int = MAX_QUEUE_SIZE,
+        kv_budget_bytes: Optional[int] = None,
+        preemption: Optional[str] = "recompute",
+    ):
+        """
+        threads_per_worker: torch intra-op threads for this worker's inference
+            thread; set to cores // workers so replicas don't oversubscribe the CPU
+        copy_model: give the worker its own copy of the backend (and its weights)
+            instead of sharing it read-only with the other workers
+        max_queue_size: requests that may wait on this worker; beyond that
+            handle_request raises RequestRejected instead of queueing
+        kv_budget_bytes / preemption: KV memory bound of the worker's batch and how
+            running bulk requests give way to interactive ones (scheduler.ContinuousBatchScheduler)
+        """
+        self.backend = copy.deepcopy(backend) if copy_model else backend
         self.worker_id = str(worker_id)
+        self.max_batch_size = max_batch_size
+        self.controller = controller
+        self.prefix_cache = PrefixCache(max_bytes=prefix_cache_bytes) if prefix_cache_bytes else None
+        self.kv_budget_bytes = kv_budget_bytes
+        self.preemption = preemption
 
-    async def handle_request(self, prompt: str, max_new_tokens: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        # The batching loop's look-ahead: requests taken off the queue but not yet running
+        self.batcher = continuous_batcher(max_batch_size, controller)
+        self.executor = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix=f"worker-{self.worker_id}",
+            initializer=_set_torch_threads if threads_per_worker else None,
+            initargs=(threads_per_worker,) if threads_per_worker else (),
+        )
+        self.in_flight = 0
+        # Cumulative counts, read by the autoscaler to estimate arrival/service rates
+        self.accepted = 0
+        self.completed = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(
+            continuous_batch_worker(
+                backend=self.backend,
+                max_batch_size=self.max_batch_size,
+                prefix_cache=self.prefix_cache,
+                executor=self.executor,
+                controller=self.controller,
+                queue=self.queue,
+                batcher=self.batcher,
+                kv_budget_bytes=self.kv_budget_bytes,
+                preemption=self.preemption,
+            )
+        )
+
+    def queue_depth(self) -> int:
+        """
+        Requests accepted but not running yet: still on the queue, or already
+        pulled into the batching loop's look-ahead (up to 4x max_batch_size).
+        """
+        return self.queue.qsize() + len(self.batcher)
+
+    async def handle_request(
+        self,
+        prompt: str,
+        max_new_tokens: int,
+        stream=None,
+        deadline: Optional[float] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        sampling: Optional[SamplingParams] = None,
+    ):
         """
         Called by load balancer.
-        Checks cache via batch_processor queue.
-        Returns generated text.
+        Enqueues onto this worker's own queue and returns generated text.
         """
         # Increment the global counter with the worker_id label
         WORKER_REQUEST_COUNTER.labels(worker_id=self.worker_id).inc()
-        # In current system, enqueue_request handles batching
-        result = await enqueue_request(prompt, max_new_tokens)
-        return result
+        self.in_flight += 1
+        self.accepted += 1
+        try:
+            return await enqueue_request(
+                prompt,
+                max_new_tokens,
+                stream=stream,
+                queue=self.queue,
+                deadline=deadline,
+                priority=priority,
+                sampling=sampling,
+            )
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+
+    async def drain(self, poll_interval: float = 0.05):
+        """
+        Graceful shutdown: wait for every accepted request to finish, then stop
+        the batching loop and release the inference thread.
+        The worker must already be unregistered from the load balancer.
+        """
+        while self.in_flight:
+            await asyncio.sleep(poll_interval)
+        if self.task is not None:
+            self.task.cancel()
+        self.executor.shutdown(wait=False)
+        if self.prefix_cache is not None:
+            self.prefix_cache.clear()
@@ -0,0 +1,62 @@
+# speculative.py
+# Speculative decoding. A small draft model proposes k tokens per sequence and
+# the target model scores all of them in one forward pass. Each draft token is
+# accepted with probability min(1, p(x) / q(x)) (p target, q draft); the first
+# rejected position is resampled from the residual max(0, p - q), and if every
+# draft token is accepted a bonus token is sampled from the target. The output
+# has exactly the target's sampling distribution, at 1..k+1 tokens per target pass.
+
+from typing import Optional, Tuple
+
+import torch
+
+from backends.sampling import sample_from
+
+
+def verify_draft(
+    target_probs: torch.Tensor,
+    draft_probs: torch.Tensor,
+    draft_tokens: torch.Tensor,
+    accept_u: Optional[torch.Tensor] = None,
+    sample_u: Optional[torch.Tensor] = None,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Rejection-sample a batch of drafts against the target.
+    target_probs: [batch, k + 1, vocab], target distribution after each of
+        (last token, draft token 1, ..., draft token k)
+    draft_probs: [batch, k, vocab], distribution each draft token was sampled from
+    draft_tokens: [batch, k]
+    accept_u, sample_u: uniforms [batch, k] for the accept tests and [batch]
+        for the resampled token, or [batch, k + 1] to use column j when j
+        drafts are accepted (backends.sampling.uniforms, for reproducible
+        seeded rows); drawn from torch's generator when omitted
+    Returns (accepted [batch], next_token [batch]): each row keeps its first
+    accepted draft tokens, then next_token (resampled or bonus).
+    """
+    batch, k = draft_tokens.shape
+    index = draft_tokens.unsqueeze(-1)
+    p = target_probs[:, :k].gather(-1, index).squeeze(-1)
+    q = draft_probs.gather(-1, index).squeeze(-1)
+
+    # q > 0 for every sampled token; accept while u < p / q
+    if accept_u is None:
+        accept_u = torch.rand_like(p)
+    accept = accept_u.to(p.dtype) * q < p
+    accepted = accept.long().cumprod(dim=1).sum(dim=1)
+
+    # Residual at the first rejected position; with no rejection q is taken as 0,
+    # so the "residual" is the target's own distribution for the bonus token
+    rows = torch.arange(batch, device=draft_tokens.device)
+    padded_draft = torch.cat([draft_probs, draft_probs.new_zeros((batch, 1, draft_probs.shape[-1]))], dim=1)
+    p_at = target_probs[rows, accepted]
+    residual = (p_at - padded_draft[rows, accepted]).clamp(min=0)
+    total = residual.sum(dim=-1, keepdim=True)
+    # p == q exactly leaves no residual mass; any sample from p is then correct
+    residual = torch.where(total > 0, residual / total.clamp(min=1e-12), p_at)
+    if sample_u is None:
+        next_token = torch.multinomial(residual, num_samples=1).squeeze(-1)
+    else:
+        if sample_u.dim() == 2:
+            sample_u = sample_u.gather(1, accepted[:, None]).squeeze(1)
+        next_token = sample_from(residual, sample_u)
+    return accepted, next_token
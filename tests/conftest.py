@@ -0,0 +1,85 @@
+# tests/conftest.py
+# Shared fixtures: a tiny randomly initialised GPT-2 with a byte-level
+# tokenizer built in memory, so HFBackend can be tested on CPU in a second,
+# with no model download.
+
+import asyncio
+import os
+import sys
+from typing import List, Optional
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backends.synthetic import LatencyModel, SyntheticBackend  # noqa: E402
+from batch_processor import GenerationRequest, PRIORITY_INTERACTIVE  # noqa: E402
+from sampling import DEFAULT_SAMPLING, SamplingParams  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def tiny_hf():
+    torch = pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+    from transformers.models.gpt2.tokenization_gpt2 import bytes_to_unicode
+
+    from backends.hf import HFBackend
+
+    # One token per byte plus EOS. The model's vocabulary stops short of EOS,
+    # so like SyntheticBackend it never ends a request before max_new_tokens
+    chars = bytes_to_unicode()
+    vocab = {chars[b]: b for b in range(256)}
+    vocab["<|endoftext|>"] = 256
+    tok = Tokenizer(models.BPE(vocab=vocab, merges=[]))
+    tok.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tok.decoder = decoders.ByteLevel()
+    tokenizer = transformers.PreTrainedTokenizerFast(
+        tokenizer_object=tok, eos_token="<|endoftext|>", pad_token=chars[0]
+    )
+
+    torch.manual_seed(0)
+    config = transformers.GPT2Config(vocab_size=256, n_positions=128, n_embd=32, n_layer=2, n_head=2)
+    model = transformers.GPT2LMHeadModel(config).eval()
+    return HFBackend(model, tokenizer)
+
+
+@pytest.fixture(params=["synthetic", "hf"])
+def backend(request):
+    """
+    Each test using it runs on SyntheticBackend (zero latency) and on tiny_hf.
+    """
+    if request.param == "synthetic":
+        return SyntheticBackend(LatencyModel(step_ms=0, prefill_token_us=0, decode_token_us=0))
+    return request.getfixturevalue("tiny_hf")
+
+
+def make_request(
+    prompt: str,
+    max_new_tokens: int,
+    sampling: SamplingParams = DEFAULT_SAMPLING,
+    priority: int = PRIORITY_INTERACTIVE,
+) -> GenerationRequest:
+    """
+    A request as enqueue_request builds it; call from inside a running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return GenerationRequest(
+        prompt=prompt,
+        max_new_tokens=max_new_tokens,
+        future=loop.create_future(),
+        enqueue_time=loop.time(),
+        priority=priority,
+        sampling=sampling,
+    )
+
+
+async def drain(scheduler, requests: Optional[List[GenerationRequest]] = None) -> List[str]:
+    """
+    Step the scheduler (on this thread) until it is idle; returns the
+    requests' results, in order.
+    """
+    while scheduler.has_work():
+        scheduler.step()
+        scheduler.deliver()
+    return [r.future.result() for r in requests or []]
@@ -0,0 +1,136 @@
+# tests/test_preemption.py
+# ContinuousBatchScheduler preemption and KV budget: a bulk sequence paused
+# for an interactive one, by swapping its KV out or by recomputing it,
+# finishes with exactly the output it gets when it is never preempted.
+
+import asyncio
+
+import pytest
+from prometheus_client import REGISTRY
+
+from batch_processor import PRIORITY_BULK, PRIORITY_INTERACTIVE, RequestRejected
+from conftest import drain, make_request
+from sampling import SamplingParams
+from scheduler import ContinuousBatchScheduler
+
+BULK = [
+    ("first bulk prompt", SamplingParams(temperature=0)),
+    ("second, seeded", SamplingParams(temperature=1.0, top_k=0, seed=11)),
+]
+INTERACTIVE = ("urgent", SamplingParams(temperature=0.7, seed=5))
+BULK_TOKENS, INTERACTIVE_TOKENS = 12, 6
+
+
+def preemptions(mode: str) -> float:
+    return REGISTRY.get_sample_value("llm_preemptions_total", {"mode": mode}) or 0.0
+
+
+def kv_gauge() -> dict:
+    return {kind: REGISTRY.get_sample_value("llm_kv_cache_bytes", {"kind": kind}) or 0.0 for kind in ("used", "reserved")}
+
+
+def bulk_budget(backend) -> int:
+    """
+    KV bytes that hold both bulk requests at full length, but not a third
+    sequence; the interactive one (shorter) fits in place of either.
+    """
+    lengths = [len(ids) + BULK_TOKENS for ids in backend.tokenize([p for p, _ in BULK])]
+    return backend.kv_bytes(lengths)
+
+
+def run(backend, preemption, max_batch_size, kv_budget_bytes=None):
+    """
+    Two bulk requests run for a few steps, then an interactive one arrives.
+    With max_batch_size=2, or kv_budget_bytes=bulk_budget(), it can only
+    start by preempting a bulk one.
+    """
+    async def main():
+        scheduler = ContinuousBatchScheduler(
+            backend, max_batch_size=max_batch_size, kv_budget_bytes=kv_budget_bytes, preemption=preemption
+        )
+        requests = [make_request(p, BULK_TOKENS, s, priority=PRIORITY_BULK) for p, s in BULK]
+        for req in requests:
+            scheduler.add_request(req)
+        for _ in range(4):
+            scheduler.step()
+            scheduler.deliver()
+        urgent = make_request(INTERACTIVE[0], INTERACTIVE_TOKENS, INTERACTIVE[1], priority=PRIORITY_INTERACTIVE)
+        scheduler.add_request(urgent)
+        scheduler.step()
+        # The interactive request is running at once, not waiting for a bulk one to finish
+        assert urgent in [s.request for s in scheduler.running]
+        return await drain(scheduler, requests + [urgent])
+
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize("mode", ["swap", "recompute"])
+def test_preempted_outputs_match_unpreempted(backend, mode):
+    expected = run(backend, None, max_batch_size=3)
+    before = preemptions(mode)
+    assert run(backend, mode, max_batch_size=2) == expected
+    assert preemptions(mode) == before + 1
+
+
+@pytest.mark.parametrize("mode", ["swap", "recompute"])
+def test_kv_budget_preempts_running_bulk(backend, mode):
+    expected = run(backend, None, max_batch_size=3)
+    before = preemptions(mode)
+    assert run(backend, mode, max_batch_size=8, kv_budget_bytes=bulk_budget(backend)) == expected
+    assert preemptions(mode) == before + 1
+
+
+def test_no_preemption_waits(backend):
+    async def main():
+        scheduler = ContinuousBatchScheduler(backend, max_batch_size=2, preemption=None)
+        for p, s in BULK:
+            scheduler.add_request(make_request(p, BULK_TOKENS, s, priority=PRIORITY_BULK))
+        scheduler.step()
+        urgent = make_request(INTERACTIVE[0], INTERACTIVE_TOKENS, INTERACTIVE[1])
+        scheduler.add_request(urgent)
+        scheduler.step()
+        assert urgent not in [s.request for s in scheduler.running]
+        await drain(scheduler)
+        return urgent.future.result()
+
+    assert asyncio.run(main()) == run(backend, None, max_batch_size=3)[-1]
+
+
+def test_request_over_kv_budget_is_refused(backend):
+    async def main():
+        budget = bulk_budget(backend)
+        scheduler = ContinuousBatchScheduler(backend, max_batch_size=8, kv_budget_bytes=budget)
+        # Fits alone; the other could never fit, even in an empty batch
+        fits = make_request(INTERACTIVE[0], INTERACTIVE_TOKENS, INTERACTIVE[1])
+        too_big = make_request(BULK[0][0], 100, BULK[0][1])
+        scheduler.add_request(fits)
+        scheduler.add_request(too_big)
+        await drain(scheduler)
+        return fits.future.result(), too_big.future.exception()
+
+    output, error = asyncio.run(main())
+    assert output
+    assert isinstance(error, RequestRejected)
+    assert error.status_code == 413
+    assert error.reason == "kv_budget_exceeded"
+
+
+def test_kv_gauge_returns_to_zero_after_draining(backend):
+    before = kv_gauge()
+
+    async def main():
+        scheduler = ContinuousBatchScheduler(
+            backend, max_batch_size=8, kv_budget_bytes=bulk_budget(backend), preemption="swap"
+        )
+        for p, s in BULK:
+            scheduler.add_request(make_request(p, BULK_TOKENS, s, priority=PRIORITY_BULK))
+        scheduler.step()
+        during = kv_gauge()
+        scheduler.add_request(make_request(INTERACTIVE[0], INTERACTIVE_TOKENS, INTERACTIVE[1]))
+        await drain(scheduler)
+        return during
+
+    during = asyncio.run(main())
+    assert during["reserved"] - before["reserved"] == bulk_budget(backend)
+    assert during["used"] > before["used"]
+    assert kv_gauge() == before
@@ -0,0 +1,74 @@
+# tests/test_sampling.py
+# Per-row sampling (sampling.SamplingParams, backends/sampling.py): a seeded
+# request gets the same output whatever it is batched with, and greedy rows
+# are plain argmax decoding.
+
+import asyncio
+
+import pytest
+
+from conftest import drain, make_request
+from sampling import SamplingParams
+from scheduler import ContinuousBatchScheduler
+
+SEEDED = SamplingParams(temperature=1.0, top_k=0, seed=7)
+GREEDY = SamplingParams(temperature=0)
+# Companions with other settings, prompt lengths and budgets
+OTHERS = [
+    ("x", GREEDY),
+    ("a much longer prompt than the others", SamplingParams(temperature=0.5, top_k=20, seed=1)),
+    ("unseeded", SamplingParams(temperature=1.3, top_p=0.9)),
+    ("penalised", SamplingParams(temperature=0.8, repetition_penalty=1.5, seed=3)),
+]
+PROMPT = "hello world"
+
+
+def test_seeded_output_independent_of_static_batch(backend):
+    alone = backend.generate([PROMPT], 12, [SEEDED])[1][0]
+    for n in range(1, len(OTHERS) + 1):
+        prompts = [p for p, _ in OTHERS[:n]] + [PROMPT]
+        params = [s for _, s in OTHERS[:n]] + [SEEDED]
+        assert backend.generate(prompts, 12, params)[1][-1] == alone
+
+
+def test_seeded_output_independent_of_continuous_batch(backend):
+    async def run(companions):
+        scheduler = ContinuousBatchScheduler(backend, max_batch_size=8)
+        # Companions run for a few steps first, so the seeded row joins mid-batch
+        for prompt, sampling in companions:
+            scheduler.add_request(make_request(prompt, 10, sampling))
+        for _ in range(3):
+            scheduler.step()
+        req = make_request(PROMPT, 12, SEEDED)
+        scheduler.add_request(req)
+        return (await drain(scheduler, [req]))[0]
+
+    alone = asyncio.run(run([]))
+    assert asyncio.run(run(OTHERS)) == alone
+    assert asyncio.run(run(OTHERS[1:3])) == alone
+
+
+def test_different_seeds_differ(backend):
+    params = [SEEDED, SamplingParams(temperature=1.0, top_k=0, seed=8)]
+    a, b = backend.generate([PROMPT, PROMPT], 12, params)[1]
+    assert a != b
+
+
+def test_greedy_rows_are_argmax(tiny_hf):
+    torch = pytest.importorskip("torch")
+
+    def argmax_decode(prompt, max_new_tokens):
+        ids = tiny_hf.tokenize([prompt])[0]
+        out = []
+        with torch.no_grad():
+            for _ in range(max_new_tokens):
+                logits = tiny_hf.model(torch.tensor([ids + out])).logits
+                out.append(int(logits[0, -1].argmax()))
+        return out
+
+    prompts = [p for p, _ in OTHERS] + [PROMPT]
+    params = [SEEDED] * len(OTHERS) + [GREEDY]
+    params[0] = GREEDY  # "x", the shortest prompt: left-padded the most
+    generated = tiny_hf.generate(prompts, 10, params)[1]
+    assert generated[0] == argmax_decode(prompts[0], 10)
+    assert generated[-1] == argmax_decode(PROMPT, 10)
@@ -0,0 +1,44 @@
+# tests/test_speculative.py
+# Speculative decoding (speculative.py, HFBackend._speculative_step) samples
+# from exactly the target's distribution, repetition penalty included: with
+# the target as its own draft, seeded rows reproduce plain decoding token for
+# token, and greedy rows do so with any draft.
+
+import pytest
+
+from sampling import SamplingParams
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from backends.hf import HFBackend  # noqa: E402
+
+PROMPTS = ["first bulk prompt", "second, seeded", "hello hello", "x"]
+PARAMS = [
+    SamplingParams(temperature=0, repetition_penalty=1.5),
+    SamplingParams(temperature=1.0, top_k=0, repetition_penalty=1.3, seed=4),
+    SamplingParams(temperature=0.8, top_p=0.9, repetition_penalty=2.0, seed=9),
+    SamplingParams(temperature=0.7, seed=2),
+]
+
+
+@pytest.fixture(scope="module")
+def other_draft(tiny_hf):
+    # Same shape and tokenizer as the target, different weights
+    torch.manual_seed(1)
+    return transformers.GPT2LMHeadModel(tiny_hf.model.config).eval()
+
+
+@pytest.mark.parametrize("num_draft_tokens", [1, 3])
+def test_self_draft_reproduces_plain_decoding(tiny_hf, num_draft_tokens):
+    spec = HFBackend(tiny_hf.model, tiny_hf.tokenizer, draft_model=tiny_hf.model, num_draft_tokens=num_draft_tokens)
+    expected = tiny_hf.generate(PROMPTS, 16, PARAMS)[1]
+    assert spec.generate(PROMPTS, 16, PARAMS)[1] == expected
+
+
+def test_greedy_rows_with_penalty_match_plain_decoding(tiny_hf, other_draft):
+    spec = HFBackend(tiny_hf.model, tiny_hf.tokenizer, draft_model=other_draft, num_draft_tokens=3)
+    params = [SamplingParams(temperature=0, repetition_penalty=p) for p in (1.0, 1.5, 3.0)] + PARAMS[1:2]
+    prompts = PROMPTS[:3] + ["seeded row in the same batch"]
+    expected = tiny_hf.generate(prompts, 16, params)[1]
+    assert spec.generate(prompts, 16, params)[1][:3] == expected[:3]
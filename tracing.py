@@ -0,0 +1,187 @@
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from typing import List, Optional
+
+from metrics import phase_time_histogram
+
+# Phases of a request's life, in order. Batch-level phases (batch_form onwards)
+# cover every request in the batch and carry the batch size instead of a trace id.
+PHASES = (
+    "cache_lookup",  # app: memory/disk/semantic cache get
+    "lb_route",      # load balancer picking a worker
+    "queue_wait",    # enqueue to admission into a batch
+    "batch_form",    # forming the batch (static: the fill window)
+    "tokenize",
+    "prefill",
+    "decode",        # one decode step of the running batch
+    "preempt",       # pausing running sequences for more urgent ones (swap out / drop KV)
+    "swap_in",       # swapped-out sequences rejoining the batch
+    "detokenize",    # final text of retired sequences
+    "serialize",     # response body / final SSE event
+    "generate",      # static loop: one backend.generate call (tokenize to detokenize)
+)
+_PHASE_INDEX = {phase: i for i, phase in enumerate(PHASES)}
+
+# Span clock: monotonic nanoseconds, the same clock as the event loop's
+# loop.time() (seconds), so request timestamps can be used as span starts
+now = time.monotonic_ns
+
+# Trace id of the request the current task is serving (0 = none). asyncio tasks
+# copy it, so it follows a request from the endpoint into enqueue_request.
+current_trace_id = contextvars.ContextVar("trace_id", default=0)
+_trace_ids = itertools.count(1)
+
+
+def start_trace() -> int:
+    """
+    Give the current task a new trace id.
+    """
+    trace_id = next(_trace_ids)
+    current_trace_id.set(trace_id)
+    return trace_id
+
+
+def trace_id() -> int:
+    """
+    The current task's trace id, starting a trace if there is none.
+    """
+    return current_trace_id.get() or start_trace()
+
+
+class SpanRing:
+    """
+    Last `capacity` finished spans, in preallocated arrays: recording one is a
+    few array stores, no allocation, safe from any thread (slots come from an
+    itertools counter, which is atomic under the GIL). Every sample_every-th
+    span is also observed in llm_phase_seconds.
+    """
+
+    def __init__(self, capacity: int = 65536, sample_every: int = 4):
+        self.capacity = capacity
+        self.sample_every = sample_every
+        self.phase = array("B", bytes(capacity))
+        self.start = array("q", bytes(8 * capacity))
+        self.duration = array("q", bytes(8 * capacity))
+        self.trace_id = array("q", bytes(8 * capacity))
+        self.size = array("q", bytes(8 * capacity))
+        self.thread = array("Q", bytes(8 * capacity))
+        self._counter = itertools.count()
+        self._written = 0
+        # Resolve the label children once instead of per observation
+        self._histograms = [phase_time_histogram.labels(phase=p) for p in PHASES]
+
+    def record(self, phase: str, start_ns: int, end_ns: Optional[int] = None, trace_id: int = 0, size: int = 0):
+        """
+        start_ns/end_ns: tracing.now() timestamps (end defaults to now)
+        trace_id: the request's trace id, or 0 for batch-level spans
+        size: batch size for batch-level spans
+        """
+        if end_ns is None:
+            end_ns = now()
+        n = next(self._counter)
+        i = n % self.capacity
+        p = _PHASE_INDEX[phase]
+        self.phase[i] = p
+        self.start[i] = start_ns
+        self.duration[i] = end_ns - start_ns
+        self.trace_id[i] = trace_id
+        self.size[i] = size
+        self.thread[i] = threading.get_ident()
+        self._written = n + 1
+        if n % self.sample_every == 0:
+            self._histograms[p].observe((end_ns - start_ns) / 1e9)
+
+    @contextmanager
+    def span(self, phase: str, size: int = 0):
+        """
+        Time a block as a span of the current trace. Convenience for code off the
+        hot path; hot loops call record() with timestamps they already have.
+        """
+        start = now()
+        try:
+            yield
+        finally:
+            self.record(phase, start, trace_id=current_trace_id.get(), size=size)
+
+    def snapshot(self) -> List[tuple]:
+        """
+        (phase, start_ns, duration_ns, trace_id, size, thread) for every retained
+        span, oldest first. Spans recorded while copying may be torn; fine for a debug view.
+        """
+        written = self._written
+        first = max(0, written - self.capacity)
+        spans = []
+        for n in range(first, written):
+            i = n % self.capacity
+            spans.append((
+                PHASES[self.phase[i]], self.start[i], self.duration[i],
+                self.trace_id[i], self.size[i], self.thread[i],
+            ))
+        return spans
+
+    def chrome_trace(self) -> dict:
+        """
+        Chrome trace event format (chrome://tracing, ui.perfetto.dev): one
+        complete ("X") event per span on its thread's track.
+        """
+        pid = os.getpid()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in names.items()
+        ]
+        for phase, start, duration, tid, size, thread in self.snapshot():
+            args = {"trace_id": tid} if tid else {"batch_size": size}
+            events.append({
+                "name": phase, "cat": "request" if tid else "batch", "ph": "X",
+                "ts": start / 1000, "dur": duration / 1000, "pid": pid, "tid": thread, "args": args,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def otlp_trace(self, service_name: str = "llm-serving") -> dict:
+        """
+        OTLP/JSON (ExportTraceServiceRequest), for an OpenTelemetry collector's
+        file receiver or any OTLP/HTTP endpoint. Spans of one request share a
+        trace id; batch-level spans get a trace of their own.
+        """
+        # Monotonic span clock -> Unix time
+        offset = time.time_ns() - now()
+        spans = []
+        for n, (phase, start, duration, tid, size, thread) in enumerate(self.snapshot()):
+            attributes = [{"key": "thread.id", "value": {"intValue": str(thread)}}]
+            if not tid:
+                attributes.append({"key": "batch.size", "value": {"intValue": str(size)}})
+            spans.append({
+                "traceId": f"{tid or (1 << 63) + n:032x}",
+                "spanId": f"{n + 1:016x}",
+                "name": phase,
+                "kind": 1,  # SPAN_KIND_INTERNAL
+                "startTimeUnixNano": str(start + offset),
+                "endTimeUnixNano": str(start + duration + offset),
+                "attributes": attributes,
+            })
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": spans}],
+        }]}
+
+    def export(self, path: str, format: str = "chrome"):
+        """
+        Write the retained spans to a local file, "chrome" or "otlp" JSON.
+        """
+        data = self.chrome_trace() if format == "chrome" else self.otlp_trace()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+
+# Process-wide span buffer
+spans = SpanRing()